@@ -15,7 +15,11 @@ def main(args):
     define_ast(output_dir,
                "Expr",
                """
+               from typing import TYPE_CHECKING
                from oneliner.token import Token
+
+               if TYPE_CHECKING:
+                   from oneliner.klass import MethodCache, PropertyCache
                """,
                {
                    "Assign": [("name", "Token"), ("value", "Expr")],
@@ -52,6 +56,40 @@ def main(args):
                                 ("index", "Token"),
                                 ("bracket", "Token"),
                                 ("value", "Expr")],
+                   "Range": [("start", "Expr"),
+                             ("stop", "Expr"),
+                             ("step", "Expr"),
+                             ("operator", "Token")],
+               },
+               {
+                   "Assign": [("depth", "int | None"),
+                              ("slot", "int | None")],
+                   "Call": [("cache", '"MethodCache | None"')],
+                   "Function": [("slots", "dict[str, int] | None")],
+                   "Get": [("cache", '"PropertyCache | None"')],
+                   "Set": [("cache", '"PropertyCache | None"')],
+                   "Super": [("depth", "int | None"),
+                             ("slot", "int | None"),
+                             ("this_depth", "int | None"),
+                             ("cache", '"MethodCache | None"')],
+                   "This": [("depth", "int | None"),
+                            ("slot", "int | None")],
+                   "Variable": [("depth", "int | None"),
+                                ("slot", "int | None")],
+               },
+               {
+                   "Add": "Binary",
+                   "Subtract": "Binary",
+                   "Multiply": "Binary",
+                   "Divide": "Binary",
+                   "FloorDivide": "Binary",
+                   "Modulo": "Binary",
+                   "Greater": "Binary",
+                   "GreaterEqual": "Binary",
+                   "Less": "Binary",
+                   "LessEqual": "Binary",
+                   "Equal": "Binary",
+                   "NotEqual": "Binary",
                })
 
     define_ast(output_dir,
@@ -72,14 +110,33 @@ def main(args):
                           ("else_branch", "Stmt")],
                    "Return": [("keyword", "Token"), ("value", "Expr")],
                    "Var": [("name", "Token"), ("initializer", "Expr")],
-                   "While": [("condition", "Expr"), ("body", "Stmt")]
+                   "While": [("condition", "Expr"), ("body", "Stmt")],
+                   "ForIn": [("name", "Token"), ("iterable", "Expr"),
+                             ("body", "Stmt")],
+               },
+               {
+                   "Block": [("slots", "dict[str, int] | None")],
+                   "Function": [("slot", "int | None")],
+                   "Class": [("slot", "int | None")],
+                   "Return": [("tail", "bool | None")],
+                   "Var": [("slot", "int | None")],
+                   "ForIn": [("slots", "dict[str, int] | None"),
+                             ("slot", "int | None")],
                })
 
 
 def define_ast(output_dir,
                base_name,
                imports: str,
-               types: dict[str, list[tuple[str, str]]]):
+               types: dict[str, list[tuple[str, str]]],
+               attributes: dict[str, list[tuple[str, str]]] = {},
+               subtypes: dict[str, str] = {}):
+    """
+    typesはコンストラクタで受け取るフィールド、
+    attributesはResolverが後から設定する属性(初期値None)、
+    subtypesはtypesの型を継承してVisitorのメソッドだけを分けた型(演算子ごとのノード)。
+    Visitorで実装しなければ、継承元の型のメソッドが呼ばれる
+    """
     path = Path(output_dir) / (camel_to_snake(base_name) + ".py")
 
     type_list = [
@@ -88,7 +145,12 @@ def define_ast(output_dir,
          "fields": [
              {"name": name_type[0],
               "type": name_type[1]}
-             for name_type in values]}
+             for name_type in values],
+         "has_attributes": key in attributes,
+         "attributes": [
+             {"name": name_type[0],
+              "type": name_type[1]}
+             for name_type in attributes.get(key, [])]}
         for key, values in types.items()
     ]
 
@@ -96,17 +158,28 @@ def define_ast(output_dir,
         fields = t["fields"]
         fields[-1]["is_last"] = True
 
+    subtype_list = [
+        {"subclass_name": key,
+         "subclass_name_lc": camel_to_snake(key),
+         "parent_name": parent,
+         "parent_name_lc": camel_to_snake(parent)}
+        for key, parent in subtypes.items()
+    ]
+
     with open(path, "w", encoding="utf-8") as writer:
         with open(
             "resource/ast_class.mustache", "r", encoding="utf-8"
         ) as template:
-            writer.write(chevron.render(template, {
+            source = chevron.render(template, {
                 "base_name": base_name,
                 "base_name_lc": camel_to_snake(base_name),
                 "imports": textwrap.dedent(imports).strip(),
                 "types": type_list,
+                "subtypes": subtype_list,
 
-            }))
+            })
+            # テンプレートの末尾の空行は出力しない
+            writer.write(source.rstrip("\n") + "\n")
 
 
 if __name__ == "__main__":
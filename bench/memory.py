@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+"""
+インスタンス1個あたりのメモリ使用量を測る。
+
+フィールドを3つ持つクラス Human のインスタンスを count 個作り、
+作る前後の tracemalloc の確保量の差を count で割る。
+フィールドの値は全インスタンスで同じオブジェクトを使うので、
+インスタンス自身とフィールドの格納領域の大きさだけが数えられる。
+
+    python bench/memory.py
+    python bench/memory.py -e tree -e vm --count 200000
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from oneliner.error import ErrorReporter  # noqa: E402
+from oneliner.parser import Parser  # noqa: E402
+from oneliner.resolver import Resolver  # noqa: E402
+from oneliner.runner import ENGINES, load_engine  # noqa: E402
+from oneliner.scanner import Scanner  # noqa: E402
+
+PROGRAM = """
+class Human {
+    method init(name, age) {
+        this.name = name;
+        this.age = age;
+        this.alive = true;
+    }
+}
+"""
+
+
+def bytes_per_object(engine: str, count: int) -> float:
+    error_reporter = ErrorReporter()
+    tokens = Scanner(PROGRAM, error_reporter).scan_tokens()
+    statements = Parser(tokens, error_reporter).parse()
+    Resolver(error_reporter).resolve(statements)
+    interpreter = load_engine(engine)(error_reporter)
+    interpreter.interpret(statements)
+    klass = interpreter.globals.variables["Human"]
+    arguments = ["name", 20]
+
+    # 1個目で作られるもの(キャッシュなど)は数えない
+    objects = [klass.call(interpreter, arguments)] + [None] * count
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(1, count + 1):
+        objects[i] = klass.call(interpreter, arguments)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--engine", action="append",
+                        choices=list(ENGINES),
+                        help="engine to run (repeatable, default: all)")
+    parser.add_argument("--count", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{'engine':8} {'bytes/object':>12}")
+    for engine in args.engine or list(ENGINES):
+        print(f"{engine:8} {bytes_per_object(engine, args.count):12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+"""
+インタプリタのベンチマーク。
+
+bench/programs/*.1l の各プログラムと、Scanner/Parserのスループットを測る。
+ベンチマークとエンジンの組ごとに子プロセスを起動し、その中でウォームアップの後
+repeat 回実行して、中央値・標準偏差・ops/sec を表示する。
+1lのプログラムの ops は先頭の "# ops: N" コメントで指定する。
+
+    python bench/run.py                          # tree エンジンで全部
+    python bench/run.py -e tree -e closure -e vm # エンジンを並べて比較
+    python bench/run.py -k fib --repeat 10       # 名前で絞り込む
+    python bench/run.py --save bench/baseline.json
+    python bench/run.py --compare bench/baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCH = Path(__file__).resolve().parent
+ROOT = BENCH.parent
+PROGRAMS = BENCH / "programs"
+sys.path.insert(0, str(ROOT))
+
+from oneliner.error import ErrorReporter  # noqa: E402
+from oneliner.parser import Parser  # noqa: E402
+from oneliner.resolver import Resolver  # noqa: E402
+from oneliner.runner import ENGINES, load_engine  # noqa: E402
+from oneliner.scanner import Scanner  # noqa: E402
+
+# エンジンによらないフロントエンドのベンチマーク
+FRONTEND = ("scan", "parse")
+FRONTEND_SIZE = 300_000
+
+# 比較で遅くなったとみなす割合
+THRESHOLD = 0.10
+
+
+def program_names() -> list[str]:
+    return sorted(path.stem for path in PROGRAMS.glob("*.1l"))
+
+
+def read_ops(code: str) -> int:
+    if match := re.search(r"^# ops: (\d+)", code, re.MULTILINE):
+        return int(match.group(1))
+    return 1
+
+
+#
+# 子プロセス側
+#
+
+def parse(name: str, code: str, error_reporter: ErrorReporter):
+    tokens = Scanner(code, error_reporter).scan_tokens()
+    statements = Parser(tokens, error_reporter).parse()
+    Resolver(error_reporter).resolve(statements)
+    if error_reporter.has_error:
+        raise SystemExit(f"{name}: syntax error")
+    return statements
+
+
+def run_program(name: str, engine: str, warmup: int, repeat: int) -> dict:
+    code = (PROGRAMS / f"{name}.1l").read_text(encoding="utf-8")
+    error_reporter = ErrorReporter()
+    statements = parse(name, code, error_reporter)
+    interpreter = load_engine(engine)(error_reporter)
+
+    times = []
+    output = ""
+    for i in range(warmup + repeat):
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            start = time.perf_counter()
+            interpreter.interpret(statements)
+            elapsed = time.perf_counter() - start
+        if error_reporter.has_runtime_error:
+            raise SystemExit(f"{name}: {buffer.getvalue()}")
+        output = buffer.getvalue()
+        if i >= warmup:
+            times.append(elapsed)
+    return {"times": times, "ops": read_ops(code), "output": output}
+
+
+def run_frontend(name: str, warmup: int, repeat: int) -> dict:
+    sys.path.insert(0, str(BENCH))
+    from scanner_bench import synthetic_source
+    source = synthetic_source(FRONTEND_SIZE)
+    ops = len(Scanner(source, ErrorReporter()).scan_tokens())
+
+    times = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        tokens = Scanner(source, ErrorReporter()).scan_tokens()
+        if name == "parse":
+            with contextlib.redirect_stdout(io.StringIO()):
+                Parser(tokens, ErrorReporter()).parse()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return {"times": times, "ops": ops, "output": ""}
+
+
+def worker(args):
+    if args.worker in FRONTEND:
+        result = run_frontend(args.worker, args.warmup, args.repeat)
+    else:
+        result = run_program(args.worker, args.engine[0],
+                             args.warmup, args.repeat)
+    json.dump(result, sys.stdout)
+
+
+#
+# 親プロセス側
+#
+
+def measure(name: str, engine: str, args) -> dict:
+    command = [sys.executable, __file__, "--worker", name,
+               "-e", engine,
+               "--warmup", str(args.warmup),
+               "--repeat", str(args.repeat)]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise SystemExit(f"{name} [{engine}] failed:\n{process.stderr}")
+    result = json.loads(process.stdout)
+
+    times = result["times"]
+    median = statistics.median(times)
+    return {
+        "median": median,
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "ops_per_sec": result["ops"] / median,
+        "output": result["output"],
+    }
+
+
+def compare(name: str, engine: str, result: dict, baseline: dict) -> str:
+    previous = baseline.get("results", {}).get(name, {}).get(engine)
+    if previous is None:
+        return ""
+    ratio = result["median"] / previous["median"]
+    mark = ""
+    if ratio > 1 + THRESHOLD:
+        mark = "  SLOWER"
+    elif ratio < 1 - THRESHOLD:
+        mark = "  faster"
+    return f"  x{ratio:5.2f} vs baseline{mark}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--engine", action="append",
+                        choices=list(ENGINES),
+                        help="engine to run (repeatable, default: tree)")
+    parser.add_argument("-k", "--filter", type=str, default="",
+                        help="run benchmarks whose name contains this")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", type=str,
+                        help="write the results as a JSON baseline")
+    parser.add_argument("--compare", type=str,
+                        help="compare with a JSON baseline")
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.engine = args.engine or ["tree"]
+
+    if args.worker:
+        worker(args)
+        return
+
+    baseline = {}
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+
+    names = [name for name in program_names() + list(FRONTEND)
+             if args.filter in name]
+    results: dict[str, dict[str, dict]] = {}
+    print(f"{'benchmark':12} {'engine':8} {'median':>10} {'stdev':>9}"
+          f" {'ops/sec':>12}")
+    for name in names:
+        engines = ["-"] if name in FRONTEND else args.engine
+        results[name] = {}
+        for engine in engines:
+            result = measure(name, "tree" if engine == "-" else engine, args)
+            results[name][engine] = result
+            print(f"{name:12} {engine:8}"
+                  f" {result['median'] * 1000:8.1f}ms"
+                  f" {result['stdev'] * 1000:7.1f}ms"
+                  f" {result['ops_per_sec']:12,.0f}"
+                  + compare(name, engine, result, baseline))
+
+        outputs = {result["output"] for result in results[name].values()}
+        if len(outputs) > 1:
+            print(f"warning: engines disagree on the output of {name}")
+
+    if args.save:
+        for engine_results in results.values():
+            for result in engine_results.values():
+                del result["output"]
+        data = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        Path(args.save).write_text(json.dumps(data, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
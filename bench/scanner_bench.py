@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+"""
+Scannerのスループットを測る。
+
+sample_code.1l などを繰り返して指定サイズの合成スクリプトを作り、
+スキャンにかかる時間の中央値と MB/s, tokens/s を表示する。
+--against に別の scanner.py を渡すと、同じ入力で比較する。
+
+    python bench/scanner_bench.py --size 1000000
+    git show HEAD~1:oneliner/scanner.py > /tmp/old_scanner.py
+    python bench/scanner_bench.py --against /tmp/old_scanner.py
+"""
+import argparse
+import importlib.util
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from oneliner.error import ErrorReporter  # noqa: E402
+from oneliner.scanner import Scanner  # noqa: E402
+
+SEEDS = ["sample_code.1l", "sample_code2.1l"]
+
+
+def synthetic_source(size: int) -> str:
+    seed = "\n".join((ROOT / name).read_text(encoding="utf-8")
+                     for name in SEEDS)
+    seed += '\n#{ block\ncomment }\nv s = "multi\nline"; %{ "k": 1.5 }\n'
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+def load_scanner(path: str):
+    spec = importlib.util.spec_from_file_location("other_scanner", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Scanner
+
+
+def measure(scanner_class, source: str, repeat: int):
+    times = []
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = scanner_class(source, ErrorReporter()).scan_tokens()
+        times.append(time.perf_counter() - start)
+        count = len(tokens)
+    return statistics.median(times), count
+
+
+def report(label: str, seconds: float, count: int, size: int):
+    print(f"{label:10} {seconds * 1000:9.1f} ms "
+          f"{size / seconds / 1e6:8.2f} MB/s "
+          f"{count / seconds:12,.0f} tokens/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1_000_000,
+                        help="source size in characters")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--against", type=str,
+                        help="another scanner.py to compare with")
+    args = parser.parse_args()
+
+    source = synthetic_source(args.size)
+    seconds, count = measure(Scanner, source, args.repeat)
+    report("current", seconds, count, len(source))
+
+    if args.against:
+        other = load_scanner(args.against)
+        other_seconds, other_count = measure(other, source, args.repeat)
+        report("against", other_seconds, other_count, len(source))
+        print(f"speedup: {other_seconds / seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+"""
+起動時間のベンチマーク。
+
+1l 'p(1)' のような短いプログラムを count 回起動し、中央値から
+何もしない Python の起動時間を引いたものを起動のコストとして表示する。
+コストが budget ミリ秒を超えるか、起動時に読み込まないはずのモジュールが
+-X importtime の出力に現れたら、終了ステータス1で終わる。
+--warm では一時的な 1l --server を起動し、1l --client で起動済みのワーカーに
+実行させたときの時間も並べて表示する。
+
+    python bench/startup.py
+    python bench/startup.py -e tree -e vm --count 50 --budget 40
+    python bench/startup.py --imports 20   # 読み込みに時間のかかるモジュール
+    python bench/startup.py --warm         # サーバを使う場合と比べる
+"""
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+ONELINER = ROOT / "1l"
+ENGINES = ("tree", "closure", "vm")
+
+PROGRAM = "p(1)"
+# 起動のコストの上限(ミリ秒)
+DEFAULT_BUDGET = 60.0
+# REPL・デバッグ・キャッシュ・プロファイル・他のエンジン・NumPy などでだけ使い、
+# tree エンジンの起動では読み込まないモジュール
+DEFERRED = ("readline", "logging", "pickle", "hashlib", "pathlib", "gzip",
+            "numpy", "oneliner.cache", "oneliner.profiler",
+            "oneliner.ast_printer", "oneliner.closure_compiler",
+            "oneliner.compiler", "oneliner.vm", "oneliner.server", "socket")
+
+
+def elapsed(command: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def median_time(command: list[str], count: int) -> float:
+    # 1回目はOSのキャッシュに載せるためのもの
+    elapsed(command)
+    return statistics.median(elapsed(command) for _ in range(count))
+
+
+def start_server(path: str) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, str(ONELINER), "--server",
+                               "--socket", path, "--workers", "2"],
+                              stderr=subprocess.DEVNULL)
+    # ソケットができるまで待つ
+    while not os.path.exists(path):
+        if server.poll() is not None:
+            raise SystemExit("1l --server exited")
+        time.sleep(0.05)
+    return server
+
+
+def import_times(engine: str) -> list[tuple[float, str]]:
+    "-X importtime の出力から、(累積ミリ秒, モジュール名) のリストを作る"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(ONELINER),
+         "--local", "--engine", engine, PROGRAM],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((int(cumulative) / 1000, name.strip()))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--engine", action="append", choices=ENGINES,
+                        help="engine to run (repeatable, default: all)")
+    parser.add_argument("--count", type=int, default=30)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="maximum startup cost in ms "
+                             f"(default: {DEFAULT_BUDGET:g})")
+    parser.add_argument("--imports", type=int, default=0, metavar="N",
+                        help="also list the N slowest imports")
+    parser.add_argument("--warm", action="store_true",
+                        help="also measure runs on a 1l --server")
+    args = parser.parse_args()
+
+    # バイトコードのキャッシュを作る時間を測らないように、先にコンパイルしておく
+    compileall.compile_dir(ROOT / "oneliner", quiet=1)
+
+    python = median_time([sys.executable, "-c", "pass"], args.count)
+    print(f"python startup {python:8.1f} ms")
+    header = f"{'engine':8} {'total ms':>10} {'cost ms':>10}"
+    if args.warm:
+        header += f" {'warm ms':>10} {'warm cost':>10}"
+    print(header)
+
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "oneliner.sock")
+        if args.warm:
+            server = start_server(path)
+        try:
+            failed = False
+            for engine in args.engine or ENGINES:
+                command = [sys.executable, str(ONELINER), "--engine", engine]
+                total = median_time(command + ["--local", PROGRAM],
+                                    args.count)
+                cost = total - python
+                over = cost > args.budget
+                failed |= over
+                line = f"{engine:8} {total:10.1f} {cost:10.1f}"
+                if server is not None:
+                    warm = median_time(
+                        command + ["--client", "--socket", path, PROGRAM],
+                        args.count)
+                    line += f" {warm:10.1f} {warm - python:10.1f}"
+                print(line + ("  OVER BUDGET" if over else ""))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    times = import_times("tree")
+    imported = {name for _, name in times}
+    for name in DEFERRED:
+        if name in imported:
+            failed = True
+            print(f"{name} is imported at startup")
+
+    if args.imports:
+        print(f"{'cumulative ms':>13}  module")
+        for cumulative, name in sorted(times, reverse=True)[:args.imports]:
+            print(f"{cumulative:13.1f}  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
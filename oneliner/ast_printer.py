@@ -1,10 +1,10 @@
 from oneliner.expr import Expr, ExprVisitor, LiteralExpr, UnaryExpr, \
     BinaryExpr, GroupingExpr, TernaryExpr, AssignExpr, CallExpr, GetExpr, \
     SetExpr, LogicalExpr, ThisExpr, SuperExpr, ListExpr, MapExpr, \
-    IndexGetExpr, IndexSetExpr, FunctionExpr, VariableExpr
+    IndexGetExpr, IndexSetExpr, FunctionExpr, VariableExpr, RangeExpr
 from oneliner.stmt import Stmt, StmtVisitor, ExpressionStmt, VarStmt, \
     BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt, ClassStmt, \
-    EmptyStmt
+    EmptyStmt, ForInStmt
 from oneliner.token import Token
 from oneliner.utll import stringify
 
@@ -79,6 +79,12 @@ class AstPrinter(ExprVisitor, StmtVisitor):
                                  stmt.condition,
                                  stmt.body)
 
+    def visit_for_in_stmt(self, stmt: ForInStmt):
+        return self.parenthesize("for-in",
+                                 stmt.name,
+                                 stmt.iterable,
+                                 stmt.body)
+
     def visit_function_stmt(self, stmt: FunctionStmt):
         return self.parenthesize("function-decr",
                                  stmt.name,
@@ -148,3 +154,9 @@ class AstPrinter(ExprVisitor, StmtVisitor):
                                  expr.object,
                                  expr.index,
                                  expr.value)
+
+    def visit_range_expr(self, expr: RangeExpr):
+        return self.parenthesize(f"range{expr.operator.lexeme}",
+                                 expr.start,
+                                 expr.stop,
+                                 expr.step)
@@ -1,13 +1,50 @@
+import mmap
+import operator
+import os
+import stat
+import sys
+from collections import OrderedDict
 from oneliner.function import Callable
+from oneliner.error import NativeError
+from oneliner.stream import read_records, open_input, open_output, \
+    compression
 from time import time
-from oneliner.utll import camel_to_snake, stringify, is_truthy
+from oneliner.utll import camel_to_snake, stringify, is_truthy, Rope
 
 
 def export_functions():
-    return [Clock(), Print(), Str(), Float(), Int(), Bool(), Size()]
+    return [Clock(), Print(), Fprint(), Eprint(), Flush(), Close(),
+            Lines(), StdinLines(), ReadAll(), WriteLines(),
+            Str(), Float(), Int(), Bool(), Size(),
+            Stream(), Map(), Filter(), Take(), Reduce(), Collect(),
+            Memo(), MemoStats(), Range(),
+            Array(), Zeros(), Arange(), ToList(), Sum(), Mean(), Min(), Max()]
+
+
+def native_variables():
+    "ネイティブ関数を、グローバル変数の名前と値の組にして返す"
+    for native in export_functions():
+        yield native.name(), native
+        for alias in native.alias():
+            yield alias, native
+
+
+def with_flat_strings(call):
+    "ネイティブ関数の call を、引数のRopeを文字列にしてから呼ぶように包む"
+    def call_with_flat_strings(self, interpreter, arguments: list):
+        if Rope in map(type, arguments):
+            arguments = [str(argument) if type(argument) is Rope else argument
+                         for argument in arguments]
+        return call(self, interpreter, arguments)
+    return call_with_flat_strings
 
 
 class NativeFunction(Callable):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "call" in cls.__dict__:
+            cls.call = with_flat_strings(cls.call)
+
     def name(self):
         return camel_to_snake(type(self).__name__)
 
@@ -36,12 +73,191 @@ class Print(NativeFunction):
         return 1
 
     def call(self, interpreter, arguments: list):
-        print(stringify(arguments[0]))
+        interpreter.output.print(arguments[0])
 
     def alias(self):
         return ["p"]
 
 
+class Fprint(NativeFunction):
+    "fprint(path, value) で、ファイルに1行書く。ファイルは開いたままにしておく"
+
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        path = arguments[0]
+        if not isinstance(path, str):
+            raise NativeError("fprint expects a file name.")
+        interpreter.output.print_to(path, arguments[1])
+
+
+class Eprint(NativeFunction):
+    "標準エラー出力に1行書く"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        interpreter.output.print_to("/dev/stderr", arguments[0])
+
+
+class Flush(NativeFunction):
+    "標準出力と、fprint で開いているファイルにたまっている出力を書き出す"
+
+    def arity(self):
+        return 0
+
+    def call(self, interpreter, arguments: list):
+        interpreter.output.flush_all()
+
+
+class Close(NativeFunction):
+    "fprint で開いたファイルを閉じる。開いていたら true を返す"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        path = arguments[0]
+        if not isinstance(path, str):
+            raise NativeError("close expects a file name.")
+        return interpreter.output.files.close(path)
+
+
+# write_lines で一度に書く行数
+WRITE_BATCH = 4096
+
+
+def check_path(path, name: str):
+    if not isinstance(path, str):
+        raise NativeError(f"{name} expects a file name.")
+
+
+def check_readable(path: str):
+    "ファイルを読めなければ、読み始める前にエラーにする"
+    if path == "-":
+        return
+    try:
+        open_input(path).close()
+    except OSError as e:
+        raise NativeError(f"Can't open {path}: {e.strerror}.")
+
+
+class FileLines:
+    "ファイルの行を、回すたびに先頭から読む。改行は含まない"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self):
+        return read_records([self.path], "\n")
+
+
+class Lines(NativeFunction):
+    """
+    lines(path) で、ファイルの行のストリームを作る。
+    ファイルはチャンクごとに読んで分割するので、大きなファイルでも
+    メモリの使用量は一定
+    """
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        path = arguments[0]
+        check_path(path, "lines")
+        check_readable(path)
+        return LazyStream(interpreter, FileLines(path))
+
+
+class StdinLines(NativeFunction):
+    "標準入力の行のストリーム。パイプの行は、入力の終わりを待たずに届いたものから返す"
+
+    def arity(self):
+        return 0
+
+    def call(self, interpreter, arguments: list):
+        return LazyStream(interpreter, FileLines("-"))
+
+
+def read_text(path: str) -> str:
+    """
+    ファイル全体を文字列として読む。普通のファイルは mmap して、
+    読み込み用のバッファを介さずにデコードする
+    """
+    if path == "-":
+        return sys.stdin.buffer.read().decode("utf-8", "surrogateescape")
+    if compression(path) is not None:
+        with open_input(path) as file:
+            return file.read().decode("utf-8", "surrogateescape")
+
+    with open(path, "rb") as file:
+        status = os.fstat(file.fileno())
+        # 空のファイルやパイプは mmap できない
+        if not stat.S_ISREG(status.st_mode) or status.st_size == 0:
+            return file.read().decode("utf-8", "surrogateescape")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return str(data, "utf-8", "surrogateescape")
+
+
+class ReadAll(NativeFunction):
+    "read_all(path) で、ファイル全体を1つの文字列として読む"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        path = arguments[0]
+        check_path(path, "read_all")
+        try:
+            return read_text(path)
+        except OSError as e:
+            raise NativeError(f"Can't read {path}: {e.strerror}.")
+
+
+class WriteLines(NativeFunction):
+    """
+    write_lines(path, xs) で、xs の要素を1行ずつファイルに書き、書いた行数を返す。
+    ファイルは切り詰める。行はまとめてから書く
+    """
+
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        path, values = arguments
+        check_path(path, "write_lines")
+        values = iterate(values)
+        if path in ("-", "/dev/stdout"):
+            count = 0
+            for value in values:
+                interpreter.output.print(value)
+                count += 1
+            return count
+
+        # fprint で開いているなら、先に書き出して閉じる
+        interpreter.output.files.close(path)
+        count = 0
+        try:
+            with open_output(path) as file:
+                batch = []
+                for value in values:
+                    batch.append(stringify(value))
+                    if len(batch) == WRITE_BATCH:
+                        batch.append("")
+                        file.write("\n".join(batch))
+                        count += WRITE_BATCH
+                        batch.clear()
+                if batch:
+                    batch.append("")
+                    file.write("\n".join(batch))
+                    count += len(batch) - 1
+        except OSError as e:
+            raise NativeError(f"Can't write {path}: {e.strerror}.")
+        return count
+
+
 class Str(NativeFunction):
     def arity(self):
         return 1
@@ -83,3 +299,551 @@ class Size(NativeFunction):
 
     def alias(self):
         return ["length", "len"]
+
+
+# LazyStreamの段の種類
+MAP = 0
+FILTER = 1
+TAKE = 2
+
+
+class LazyStream:
+    """
+    遅延評価されるストリーム。map/filter/take は段を追加した新しいストリームを
+    返すだけで、reduce/collect などの終端操作で初めて source を読む。
+    すべての段は1回のループの中で要素ごとに適用されるので、
+    途中のリストは作られない。
+    """
+
+    def __init__(self, interpreter, source, stages: tuple = ()):
+        self.interpreter = interpreter
+        self.source = source
+        self.stages = stages
+
+    def then(self, kind: int, argument):
+        return LazyStream(self.interpreter,
+                          self.source,
+                          self.stages + ((kind, argument),))
+
+    def __iter__(self):
+        interpreter = self.interpreter
+        stages = self.stages
+        # take の段ごとの残り数
+        remaining = {index: argument
+                     for index, (kind, argument) in enumerate(stages)
+                     if kind == TAKE}
+        if any(count <= 0 for count in remaining.values()):
+            return
+
+        for item in self.source:
+            finished = False
+            for index, (kind, argument) in enumerate(stages):
+                if kind == MAP:
+                    item = argument.call(interpreter, [item])
+                elif kind == FILTER:
+                    if not is_truthy(argument.call(interpreter, [item])):
+                        break
+                else:
+                    remaining[index] -= 1
+                    if remaining[index] == 0:
+                        finished = True
+            else:
+                yield item
+            # take の数に達したら、それ以上 source を読まない
+            if finished:
+                return
+
+    def __str__(self):
+        return "<stream>"
+
+
+def to_stream(interpreter, value) -> LazyStream:
+    if isinstance(value, LazyStream):
+        return value
+    if isinstance(value, (list, dict, str, NumberRange, NumArray)):
+        return LazyStream(interpreter, value)
+    raise NativeError(f"Can't make a stream from {stringify(value)}.")
+
+
+def check_function(value, arity: int, name: str):
+    if not isinstance(value, Callable) or value.arity() != arity:
+        raise NativeError(
+            f"{name} expects a function of {arity} argument(s).")
+
+
+class Stream(NativeFunction):
+    "リスト・マップ(キー)・文字列からストリームを作る"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        return to_stream(interpreter, arguments[0])
+
+
+class Map(NativeFunction):
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        check_function(arguments[1], 1, "map")
+        return to_stream(interpreter, arguments[0]).then(MAP, arguments[1])
+
+
+class Filter(NativeFunction):
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        check_function(arguments[1], 1, "filter")
+        return to_stream(interpreter, arguments[0]).then(FILTER,
+                                                         arguments[1])
+
+
+class Take(NativeFunction):
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        count = arguments[1]
+        if not isinstance(count, int) or isinstance(count, bool):
+            raise NativeError("take expects an integer.")
+        return to_stream(interpreter, arguments[0]).then(TAKE, count)
+
+
+class Reduce(NativeFunction):
+    def arity(self):
+        return 3
+
+    def call(self, interpreter, arguments: list):
+        function = arguments[1]
+        check_function(function, 2, "reduce")
+        accumulator = arguments[2]
+        for item in to_stream(interpreter, arguments[0]):
+            accumulator = function.call(interpreter, [accumulator, item])
+        return accumulator
+
+
+class Collect(NativeFunction):
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        return list(to_stream(interpreter, arguments[0]))
+
+
+class NumberRange:
+    """
+    range() の値。start から step ずつ、stop を越えるまでの数を遅延して返す。
+    inclusive なら stop も含む。step の符号で増える方向か減る方向かが決まる
+    """
+
+    def __init__(self, start, stop, step, inclusive: bool = False):
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.inclusive = inclusive
+
+    def is_integer(self) -> bool:
+        return type(self.start) is int and type(self.stop) is int \
+            and type(self.step) is int
+
+    def integer_range(self) -> range:
+        stop = self.stop
+        if self.inclusive:
+            stop += 1 if self.step > 0 else -1
+        return range(self.start, stop, self.step)
+
+    def __iter__(self):
+        # 整数だけならPythonのrangeで回す
+        if self.is_integer():
+            return iter(self.integer_range())
+        return self.values()
+
+    def values(self):
+        "浮動小数を含むときは、1lのループと同じく step を足していく"
+        if self.step > 0:
+            compare = operator.le if self.inclusive else operator.lt
+        else:
+            compare = operator.ge if self.inclusive else operator.gt
+        value = self.start
+        stop = self.stop
+        step = self.step
+        while compare(value, stop):
+            yield value
+            value = value + step
+
+    def __len__(self):
+        if self.is_integer():
+            return len(self.integer_range())
+        return sum(1 for _ in self.values())
+
+    def __str__(self):
+        return f"<range {stringify(self.start)}..{stringify(self.stop)}" \
+            f" step {stringify(self.step)}>"
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float))
+
+
+class Range(NativeFunction):
+    "range(start, stop, step) で、stop を含まない数の並びを作る"
+
+    def arity(self):
+        return 3
+
+    def call(self, interpreter, arguments: list):
+        start, stop, step = arguments
+        if not (is_number(start) and is_number(stop) and is_number(step)):
+            raise NativeError("range expects numbers.")
+        if step == 0:
+            raise NativeError("range step must not be zero.")
+        return NumberRange(start, stop, step)
+
+
+def iterate(value):
+    "for-in で回す値のイテレータ。マップはキーを、開始時点のものだけ回す"
+    if isinstance(value, (list, str, Rope, NumberRange, LazyStream,
+                          NumArray)):
+        return iter(value)
+    if isinstance(value, dict):
+        return iter(list(value))
+    raise NativeError(
+        "Can only iterate over lists, maps, strings, ranges and streams.")
+
+
+# 配列を初めて作るときに読み込む(起動を遅くしないため)
+numpy = None
+
+
+def load_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            raise NativeError("array requires numpy.") from None
+        # 0での除算などは警告を出さずに inf や nan にする
+        module.seterr(all="ignore")
+        numpy = module
+    return numpy
+
+
+def unwrap(value):
+    return value.values if isinstance(value, NumArray) else value
+
+
+def wrap(result):
+    "numpyの演算結果を1lの値にする。要素は int / float / bool に戻す"
+    if isinstance(result, numpy.ndarray):
+        return NumArray(result)
+    if isinstance(result, numpy.generic):
+        return result.item()
+    return result
+
+
+def elementwise(function):
+    def apply(self, other):
+        return wrap(function(self.values, unwrap(other)))
+    return apply
+
+
+def reflected(function):
+    "数値 + 配列 のように、左辺が数値のとき"
+    def apply(self, other):
+        return wrap(function(other, self.values))
+    return apply
+
+
+class NumArray:
+    """
+    array() などで作る数値の配列(numpy.ndarray)。算術演算子と比較演算子は
+    要素ごとに適用され、結果も配列になる。相手は数値か、同じ長さの配列。
+    添字には整数のほか、真偽値の配列(マスク)や整数の配列も使える
+    """
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    __add__ = elementwise(operator.add)
+    __sub__ = elementwise(operator.sub)
+    __mul__ = elementwise(operator.mul)
+    __truediv__ = elementwise(operator.truediv)
+    __floordiv__ = elementwise(operator.floordiv)
+    __mod__ = elementwise(operator.mod)
+    __radd__ = reflected(operator.add)
+    __rsub__ = reflected(operator.sub)
+    __rmul__ = reflected(operator.mul)
+    __rtruediv__ = reflected(operator.truediv)
+    __rfloordiv__ = reflected(operator.floordiv)
+    __rmod__ = reflected(operator.mod)
+    __lt__ = elementwise(operator.lt)
+    __le__ = elementwise(operator.le)
+    __gt__ = elementwise(operator.gt)
+    __ge__ = elementwise(operator.ge)
+    __eq__ = elementwise(operator.eq)
+    __ne__ = elementwise(operator.ne)
+
+    def __neg__(self):
+        return NumArray(-self.values)
+
+    def __bool__(self):
+        # 1lの真偽判定と同じく、配列は空でも真
+        return True
+
+    def __getitem__(self, index):
+        return wrap(self.values[unwrap(index)])
+
+    def __setitem__(self, index, value):
+        self.values[unwrap(index)] = unwrap(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __str__(self):
+        return f"array({stringify(self.values.tolist())})"
+
+
+class Array(NativeFunction):
+    "数値のリスト・range・ストリームから配列を作る"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        numpy = load_numpy()
+        value = arguments[0]
+        try:
+            if isinstance(value, NumArray):
+                values = value.values.copy()
+            elif isinstance(value, NumberRange) and value.is_integer():
+                values = numpy.arange(value.start, value.stop, value.step)
+            elif isinstance(value, list):
+                values = numpy.array(value)
+            else:
+                values = numpy.array(list(to_stream(interpreter, value)))
+        except ValueError:
+            raise NativeError("array expects numbers.") from None
+        # b: 真偽値、i/u: 整数、f: 浮動小数
+        if values.dtype.kind not in "biuf":
+            raise NativeError("array expects numbers.")
+        return NumArray(values)
+
+
+class Zeros(NativeFunction):
+    "zeros(n) で、0.0 が n 個の配列を作る"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        count = arguments[0]
+        if not isinstance(count, int) or isinstance(count, bool) \
+                or count < 0:
+            raise NativeError("zeros expects a non-negative integer.")
+        return NumArray(load_numpy().zeros(count))
+
+
+class Arange(NativeFunction):
+    "arange(a, b) で、a から1ずつ b の手前までの配列を作る"
+
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        start, stop = arguments
+        if not (is_number(start) and is_number(stop)):
+            raise NativeError("arange expects numbers.")
+        return NumArray(load_numpy().arange(start, stop))
+
+
+class ToList(NativeFunction):
+    "配列・range・ストリームをリストにする"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        value = arguments[0]
+        if isinstance(value, NumArray):
+            return value.values.tolist()
+        return list(to_stream(interpreter, value))
+
+
+# リストなどの要素に使う関数。配列には同じ名前のnumpyのメソッドを使う
+REDUCTIONS = {
+    "sum": sum,
+    "mean": lambda values: sum(values) / len(values),
+    "min": min,
+    "max": max,
+}
+
+
+def reduce_numbers(interpreter, value, name: str):
+    if isinstance(value, NumArray):
+        values = value.values
+        if len(values) == 0 and name != "sum":
+            raise NativeError(f"{name} of an empty array.")
+        return getattr(values, name)().item()
+
+    values = list(to_stream(interpreter, value))
+    if len(values) == 0 and name != "sum":
+        raise NativeError(f"{name} of an empty list.")
+    try:
+        return REDUCTIONS[name](values)
+    except TypeError:
+        raise NativeError(f"{name} expects numbers.") from None
+
+
+class Sum(NativeFunction):
+    "配列・リスト・range・ストリームの要素の合計"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        return reduce_numbers(interpreter, arguments[0], "sum")
+
+
+class Mean(NativeFunction):
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        return reduce_numbers(interpreter, arguments[0], "mean")
+
+
+class Min(NativeFunction):
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        return reduce_numbers(interpreter, arguments[0], "min")
+
+
+class Max(NativeFunction):
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        return reduce_numbers(interpreter, arguments[0], "max")
+
+
+def memo_key(value, active: set | None = None):
+    """
+    memoのキー。リストとマップは要素から作るので、中身が同じなら同じキーになる。
+    真偽値・浮動小数は、等しい整数と区別する
+    """
+    match value:
+        case list():
+            active = enter_container(value, active)
+            key = ("list", tuple(memo_key(item, active) for item in value))
+            active.discard(id(value))
+            return key
+        case dict():
+            active = enter_container(value, active)
+            key = ("map", frozenset((memo_key(k, active),
+                                     memo_key(v, active))
+                                    for k, v in value.items()))
+            active.discard(id(value))
+            return key
+        case bool() | float():
+            return (type(value), value)
+        case NumArray():
+            values = value.values
+            return ("array", values.dtype.str, values.shape, values.tobytes())
+        case _:
+            # 数値・文字列・nilは値で、インスタンスや関数は同一性で比べる
+            return value
+
+
+def enter_container(value, active: set | None) -> set:
+    "キーを作っている途中のリスト・マップに戻ってきたら、循環しているのでエラー"
+    if active is None:
+        active = set()
+    elif id(value) in active:
+        raise NativeError("memo can't use a cyclic list or map as a key.")
+    active.add(id(value))
+    return active
+
+
+# 覚えている結果がないことを表す(nilも結果として覚えるため)
+MISSING = object()
+
+
+class MemoizedFunction(Callable):
+    """
+    関数の結果を引数の値ごとに覚えておく。覚える数が capacity を超えたら、
+    最も長く使われていない結果から捨てる(LRU)。
+    """
+
+    def __init__(self, function: Callable, capacity: int):
+        self.function = function
+        self.capacity = capacity
+        self.results: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def arity(self):
+        return self.function.arity()
+
+    def call(self, interpreter, arguments: list):
+        if len(arguments) == 1:
+            key = memo_key(arguments[0])
+        else:
+            key = tuple(memo_key(argument) for argument in arguments)
+        results = self.results
+        value = results.get(key, MISSING)
+        if value is not MISSING:
+            self.hits += 1
+            results.move_to_end(key)
+            return value
+
+        self.misses += 1
+        # 再帰呼び出しの中で同じキーが覚えられることもあるので、後から上書きする
+        value = self.function.call(interpreter, arguments)
+        results[key] = value
+        results.move_to_end(key)
+        if len(results) > self.capacity:
+            results.popitem(last=False)
+        return value
+
+    def __str__(self):
+        return f"<memo {self.function}>"
+
+
+class Memo(NativeFunction):
+    "memo(f, capacity) で、結果を最大 capacity 個覚える f を作る"
+
+    def arity(self):
+        return 2
+
+    def call(self, interpreter, arguments: list):
+        function, capacity = arguments
+        if not isinstance(function, Callable):
+            raise NativeError("memo expects a function.")
+        if not isinstance(capacity, int) or isinstance(capacity, bool) \
+                or capacity < 1:
+            raise NativeError("memo expects a positive integer capacity.")
+        return MemoizedFunction(function, capacity)
+
+
+class MemoStats(NativeFunction):
+    "memoした関数の、覚えた結果が使われた回数(hits)と使われなかった回数(misses)など"
+
+    def arity(self):
+        return 1
+
+    def call(self, interpreter, arguments: list):
+        memo = arguments[0]
+        if not isinstance(memo, MemoizedFunction):
+            raise NativeError("memo_stats expects a function made by memo.")
+        return {"hits": memo.hits,
+                "misses": memo.misses,
+                "size": len(memo.results),
+                "capacity": memo.capacity}
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import pickle
+import sys
+from pathlib import Path
+
+# 解決済みプログラムの形式を変えたら上げる
+CACHE_FORMAT = 3
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir() -> Path:
+    if directory := os.environ.get("ONELINER_CACHE_DIR"):
+        return Path(directory)
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "oneliner"
+
+
+def default_max_size() -> int:
+    try:
+        return int(os.environ["ONELINER_CACHE_SIZE"])
+    except (KeyError, ValueError):
+        return DEFAULT_MAX_SIZE
+
+
+def interpreter_version() -> str:
+    """
+    インタプリタのバージョン。Pythonのバージョンと、onelinerパッケージの
+    ソースファイルの更新時刻・サイズから作るので、インタプリタを変更すると
+    古いキャッシュは使われなくなる。
+    """
+    package = Path(__file__).parent
+    stats = []
+    for entry in os.scandir(package):
+        if entry.name.endswith(".py"):
+            stat = entry.stat()
+            stats.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    stats.sort()
+    return repr((CACHE_FORMAT, sys.version_info[:3], stats))
+
+
+class ProgramCache:
+    """
+    Scanner/Parser/Resolverを通した後のプログラム(解決済みのAST)を
+    ソースのハッシュをキーにディスクに保存する。
+
+    キーはソースとインタプリタのバージョンから作るので、どちらかが変われば
+    別のエントリになる(古いエントリはLRUで追い出される)。
+    ヒットしたエントリは更新時刻を更新し、合計サイズが max_size を超えたら
+    更新時刻の古いものから削除する。
+    """
+
+    SUFFIX = ".1lc"
+
+    def __init__(self,
+                 directory: Path | None = None,
+                 max_size: int | None = None):
+        self.directory = directory or default_cache_dir()
+        self.max_size = default_max_size() if max_size is None else max_size
+        self.version = interpreter_version()
+
+    def path_of(self, code: str, kind: str) -> Path:
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        digest.update(b"\0")
+        digest.update(kind.encode())
+        digest.update(b"\0")
+        digest.update(code.encode("utf-8", "surrogatepass"))
+        return self.directory / (digest.hexdigest() + self.SUFFIX)
+
+    def load(self, code: str, kind: str = "program"):
+        "kindは同じソースを別の形でパースしたもの(ストリーミングモード)を区別する"
+        path = self.path_of(code, kind)
+        try:
+            with open(path, "rb") as file:
+                statements = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 壊れたエントリは捨てて作り直す
+            path.unlink(missing_ok=True)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return statements
+
+    def store(self, code: str, statements, kind: str = "program"):
+        path = self.path_of(code, kind)
+        try:
+            data = pickle.dumps(statements, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError):
+            # 深すぎるASTなどはキャッシュしない
+            return
+        if len(data) > self.max_size:
+            return
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, path)
+            self.evict()
+        except OSError:
+            # キャッシュに書けなくても実行は続ける
+            pass
+
+    def evict(self):
+        "合計サイズが上限を超えていれば、最近使われていないものから削除する"
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.SUFFIX):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,110 @@
+import argparse
+import codecs
+import os
+import sys
+from oneliner.client import default_socket_path
+from oneliner.runner import Runner, ENGINES
+from oneliner.output import FLUSH_POLICIES
+
+# --server で起動するワーカーの数
+DEFAULT_WORKERS = 4
+
+
+def unescape(separator):
+    "-F '\\t' のように書かれたエスケープを解釈する"
+    if separator is None or "\\" not in separator:
+        return separator
+    return codecs.decode(separator, "unicode_escape")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='1l')
+    parser.add_argument('code', metavar='code', type=str, nargs='*',
+                        help='code to run')
+    parser.add_argument('-f', '--file', type=str)
+    parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('--engine', choices=list(ENGINES),
+                        default='tree',
+                        help='execution engine (default: tree)')
+    parser.add_argument('-O', dest='optimize', type=int, choices=[0, 1],
+                        default=1,
+                        help='optimization level, -O0 disables the '
+                             'optimizer (default: 1)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='do not use the compiled program cache for -f')
+    parser.add_argument('--profile', action='store_true',
+                        help='print a per-function profile to stderr')
+    parser.add_argument('--profile-stacks', type=str, metavar='FILE',
+                        help='also write collapsed stacks for flamegraphs')
+    parser.add_argument('--max-depth', type=int, default=None,
+                        metavar='N',
+                        help='maximum depth of function calls '
+                             '(default: 100000)')
+    parser.add_argument('-n', dest='loop', action='store_true',
+                        help='run the program for each input record')
+    parser.add_argument('-p', dest='print_records', action='store_true',
+                        help='like -n, but print _ after each record')
+    parser.add_argument('-F', '--field-separator', type=str, default=None,
+                        help='field separator for F (default: whitespace)')
+    parser.add_argument('--record-separator', '--rs', type=str,
+                        default='\n',
+                        help='record separator (default: newline)')
+    parser.add_argument('--flush', choices=FLUSH_POLICIES, default=None,
+                        help='when to write buffered output: every line, '
+                             'every block or only on flush() '
+                             '(default: line on a terminal, otherwise block)')
+    parser.add_argument('--server', action='store_true',
+                        help='keep warm worker processes and run programs '
+                             'sent by 1l --client')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        metavar='N',
+                        help='number of worker processes for --server '
+                             f'(default: {DEFAULT_WORKERS})')
+    parser.add_argument('--socket', type=str, default=None, metavar='PATH',
+                        help='Unix socket of the server (default: '
+                             '$ONELINER_SOCKET, otherwise oneliner.sock in '
+                             '$XDG_RUNTIME_DIR or /tmp/oneliner-<uid>)')
+    parser.add_argument('--client', action='store_true',
+                        help='run the program on the server')
+    parser.add_argument('--local', action='store_true',
+                        help='do not use the server even if it is running')
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.server:
+        if args.workers < 1:
+            parser.error('--workers must be at least 1')
+        from oneliner.server import serve
+        serve(args.socket or default_socket_path(), args.workers)
+        return
+    if (args.profile or args.profile_stacks) and args.engine == 'vm':
+        parser.error('--profile is not supported by the vm engine')
+
+    # AWK風に -f があればそれをスクリプトとして、
+    # なければコマンドラインの一つ目をスクリプトとして解釈する。
+    # 残りの引数は -n / -p のときの入力ファイルになる。
+    args.field_separator = unescape(args.field_separator)
+    args.record_separator = unescape(args.record_separator)
+
+    runner = Runner(args)
+    try:
+        try:
+            if args.file:
+                runner.run_file(args.file, args.code)
+            elif len(args.code) == 0:
+                if args.loop or args.print_records:
+                    parser.error("-n and -p need a program")
+                runner.run_prompt()
+            else:
+                runner.run(args.code[0], args.code[1:])
+        finally:
+            runner.close()
+    except BrokenPipeError:
+        # 出力先のパイプが閉じられた(| head など)。残りの出力は捨て、
+        # 終了時のフラッシュでもう一度エラーにならないようにする
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
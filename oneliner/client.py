@@ -0,0 +1,134 @@
+import marshal
+import os
+import stat
+import sys
+
+# 1l --server とやりとりする。起動を速くするため、ここでは
+# プログラムの実行に使うモジュールを読み込まない
+
+# メッセージの長さを表すバイト数
+LENGTH_SIZE = 8
+# サーバに渡すファイル記述子(標準入力・標準出力・標準エラー出力)
+STANDARD_FDS = (0, 1, 2)
+
+
+def socket_directory() -> str:
+    """
+    デフォルトのソケットを置くディレクトリ。他のユーザーが書き込めない
+    $XDG_RUNTIME_DIR か、なければ 1l --server が権限 0700 で作る /tmp の下
+    """
+    if directory := os.environ.get("XDG_RUNTIME_DIR"):
+        return directory
+    return private_directory()
+
+
+def private_directory() -> str:
+    return f"/tmp/oneliner-{os.getuid()}"
+
+
+def default_socket_path() -> str:
+    if path := os.environ.get("ONELINER_SOCKET"):
+        return path
+    return os.path.join(socket_directory(), "oneliner.sock")
+
+
+def is_own_socket(path: str) -> bool:
+    "path が、このユーザーの作ったソケットか。シンボリックリンクはたどらない"
+    try:
+        status = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(status.st_mode) and status.st_uid == os.getuid()
+
+
+def peer_uid(connection) -> int | None:
+    "Unix ソケットでつながった相手のプロセスのユーザーID。調べられなければ None"
+    import _socket
+    option = getattr(_socket, "SO_PEERCRED", None)
+    if option is None:
+        return None
+    # struct ucred { pid_t pid; uid_t uid; gid_t gid; }
+    credentials = connection.getsockopt(_socket.SOL_SOCKET, option, 12)
+    return int.from_bytes(credentials[4:8], sys.byteorder)
+
+
+def client_options(argv: list[str]) -> tuple[str | None, bool]:
+    """
+    コマンドラインから、サーバに実行させるかを決める。
+    (ソケットのパス, --client が指定されたか) を返し、サーバを使わないならパスは None。
+    --client がなくても、ソケットがあればサーバを使う
+    """
+    client = False
+    path = None
+    for index, argument in enumerate(argv):
+        if argument == "--":
+            break
+        if argument in ("--server", "--local"):
+            return None, False
+        if argument == "--client":
+            client = True
+        elif argument == "--socket" and index + 1 < len(argv):
+            path = argv[index + 1]
+        elif argument.startswith("--socket="):
+            path = argument.removeprefix("--socket=")
+
+    path = path or default_socket_path()
+    if not client and not is_own_socket(path):
+        return None, False
+    return path, client
+
+
+def encode_message(value) -> bytes:
+    data = marshal.dumps(value)
+    return len(data).to_bytes(LENGTH_SIZE, "big") + data
+
+
+def send_request(connection, request: dict, fds):
+    "リクエストを送る。ファイル記述子は最初のメッセージに付けて渡す"
+    import _socket
+    message = encode_message(request)
+    # socket.send_fds と同じ。socket モジュールは読み込みに時間がかかるので使わない
+    rights = b"".join(fd.to_bytes(4, sys.byteorder) for fd in fds)
+    sent = connection.sendmsg(
+        [message], [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, rights)])
+    connection.sendall(message[sent:])
+
+
+def run_remote(path: str, argv: list[str]) -> int | None:
+    """
+    サーバのワーカーに argv を実行させ、終了ステータスを返す。
+    標準入出力はファイル記述子ごと渡すので、出力はワーカーから直接書かれる。
+    サーバにつながらなければ None を返す。環境変数や標準入出力を渡すので、
+    自分のソケットで、自分のプロセスが待っているときだけ送る
+    """
+    import _socket
+    if os.path.lexists(path) and not is_own_socket(path):
+        print(f"1l: {path} is not a socket owned by you", file=sys.stderr)
+        return None
+    connection = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        try:
+            connection.connect(path)
+            uid = peer_uid(connection)
+            if uid is not None and uid != os.getuid():
+                print(f"1l: the server at {path} is run by another user",
+                      file=sys.stderr)
+                return None
+            send_request(connection,
+                         {"argv": argv,
+                          "cwd": os.getcwd(),
+                          "environ": dict(os.environ)},
+                         STANDARD_FDS)
+        except OSError:
+            return None
+        # 実行が終わると、終了ステータスが1バイトで返ってくる
+        try:
+            status = connection.recv(1)
+        except KeyboardInterrupt:
+            return 130
+    finally:
+        connection.close()
+    if not status:
+        print("1l: lost connection to the server", file=sys.stderr)
+        return 1
+    return status[0]
@@ -0,0 +1,868 @@
+import operator
+from oneliner.utll import is_truthy, concat
+from oneliner.function import Function, Callable, Partial, TailCall
+from oneliner.environment import Environment, SUPER_SLOTS
+from oneliner.error import InterpretError, ErrorReporter, RETURN, \
+    NativeError
+from oneliner.interpreter import Interpreter, is_inclusive
+from oneliner.builtin import NumberRange, NumArray, iterate
+from oneliner.klass import Instance, Klass
+from oneliner.token import TokenType, Token
+from oneliner.expr import Expr, ExprVisitor, LiteralExpr, GroupingExpr, \
+    SetExpr, BinaryExpr, SuperExpr, TernaryExpr, VariableExpr, AssignExpr, \
+    LogicalExpr, CallExpr, GetExpr, ThisExpr, UnaryExpr, FunctionExpr, \
+    ListExpr, MapExpr, IndexGetExpr, IndexSetExpr, RangeExpr
+from oneliner.stmt import Stmt, StmtVisitor, EmptyStmt, ExpressionStmt, \
+    VarStmt, BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt, \
+    ClassStmt, ForInStmt
+
+
+NUMERIC_OPERATORS = {
+    TokenType.MINUS: operator.sub,
+    TokenType.STAR: operator.mul,
+    TokenType.SLASH: operator.truediv,
+    TokenType.PERCENT: operator.mod,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+}
+
+BOOLEAN_OPERATORS = {
+    TokenType.GREATER, TokenType.GREATER_EQUAL,
+    TokenType.LESS, TokenType.LESS_EQUAL,
+    TokenType.DOUBLE_EQUAL, TokenType.BANG_EQUAL,
+    TokenType.NOT, TokenType.BANG,
+}
+
+# 配列も数値と同じ演算子で、要素ごとに計算できる
+NUMERIC = (int, float, NumArray)
+
+
+def is_numeric(object):
+    return isinstance(object, NUMERIC)
+
+
+def is_boolean(expr: Expr) -> bool:
+    "評価結果が必ずboolになる式かどうか(真偽判定を省略できる)"
+    match expr:
+        case BinaryExpr() | UnaryExpr():
+            return expr.operator.type in BOOLEAN_OPERATORS
+        case GroupingExpr():
+            return is_boolean(expr.expression)
+        case LiteralExpr():
+            return isinstance(expr.value, bool)
+        case _:
+            return False
+
+
+def is_equal(left, right):
+    if left is None and right is None:
+        return True
+    if left is None:
+        return False
+    return left == right
+
+
+class CompiledFunction(Function):
+    "本体をクロージャにコンパイル済みの関数"
+
+    def __init__(self,
+                 stmt: FunctionStmt | None = None,
+                 name: Token | None = None,
+                 expr: FunctionExpr | None = None,
+                 closure: Environment = None,
+                 is_initializer: bool = False,
+                 this=None,
+                 body: tuple = ()):
+        super().__init__(stmt=stmt, name=name, expr=expr, closure=closure,
+                         is_initializer=is_initializer, this=this)
+        self.body = body
+
+    def call(self, interpreter, arguments: list):
+        if self.is_method:
+            return self.call_method(interpreter, self.this, arguments)
+
+        depth = interpreter.depth
+        if depth >= interpreter.max_depth:
+            raise NativeError("Stack overflow.")
+        interpreter.depth = depth + 1
+        try:
+            environment: Environment = Environment(self.closure,
+                                                   self.expr.slots)
+            environment.values[:len(arguments)] = arguments
+            value = None
+            for statement in self.body:
+                if statement(environment) is RETURN:
+                    value = interpreter.return_value
+                    if type(value) is TailCall:
+                        value = value.run(interpreter)
+                    break
+            return value
+        except RecursionError:
+            # Pythonの再帰の上限に先に達した
+            raise NativeError("Stack overflow.") from None
+        finally:
+            interpreter.depth = depth
+
+    def call_method(self, interpreter, this, arguments: list):
+        depth = interpreter.depth
+        if depth >= interpreter.max_depth:
+            raise NativeError("Stack overflow.")
+        interpreter.depth = depth + 1
+        try:
+            environment: Environment = Environment(self.closure,
+                                                   self.expr.slots)
+            environment.values[0] = this
+            environment.values[1:len(arguments) + 1] = arguments
+            value = None
+            for statement in self.body:
+                if statement(environment) is RETURN:
+                    value = interpreter.return_value
+                    if type(value) is TailCall:
+                        value = value.run(interpreter)
+                    break
+        except RecursionError:
+            raise NativeError("Stack overflow.") from None
+        finally:
+            interpreter.depth = depth
+        if self.is_initializer:
+            return this
+        return value
+
+    def run(self, interpreter, arguments: list):
+        environment: Environment = Environment(self.closure, self.expr.slots)
+        if self.is_method:
+            environment.values[0] = self.this
+            environment.values[1:len(arguments) + 1] = arguments
+        else:
+            environment.values[:len(arguments)] = arguments
+        for statement in self.body:
+            if statement(environment) is RETURN:
+                if self.is_initializer:
+                    return self.this
+                return interpreter.return_value
+
+        if self.is_initializer:
+            return self.this
+        return None
+
+    def bind(self, instance):
+        return CompiledFunction(name=self.name,
+                                expr=self.expr,
+                                closure=self.closure,
+                                is_initializer=self.is_initializer,
+                                this=instance,
+                                body=self.body)
+
+
+def get_property(env: Environment, invocant, property: Token):
+    if isinstance(invocant, Instance):
+        return invocant.get(property)
+
+    # syntax sugar: obj.foo(x,y,z) == foo(obj, x,y,z)
+    function = env.get(property)
+    if function is not None and isinstance(function, Callable):
+        if function.arity() < 1:
+            raise InterpretError(
+                property,
+                "Callable must have at least 1 argument")
+        return Partial(function, invocant)
+
+    raise InterpretError(property,
+                         "Neither instance property nor callable")
+
+
+class ClosureCompiler(ExprVisitor, StmtVisitor):
+    """
+    解決済みのASTを、環境(Environment)を引数に取るPythonのクロージャの木に変換する。
+    演算子の選択、変数の深さとスロット番号、リテラル値はコンパイル時に埋め込まれる。
+    """
+
+    def __init__(self, interpreter: Interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.globals
+
+    def compile(self, node: Expr | Stmt):
+        return node.accept(self)
+
+    def compile_statements(self, statements: list[Stmt]) -> tuple:
+        "文のクロージャは、return文を実行したら RETURN を返す(式文は式の値を返す)"
+        return tuple(self.compile(statement) for statement in statements)
+
+    def variable_setter(self, name: Token, slot: int | None):
+        "宣言された変数に値を設定するクロージャ。slotがNoneならグローバル変数"
+        if slot is None:
+            variables = self.globals.variables
+            key = name.lexeme
+
+            def define_global(env, value):
+                variables[key] = value
+            return define_global
+
+        def define_local(env, value):
+            env.values[slot] = value
+        return define_local
+
+    #
+    # statements
+    #
+
+    def visit_expression_stmt(self, stmt: ExpressionStmt):
+        return self.compile(stmt.expression)
+
+    def visit_empty_stmt(self, stmt: EmptyStmt):
+        def empty(env):
+            pass
+        return empty
+
+    def visit_return_stmt(self, stmt: ReturnStmt):
+        interpreter = self.interpreter
+        if stmt.value is None:
+            def return_nil(env):
+                interpreter.return_value = None
+                return RETURN
+            return return_nil
+
+        if stmt.tail:
+            value = self.compile_tail(stmt.value)
+        else:
+            value = self.compile(stmt.value)
+
+        def return_value(env):
+            interpreter.return_value = value(env)
+            return RETURN
+        return return_value
+
+    def compile_tail(self, expr: Expr):
+        "return文の値のクロージャ。末尾位置の1lの関数の呼び出しは TailCall を返す"
+        match expr:
+            case TernaryExpr():
+                condition = self.compile_condition(expr.condition)
+                then_expr = self.compile_tail(expr.then_expr)
+                else_expr = self.compile_tail(expr.else_expr)
+
+                def ternary(env):
+                    if condition(env):
+                        return then_expr(env)
+                    return else_expr(env)
+                return ternary
+            case GroupingExpr():
+                return self.compile_tail(expr.expression)
+            case CallExpr():
+                return self.compile_tail_call(expr)
+            case _:
+                return self.compile(expr)
+
+    def compile_tail_call(self, expr: CallExpr):
+        paren = expr.paren
+        callee = self.compile(expr.callee)
+        arguments = tuple(self.compile(arg) for arg in expr.arguments)
+        arity = len(arguments)
+        call_value = self.value_caller(paren, arguments)
+
+        def tail_call(env):
+            function = callee(env)
+            if not isinstance(function, CompiledFunction):
+                return call_value(env, function)
+            values = [argument(env) for argument in arguments]
+            if arity != (expected := function.arity()):
+                raise InterpretError(
+                    paren,
+                    f"Expected {expected} arguments but got {arity}."
+                )
+            return TailCall(function, values)
+        return tail_call
+
+    def visit_function_stmt(self, stmt: FunctionStmt):
+        define = self.variable_setter(stmt.name, stmt.slot)
+        body = self.compile_statements(stmt.function.body)
+
+        def function(env):
+            define(env, CompiledFunction(stmt=stmt,
+                                         closure=env,
+                                         is_initializer=False,
+                                         body=body))
+        return function
+
+    def visit_var_stmt(self, stmt: VarStmt):
+        define = self.variable_setter(stmt.name, stmt.slot)
+        if stmt.initializer is None:
+            def var_nil(env):
+                define(env, None)
+            return var_nil
+
+        initializer = self.compile(stmt.initializer)
+
+        if stmt.slot is not None:
+            slot = stmt.slot
+
+            def var_local(env):
+                env.values[slot] = initializer(env)
+            return var_local
+
+        def var(env):
+            define(env, initializer(env))
+        return var
+
+    def visit_block_stmt(self, stmt: BlockStmt):
+        statements = self.compile_statements(stmt.statements)
+        # 変数を宣言しないブロックには環境を作らない
+        if stmt.slots is None:
+            def block_without_scope(env):
+                for statement in statements:
+                    if statement(env) is RETURN:
+                        return RETURN
+            return block_without_scope
+
+        slots = stmt.slots
+
+        def block(env):
+            environment = Environment(env, slots)
+            for statement in statements:
+                if statement(environment) is RETURN:
+                    return RETURN
+        return block
+
+    def visit_class_stmt(self, stmt: ClassStmt):
+        define = self.variable_setter(stmt.name, stmt.slot)
+        superclass_expr = stmt.superclass
+        get_superclass = None
+        if superclass_expr is not None:
+            get_superclass = self.compile(superclass_expr)
+
+        methods = [(method,
+                    method.name.lexeme,
+                    self.compile_statements(method.function.body))
+                   for method in stmt.methods]
+
+        def klass(env):
+            superclass = None
+            if get_superclass is not None:
+                superclass = get_superclass(env)
+                if not isinstance(superclass, Klass):
+                    raise InterpretError(superclass_expr.name,
+                                         "Superclass must be a class.")
+
+            define(env, None)
+            method_env = env
+            if superclass is not None:
+                method_env = Environment(env, SUPER_SLOTS, [superclass])
+
+            functions = {}
+            for method, method_name, body in methods:
+                functions[method_name] = CompiledFunction(
+                    stmt=method,
+                    closure=method_env,
+                    is_initializer=method_name == "init",
+                    body=body)
+
+            define(env, Klass(stmt.name, superclass, functions))
+        return klass
+
+    def compile_condition(self, expr: Expr):
+        condition = self.compile(expr)
+        if is_boolean(expr):
+            return condition
+
+        def truthy(env):
+            return is_truthy(condition(env))
+        return truthy
+
+    def visit_if_stmt(self, stmt: IfStmt):
+        condition = self.compile_condition(stmt.condition)
+        then_branch = self.compile(stmt.then_branch)
+        if stmt.else_branch is None:
+            def if_then(env):
+                if condition(env):
+                    return then_branch(env)
+            return if_then
+
+        else_branch = self.compile(stmt.else_branch)
+
+        def if_then_else(env):
+            if condition(env):
+                return then_branch(env)
+            return else_branch(env)
+        return if_then_else
+
+    def visit_while_stmt(self, stmt: WhileStmt):
+        condition = self.compile_condition(stmt.condition)
+        body = self.compile(stmt.body)
+
+        def while_loop(env):
+            while condition(env):
+                if body(env) is RETURN:
+                    return RETURN
+        return while_loop
+
+    def visit_for_in_stmt(self, stmt: ForInStmt):
+        iterable = self.compile(stmt.iterable)
+        body = self.compile(stmt.body)
+        name = stmt.name
+        slots = stmt.slots
+        slot = stmt.slot
+
+        def values_of(env):
+            try:
+                return iterate(iterable(env))
+            except NativeError as e:
+                raise InterpretError(name, e.message) from None
+
+        # slots が None なら、ループ変数は現在の環境のスロットにある
+        if slots is None:
+            def for_in(env):
+                variables = env.values
+                for value in values_of(env):
+                    variables[slot] = value
+                    if body(env) is RETURN:
+                        return RETURN
+            return for_in
+
+        def for_in_scope(env):
+            values = values_of(env)
+            environment = Environment(env, slots)
+            variables = environment.values
+            for value in values:
+                variables[slot] = value
+                if body(environment) is RETURN:
+                    return RETURN
+        return for_in_scope
+
+    #
+    # expressions
+    #
+
+    def visit_literal_expr(self, expr: LiteralExpr):
+        value = expr.value
+
+        def literal(env):
+            return value
+        return literal
+
+    def visit_grouping_expr(self, expr: GroupingExpr):
+        return self.compile(expr.expression)
+
+    def visit_variable_expr(self, expr: VariableExpr):
+        return self.variable_getter(expr, expr.name)
+
+    def visit_this_expr(self, expr: ThisExpr):
+        return self.variable_getter(expr, expr.keyword)
+
+    def variable_getter(self, expr: Expr, name: Token):
+        key = name.lexeme
+        slot = expr.slot
+
+        match expr.depth:
+            case None:
+                variables = self.globals.variables
+
+                def global_variable(env):
+                    try:
+                        return variables[key]
+                    except KeyError:
+                        raise InterpretError(
+                            name, f"Undefined variable: '{key}'") from None
+                return global_variable
+            case 0:
+                def local0(env):
+                    return env.values[slot]
+                return local0
+            case 1:
+                def local1(env):
+                    return env.enclosing.values[slot]
+                return local1
+            case 2:
+                def local2(env):
+                    return env.enclosing.enclosing.values[slot]
+                return local2
+            case distance:
+                def local(env):
+                    return env.ancestor(distance).values[slot]
+                return local
+
+    def visit_assign_expr(self, expr: AssignExpr):
+        name = expr.name
+        key = name.lexeme
+        value = self.compile(expr.value)
+        slot = expr.slot
+
+        match expr.depth:
+            case None:
+                variables = self.globals.variables
+
+                def assign_global(env):
+                    result = value(env)
+                    if key not in variables and not variables.defines(key):
+                        raise InterpretError(
+                            name, f"Undefined variable: '{key}'")
+                    variables[key] = result
+                    return result
+                return assign_global
+            case 0:
+                def assign0(env):
+                    result = env.values[slot] = value(env)
+                    return result
+                return assign0
+            case 1:
+                def assign1(env):
+                    result = env.enclosing.values[slot] = value(env)
+                    return result
+                return assign1
+            case distance:
+                def assign(env):
+                    result = value(env)
+                    env.ancestor(distance).values[slot] = result
+                    return result
+                return assign
+
+    def visit_unary_expr(self, expr: UnaryExpr):
+        operator = expr.operator
+        operand = self.compile(expr.operand)
+        match operator.type:
+            case TokenType.MINUS:
+                def negate(env):
+                    value = operand(env)
+                    if not is_numeric(value):
+                        raise InterpretError(operator,
+                                             "Operand must be number")
+                    return - value
+                return negate
+            case TokenType.NOT | TokenType.BANG:
+                def logical_not(env):
+                    return not is_truthy(operand(env))
+                return logical_not
+            case _:
+                raise InterpretError(operator, "Unreachable")
+
+    def visit_ternary_expr(self, expr: TernaryExpr):
+        condition = self.compile_condition(expr.condition)
+        then_expr = self.compile(expr.then_expr)
+        else_expr = self.compile(expr.else_expr)
+
+        def ternary(env):
+            if condition(env):
+                return then_expr(env)
+            return else_expr(env)
+        return ternary
+
+    def visit_logical_expr(self, expr: LogicalExpr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+
+        match expr.operator.type:
+            case TokenType.OR | TokenType.DOUBLE_PIPE:
+                def logical_or(env):
+                    value = left(env)
+                    if is_truthy(value):
+                        return value
+                    return right(env)
+                return logical_or
+            case TokenType.AND | TokenType.DOUBLE_AMPERSAND:
+                def logical_and(env):
+                    value = left(env)
+                    if not is_truthy(value):
+                        return value
+                    return right(env)
+                return logical_and
+            case _:
+                def logical(env):
+                    left(env)
+                    return right(env)
+                return logical
+
+    def visit_binary_expr(self, expr: BinaryExpr):
+        operator = expr.operator
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+
+        match operator.type:
+            case TokenType.PLUS:
+                def add(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    if isinstance(lhs, NUMERIC) and isinstance(rhs, NUMERIC):
+                        return lhs + rhs
+                    elif isinstance(lhs, list) and isinstance(rhs, list):
+                        return lhs + rhs
+                    elif isinstance(lhs, dict) and isinstance(rhs, dict):
+                        return {**lhs, **rhs}
+                    else:
+                        return concat(lhs, rhs)
+                return add
+            case TokenType.DOUBLE_SLASH:
+                def floor_divide(env):
+                    return left(env) // right(env)
+                return floor_divide
+            case TokenType.DOUBLE_EQUAL:
+                def equal(env):
+                    return is_equal(left(env), right(env))
+                return equal
+            case TokenType.BANG_EQUAL:
+                def not_equal(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    if lhs is None:
+                        return rhs is not None
+                    return lhs != rhs
+                return not_equal
+            case operator_type if operator_type in NUMERIC_OPERATORS:
+                function = NUMERIC_OPERATORS[operator_type]
+
+                def numeric(env):
+                    lhs = left(env)
+                    rhs = right(env)
+                    if not (isinstance(lhs, NUMERIC)
+                            and isinstance(rhs, NUMERIC)):
+                        raise InterpretError(operator,
+                                             "Operands must be numbers")
+                    return function(lhs, rhs)
+                return numeric
+            case _:
+                raise InterpretError(operator, "Unreachable")
+
+    def visit_call_expr(self, expr: CallExpr):
+        if isinstance(expr.callee, SuperExpr):
+            return self.compile_super_invoke(expr)
+        if expr.cache is not None:
+            return self.compile_invoke(expr)
+
+        paren = expr.paren
+        callee = self.compile(expr.callee)
+        arguments = tuple(self.compile(arg) for arg in expr.arguments)
+        interpreter = self.interpreter
+
+        def call(env):
+            function = callee(env)
+            values = [argument(env) for argument in arguments]
+            if not isinstance(function, Callable):
+                raise InterpretError(
+                    paren, "Can only callable functions and classes.")
+
+            if (actual := len(values)) != (expected := function.arity()):
+                raise InterpretError(
+                    paren,
+                    f"Expected {expected} arguments but got {actual}."
+                )
+            try:
+                return function.call(interpreter, values)
+            except NativeError as e:
+                raise InterpretError(paren, e.message) from None
+        return call
+
+    def value_caller(self, paren: Token, arguments: tuple):
+        "呼び出し対象の値を受け取り、引数を評価して呼び出すクロージャ"
+        interpreter = self.interpreter
+
+        def call_value(env, function):
+            values = [argument(env) for argument in arguments]
+            if not isinstance(function, Callable):
+                raise InterpretError(
+                    paren, "Can only callable functions and classes.")
+
+            if (actual := len(values)) != (expected := function.arity()):
+                raise InterpretError(
+                    paren,
+                    f"Expected {expected} arguments but got {actual}."
+                )
+            try:
+                return function.call(interpreter, values)
+            except NativeError as e:
+                raise InterpretError(paren, e.message) from None
+        return call_value
+
+    def compile_invoke(self, expr: CallExpr):
+        "obj.name(...) をインラインキャッシュで引いたメソッドで直接呼び出す"
+        paren = expr.paren
+        object = self.compile(expr.callee.object)
+        property = expr.callee.name
+        lookup = expr.cache.lookup
+        arguments = tuple(self.compile(arg) for arg in expr.arguments)
+        arity = len(arguments)
+        call_value = self.value_caller(paren, arguments)
+        interpreter = self.interpreter
+
+        def invoke(env):
+            invocant = object(env)
+            method = None
+            if isinstance(invocant, Instance):
+                method = lookup(invocant.shape)
+            if method is None:
+                # フィールドの関数、構文糖衣、またはエラー
+                return call_value(env, get_property(env, invocant, property))
+
+            values = [argument(env) for argument in arguments]
+            if arity != (expected := method.arity()):
+                raise InterpretError(
+                    paren,
+                    f"Expected {expected} arguments but got {arity}."
+                )
+            try:
+                return method.call_method(interpreter, invocant, values)
+            except NativeError as e:
+                raise InterpretError(paren, e.message) from None
+        return invoke
+
+    def compile_super_invoke(self, expr: CallExpr):
+        "super.name(...) を、束縛したメソッドを作らずに呼び出す"
+        paren = expr.paren
+        this_distance = expr.callee.this_depth
+        find_method = self.super_method_finder(expr.callee)
+        arguments = tuple(self.compile(arg) for arg in expr.arguments)
+        arity = len(arguments)
+        interpreter = self.interpreter
+
+        def super_invoke(env):
+            invocant = env.get_at(this_distance, 0)
+            method = find_method(env)
+            values = [argument(env) for argument in arguments]
+            if arity != (expected := method.arity()):
+                raise InterpretError(
+                    paren,
+                    f"Expected {expected} arguments but got {arity}."
+                )
+            try:
+                return method.call_method(interpreter, invocant, values)
+            except NativeError as e:
+                raise InterpretError(paren, e.message) from None
+        return super_invoke
+
+    def visit_get_expr(self, expr: GetExpr):
+        object = self.compile(expr.object)
+        property = expr.name
+        cache = expr.cache
+
+        def get(env):
+            invocant = object(env)
+            if isinstance(invocant, Instance):
+                if invocant.shape is cache.shape:
+                    return invocant.values[cache.slot]
+                return cache.get(invocant)
+            return get_property(env, invocant, property)
+        return get
+
+    def visit_set_expr(self, expr: SetExpr):
+        object = self.compile(expr.object)
+        value = self.compile(expr.value)
+        name = expr.name
+        set_field = expr.cache.set
+
+        def set(env):
+            target = object(env)
+
+            match(target):
+                case list():
+                    result = value(env)
+                    target.set(name, result)
+                    return result
+                case dict():
+                    pass
+                case Instance():
+                    result = value(env)
+                    set_field(target, result)
+                    return result
+                case _:
+                    raise InterpretError(name,
+                                         "Only instances have fields.")
+        return set
+
+    def visit_index_get_expr(self, expr: IndexGetExpr):
+        collection = self.compile(expr.collection)
+        index = self.compile(expr.index)
+
+        def index_get(env):
+            return collection(env)[index(env)]
+        return index_get
+
+    def visit_index_set_expr(self, expr: IndexSetExpr):
+        collection = self.compile(expr.collection)
+        index = self.compile(expr.index)
+        value = self.compile(expr.value)
+
+        def index_set(env):
+            target = collection(env)
+            key = index(env)
+            result = value(env)
+            target[key] = result
+            return result
+        return index_set
+
+    def visit_range_expr(self, expr: RangeExpr):
+        start = self.compile(expr.start)
+        stop = self.compile(expr.stop)
+        step = self.compile(expr.step)
+        operator = expr.operator
+        inclusive = is_inclusive(operator)
+
+        def number_range(env):
+            first = start(env)
+            last = stop(env)
+            if not (isinstance(first, NUMERIC) and isinstance(last, NUMERIC)):
+                raise InterpretError(operator, "Operands must be numbers")
+            return NumberRange(first, last, step(env), inclusive)
+        return number_range
+
+    def visit_super_expr(self, expr: SuperExpr):
+        this_distance = expr.this_depth
+        find_method = self.super_method_finder(expr)
+
+        def super_method(env):
+            return find_method(env).bind(env.get_at(this_distance, 0))
+        return super_method
+
+    def super_method_finder(self, expr: SuperExpr):
+        "スーパークラスのメソッドをインラインキャッシュで引くクロージャ"
+        super_distance = expr.depth
+        method_name = expr.method
+        lookup = expr.cache.lookup
+
+        def find_method(env):
+            method = lookup(env.get_at(super_distance, 0).shape)
+            if method is None:
+                raise InterpretError(
+                    method_name,
+                    f"Undefined property '{method_name.lexeme}'.")
+            return method
+        return find_method
+
+    def visit_function_expr(self, expr: FunctionExpr):
+        body = self.compile_statements(expr.body)
+
+        def function(env):
+            return CompiledFunction(expr=expr,
+                                    closure=env,
+                                    is_initializer=False,
+                                    body=body)
+        return function
+
+    def visit_list_expr(self, expr: ListExpr):
+        elements = tuple(self.compile(element) for element in expr.elements)
+
+        def list_literal(env):
+            return [element(env) for element in elements]
+        return list_literal
+
+    def visit_map_expr(self, expr: MapExpr):
+        elements = tuple((self.compile(key), self.compile(value))
+                         for key, value in expr.elements)
+
+        def map_literal(env):
+            return {key(env): value(env) for key, value in elements}
+        return map_literal
+
+
+class ClosureInterpreter(Interpreter):
+    "ASTを一度クロージャの木にコンパイルしてから実行するエンジン"
+
+    def __init__(self, error_reporter: ErrorReporter):
+        super().__init__(error_reporter)
+        self.compiler = ClosureCompiler(self)
+
+    def prepare(self, statements: list[Stmt]):
+        compiled = self.compiler.compile_statements(statements)
+        globals = self.globals
+
+        def program():
+            for statement in compiled:
+                statement(globals)
+        return program
@@ -0,0 +1,612 @@
+from enum import IntEnum, auto
+from oneliner.token import Token, TokenType
+from oneliner.resolver import FunctionType
+from oneliner.klass import MethodCache, PropertyCache
+from oneliner.expr import Expr, ExprVisitor, LiteralExpr, GroupingExpr, \
+    SetExpr, BinaryExpr, SuperExpr, TernaryExpr, VariableExpr, AssignExpr, \
+    LogicalExpr, CallExpr, GetExpr, ThisExpr, UnaryExpr, FunctionExpr, \
+    ListExpr, MapExpr, IndexGetExpr, IndexSetExpr, RangeExpr
+from oneliner.stmt import Stmt, StmtVisitor, EmptyStmt, ExpressionStmt, \
+    VarStmt, BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt, \
+    ClassStmt, ForInStmt
+
+
+class OpCode(IntEnum):
+    CONSTANT = auto()       # const_index
+    NIL = auto()
+    TRUE = auto()
+    FALSE = auto()
+    POP = auto()
+    GET_LOCAL = auto()      # slot
+    SET_LOCAL = auto()      # slot
+    GET_GLOBAL = auto()     # name_index
+    DEFINE_GLOBAL = auto()  # name_index
+    SET_GLOBAL = auto()     # name_index
+    GET_UPVALUE = auto()    # upvalue_index
+    SET_UPVALUE = auto()    # upvalue_index
+    GET_PROPERTY = auto()   # cache_index, target (インスタンス以外ならtargetへ進まない)
+    SET_PROPERTY = auto()   # cache_index
+    PARTIAL = auto()        # obj.foo の構文糖衣: foo(obj, ...)
+    GET_INDEX = auto()
+    SET_INDEX = auto()
+    GET_SUPER = auto()      # cache_index
+    EQUAL = auto()
+    NOT_EQUAL = auto()
+    GREATER = auto()
+    GREATER_EQUAL = auto()
+    LESS = auto()
+    LESS_EQUAL = auto()
+    ADD = auto()
+    SUBTRACT = auto()
+    MULTIPLY = auto()
+    DIVIDE = auto()
+    FLOOR_DIVIDE = auto()
+    MODULO = auto()
+    NOT = auto()
+    NEGATE = auto()
+    JUMP = auto()                   # target
+    JUMP_IF_FALSE = auto()          # target (条件をpopする)
+    JUMP_IF_TRUE_OR_POP = auto()    # target
+    JUMP_IF_FALSE_OR_POP = auto()   # target
+    CALL = auto()                   # argc
+    INVOKE = auto()                 # cache_index, target
+    SUPER_INVOKE = auto()           # cache_index
+    CLOSURE = auto()        # proto_index, (is_local, index) * upvalue_count
+    CLOSE_UPVALUE = auto()
+    RETURN = auto()
+    CLASS = auto()          # name_index
+    INHERIT = auto()
+    METHOD = auto()         # name_index
+    BUILD_LIST = auto()     # count
+    BUILD_MAP = auto()      # count
+    GET_ITER = auto()
+    FOR_ITER = auto()       # iterator_slot, target (終わったらtargetへ)
+    RANGE = auto()          # inclusive
+
+
+# オペランドの数(CLOSUREは可変長)
+OPERAND_COUNTS = {
+    OpCode.CONSTANT: 1,
+    OpCode.GET_LOCAL: 1,
+    OpCode.SET_LOCAL: 1,
+    OpCode.GET_GLOBAL: 1,
+    OpCode.DEFINE_GLOBAL: 1,
+    OpCode.SET_GLOBAL: 1,
+    OpCode.GET_UPVALUE: 1,
+    OpCode.SET_UPVALUE: 1,
+    OpCode.GET_PROPERTY: 2,
+    OpCode.SET_PROPERTY: 1,
+    OpCode.GET_SUPER: 1,
+    OpCode.JUMP: 1,
+    OpCode.JUMP_IF_FALSE: 1,
+    OpCode.JUMP_IF_TRUE_OR_POP: 1,
+    OpCode.JUMP_IF_FALSE_OR_POP: 1,
+    OpCode.CALL: 1,
+    OpCode.INVOKE: 2,
+    OpCode.SUPER_INVOKE: 1,
+    OpCode.CLOSURE: 1,
+    OpCode.CLASS: 1,
+    OpCode.METHOD: 1,
+    OpCode.BUILD_LIST: 1,
+    OpCode.BUILD_MAP: 1,
+    OpCode.FOR_ITER: 2,
+    OpCode.RANGE: 1,
+}
+
+BINARY_OPCODES = {
+    TokenType.PLUS: OpCode.ADD,
+    TokenType.MINUS: OpCode.SUBTRACT,
+    TokenType.STAR: OpCode.MULTIPLY,
+    TokenType.SLASH: OpCode.DIVIDE,
+    TokenType.DOUBLE_SLASH: OpCode.FLOOR_DIVIDE,
+    TokenType.PERCENT: OpCode.MODULO,
+    TokenType.GREATER: OpCode.GREATER,
+    TokenType.GREATER_EQUAL: OpCode.GREATER_EQUAL,
+    TokenType.LESS: OpCode.LESS,
+    TokenType.LESS_EQUAL: OpCode.LESS_EQUAL,
+    TokenType.DOUBLE_EQUAL: OpCode.EQUAL,
+    TokenType.BANG_EQUAL: OpCode.NOT_EQUAL,
+}
+
+
+class FunctionProto:
+    "コンパイル済みの関数。バイトコード、定数表、上位値(upvalue)の数を持つ"
+
+    def __init__(self, name: Token | None, arity: int, kind: FunctionType):
+        self.name = name
+        self.arity = arity
+        self.kind = kind
+        self.code: list[int] = []
+        # 命令ごとの元のトークン(実行時エラーの行番号に使う)
+        self.tokens: list[Token | None] = []
+        self.constants: list = []
+        self.upvalue_count = 0
+
+    def __str__(self):
+        return f"<fn {self.name.lexeme}>" if self.name else "<script>"
+
+
+class Local:
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.is_captured = False
+
+
+class FunctionState:
+    "コンパイル中の関数ごとの状態(ローカル変数のスロットと上位値)"
+
+    def __init__(self, enclosing, proto: FunctionProto):
+        self.enclosing: FunctionState | None = enclosing
+        self.proto = proto
+        self.scope_depth = 0
+        self.upvalues: list[tuple[bool, int]] = []
+        self.constant_indices = {}
+
+        # スロット0はメソッドならthis、それ以外は使わない
+        if proto.kind in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.locals = [Local("this", 0)]
+        else:
+            self.locals = [Local("", 0)]
+
+
+class Compiler(ExprVisitor, StmtVisitor):
+    "解決済みのStmt/Exprの木をバイトコードに変換する"
+
+    def __init__(self):
+        self.state: FunctionState | None = None
+
+    def compile(self, statements: list[Stmt]) -> FunctionProto:
+        self.state = FunctionState(None,
+                                   FunctionProto(None, 0, FunctionType.NONE))
+        for statement in statements:
+            self.compile_node(statement)
+        self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN)
+        return self.state.proto
+
+    def compile_node(self, node: Expr | Stmt):
+        node.accept(self)
+
+    #
+    # emit
+    #
+
+    def emit(self, op: OpCode, *operands: int, token: Token | None = None):
+        proto = self.state.proto
+        proto.code.append(op)
+        proto.code.extend(operands)
+        proto.tokens.extend([token] * (1 + len(operands)))
+
+    def emit_jump(self, op: OpCode, *operands: int,
+                  token: Token | None = None) -> int:
+        "飛び先を最後のオペランドに持つ命令を出力し、後で埋める位置を返す"
+        self.emit(op, *operands, -1, token=token)
+        return len(self.state.proto.code) - 1
+
+    def patch_jump(self, operand: int):
+        self.state.proto.code[operand] = len(self.state.proto.code)
+
+    def make_constant(self, value) -> int:
+        proto = self.state.proto
+        # True と 1 を区別するため型もキーに含める
+        try:
+            key = (type(value), value)
+            index = self.state.constant_indices.get(key)
+        except TypeError:
+            key, index = None, None
+        if index is None:
+            proto.constants.append(value)
+            index = len(proto.constants) - 1
+            if key is not None:
+                self.state.constant_indices[key] = index
+        return index
+
+    #
+    # scopes and variables
+    #
+
+    def begin_scope(self):
+        self.state.scope_depth += 1
+
+    def end_scope(self):
+        state = self.state
+        state.scope_depth -= 1
+        while state.locals and state.locals[-1].depth > state.scope_depth:
+            if state.locals[-1].is_captured:
+                self.emit(OpCode.CLOSE_UPVALUE)
+            else:
+                self.emit(OpCode.POP)
+            state.locals.pop()
+
+    def add_local(self, name: str):
+        self.state.locals.append(Local(name, self.state.scope_depth))
+
+    def define_variable(self, name: Token):
+        "スタックトップの値を変数として定義する"
+        if self.state.scope_depth > 0:
+            self.add_local(name.lexeme)
+        else:
+            self.emit(OpCode.DEFINE_GLOBAL,
+                      self.make_constant(name.lexeme),
+                      token=name)
+
+    def resolve_local(self, state: FunctionState, name: str) -> int | None:
+        for i in range(len(state.locals) - 1, -1, -1):
+            if state.locals[i].name == name:
+                return i
+        return None
+
+    def resolve_upvalue(self, state: FunctionState, name: str) -> int | None:
+        if state.enclosing is None:
+            return None
+
+        local = self.resolve_local(state.enclosing, name)
+        if local is not None:
+            state.enclosing.locals[local].is_captured = True
+            return self.add_upvalue(state, True, local)
+
+        upvalue = self.resolve_upvalue(state.enclosing, name)
+        if upvalue is not None:
+            return self.add_upvalue(state, False, upvalue)
+
+        return None
+
+    def add_upvalue(self, state: FunctionState, is_local: bool, index: int):
+        upvalue = (is_local, index)
+        if upvalue in state.upvalues:
+            return state.upvalues.index(upvalue)
+        state.upvalues.append(upvalue)
+        state.proto.upvalue_count = len(state.upvalues)
+        return len(state.upvalues) - 1
+
+    def variable_ops(self, name: Token) -> tuple[OpCode, OpCode, int]:
+        if (slot := self.resolve_local(self.state, name.lexeme)) is not None:
+            return OpCode.GET_LOCAL, OpCode.SET_LOCAL, slot
+        if (index := self.resolve_upvalue(self.state, name.lexeme)) \
+                is not None:
+            return OpCode.GET_UPVALUE, OpCode.SET_UPVALUE, index
+        return OpCode.GET_GLOBAL, OpCode.SET_GLOBAL, \
+            self.make_constant(name.lexeme)
+
+    def get_variable(self, name: Token):
+        get_op, _, arg = self.variable_ops(name)
+        self.emit(get_op, arg, token=name)
+
+    def set_variable(self, name: Token):
+        _, set_op, arg = self.variable_ops(name)
+        self.emit(set_op, arg, token=name)
+
+    #
+    # statements
+    #
+
+    def visit_expression_stmt(self, stmt: ExpressionStmt):
+        self.compile_node(stmt.expression)
+        self.emit(OpCode.POP)
+
+    def visit_empty_stmt(self, stmt: EmptyStmt):
+        pass
+
+    def visit_var_stmt(self, stmt: VarStmt):
+        if stmt.initializer is not None:
+            self.compile_node(stmt.initializer)
+        else:
+            self.emit(OpCode.NIL)
+        self.define_variable(stmt.name)
+
+    def visit_function_stmt(self, stmt: FunctionStmt):
+        # 再帰呼び出しのため、本体より先にローカル変数として宣言する
+        if self.state.scope_depth > 0:
+            self.add_local(stmt.name.lexeme)
+            self.function(stmt.name, stmt.function, FunctionType.FUNCTION)
+        else:
+            self.function(stmt.name, stmt.function, FunctionType.FUNCTION)
+            self.define_variable(stmt.name)
+
+    def function(self, name: Token | None, function: FunctionExpr,
+                 kind: FunctionType):
+        state = FunctionState(self.state,
+                              FunctionProto(name, len(function.params), kind))
+        self.state = state
+        self.begin_scope()
+        for param in function.params:
+            self.add_local(param.lexeme)
+        for statement in function.body:
+            self.compile_node(statement)
+        self.emit_return()
+        self.state = state.enclosing
+
+        operands = [self.make_constant(state.proto)]
+        for is_local, index in state.upvalues:
+            operands.extend((1 if is_local else 0, index))
+        self.emit(OpCode.CLOSURE, *operands, token=name)
+
+    def emit_return(self, token: Token | None = None):
+        if self.state.proto.kind == FunctionType.INITIALIZER:
+            self.emit(OpCode.GET_LOCAL, 0)
+        else:
+            self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN, token=token)
+
+    def visit_return_stmt(self, stmt: ReturnStmt):
+        if stmt.value is None or \
+                self.state.proto.kind == FunctionType.INITIALIZER:
+            self.emit_return(stmt.keyword)
+            return
+        if stmt.tail:
+            self.compile_tail(stmt.value, stmt.keyword)
+            return
+        self.compile_node(stmt.value)
+        self.emit(OpCode.RETURN, token=stmt.keyword)
+
+    def compile_tail(self, expr: Expr, keyword: Token):
+        """
+        末尾位置の呼び出しの直後に RETURN を置く。
+        VMは CALL の次が RETURN なら、呼び出し元のフレームを再利用する
+        """
+        match expr:
+            case TernaryExpr():
+                self.compile_node(expr.condition)
+                else_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+                self.compile_tail(expr.then_expr, keyword)
+                self.patch_jump(else_jump)
+                self.compile_tail(expr.else_expr, keyword)
+            case GroupingExpr():
+                self.compile_tail(expr.expression, keyword)
+            case _:
+                self.compile_node(expr)
+                self.emit(OpCode.RETURN, token=keyword)
+
+    def visit_block_stmt(self, stmt: BlockStmt):
+        self.begin_scope()
+        for statement in stmt.statements:
+            self.compile_node(statement)
+        self.end_scope()
+
+    def visit_class_stmt(self, stmt: ClassStmt):
+        name = stmt.name
+        self.emit(OpCode.CLASS, self.make_constant(name), token=name)
+        self.define_variable(name)
+
+        if stmt.superclass is not None:
+            self.get_variable(stmt.superclass.name)
+            self.begin_scope()
+            self.add_local("super")
+            self.get_variable(name)
+            self.emit(OpCode.INHERIT, token=stmt.superclass.name)
+
+        self.get_variable(name)
+        for method in stmt.methods:
+            kind = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                kind = FunctionType.INITIALIZER
+            self.function(method.name, method.function, kind)
+            self.emit(OpCode.METHOD,
+                      self.make_constant(method.name.lexeme),
+                      token=method.name)
+        self.emit(OpCode.POP)
+
+        if stmt.superclass is not None:
+            self.end_scope()
+
+    def visit_if_stmt(self, stmt: IfStmt):
+        self.compile_node(stmt.condition)
+        else_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        self.compile_node(stmt.then_branch)
+        if stmt.else_branch is None:
+            self.patch_jump(else_jump)
+            return
+
+        end_jump = self.emit_jump(OpCode.JUMP)
+        self.patch_jump(else_jump)
+        self.compile_node(stmt.else_branch)
+        self.patch_jump(end_jump)
+
+    def visit_while_stmt(self, stmt: WhileStmt):
+        loop_start = len(self.state.proto.code)
+        self.compile_node(stmt.condition)
+        exit_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        self.compile_node(stmt.body)
+        self.emit(OpCode.JUMP, loop_start)
+        self.patch_jump(exit_jump)
+
+    def visit_for_in_stmt(self, stmt: ForInStmt):
+        # イテレータとループ変数はループのスコープのローカル変数に置く
+        self.begin_scope()
+        self.compile_node(stmt.iterable)
+        self.emit(OpCode.GET_ITER, token=stmt.name)
+        self.add_local("")
+        iterator = len(self.state.locals) - 1
+        self.emit(OpCode.NIL)
+        self.add_local(stmt.name.lexeme)
+        variable = len(self.state.locals) - 1
+
+        loop_start = len(self.state.proto.code)
+        exit_jump = self.emit_jump(OpCode.FOR_ITER, iterator)
+        self.emit(OpCode.SET_LOCAL, variable)
+        self.emit(OpCode.POP)
+        self.begin_scope()
+        self.compile_node(stmt.body)
+        self.end_scope()
+        self.emit(OpCode.JUMP, loop_start)
+        self.patch_jump(exit_jump)
+        self.end_scope()
+
+    #
+    # expressions
+    #
+
+    def visit_literal_expr(self, expr: LiteralExpr):
+        match expr.value:
+            case None:
+                self.emit(OpCode.NIL)
+            case True:
+                self.emit(OpCode.TRUE)
+            case False:
+                self.emit(OpCode.FALSE)
+            case value:
+                self.emit(OpCode.CONSTANT, self.make_constant(value))
+
+    def visit_grouping_expr(self, expr: GroupingExpr):
+        self.compile_node(expr.expression)
+
+    def visit_range_expr(self, expr: RangeExpr):
+        self.compile_node(expr.start)
+        self.compile_node(expr.stop)
+        self.compile_node(expr.step)
+        inclusive = expr.operator.type in (TokenType.LESS_EQUAL,
+                                           TokenType.GREATER_EQUAL)
+        self.emit(OpCode.RANGE, int(inclusive), token=expr.operator)
+
+    def visit_unary_expr(self, expr: UnaryExpr):
+        self.compile_node(expr.operand)
+        match expr.operator.type:
+            case TokenType.MINUS:
+                self.emit(OpCode.NEGATE, token=expr.operator)
+            case TokenType.NOT | TokenType.BANG:
+                self.emit(OpCode.NOT, token=expr.operator)
+
+    def visit_binary_expr(self, expr: BinaryExpr):
+        self.compile_node(expr.left)
+        self.compile_node(expr.right)
+        self.emit(BINARY_OPCODES[expr.operator.type], token=expr.operator)
+
+    def visit_logical_expr(self, expr: LogicalExpr):
+        self.compile_node(expr.left)
+        match expr.operator.type:
+            case TokenType.OR | TokenType.DOUBLE_PIPE:
+                end_jump = self.emit_jump(OpCode.JUMP_IF_TRUE_OR_POP)
+            case _:
+                end_jump = self.emit_jump(OpCode.JUMP_IF_FALSE_OR_POP)
+        self.compile_node(expr.right)
+        self.patch_jump(end_jump)
+
+    def visit_ternary_expr(self, expr: TernaryExpr):
+        self.compile_node(expr.condition)
+        else_jump = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        self.compile_node(expr.then_expr)
+        end_jump = self.emit_jump(OpCode.JUMP)
+        self.patch_jump(else_jump)
+        self.compile_node(expr.else_expr)
+        self.patch_jump(end_jump)
+
+    def visit_variable_expr(self, expr: VariableExpr):
+        self.get_variable(expr.name)
+
+    def visit_assign_expr(self, expr: AssignExpr):
+        self.compile_node(expr.value)
+        self.set_variable(expr.name)
+
+    def visit_this_expr(self, expr: ThisExpr):
+        self.get_variable(expr.keyword)
+
+    def visit_call_expr(self, expr: CallExpr):
+        # スタックには [呼び出し対象, レシーバ(関数ならnil), 引数...] を積む
+        match expr.callee:
+            case GetExpr(object=object, name=name):
+                # インスタンスならメソッドを束縛せずにレシーバと共に積む。
+                # それ以外は obj.foo(x) == foo(obj, x) の構文糖衣。
+                # メソッドは呼び出し箇所のインラインキャッシュで引く
+                self.compile_node(object)
+                sugar = self.emit_jump(OpCode.INVOKE,
+                                       self.make_constant(expr.cache),
+                                       token=name)
+                self.get_variable(name)
+                self.emit(OpCode.PARTIAL, token=name)
+                self.emit(OpCode.NIL)
+                self.patch_jump(sugar)
+            case SuperExpr(keyword=keyword, method=method):
+                self.get_variable(Token(TokenType.THIS, "this", None,
+                                        keyword.line))
+                self.get_variable(keyword)
+                self.emit(OpCode.SUPER_INVOKE,
+                          self.make_constant(expr.callee.cache),
+                          token=method)
+            case callee:
+                self.compile_node(callee)
+                self.emit(OpCode.NIL)
+
+        for argument in expr.arguments:
+            self.compile_node(argument)
+        self.emit(OpCode.CALL, len(expr.arguments), token=expr.paren)
+
+    def visit_get_expr(self, expr: GetExpr):
+        self.compile_node(expr.object)
+        sugar = self.emit_jump(OpCode.GET_PROPERTY,
+                               self.make_constant(expr.cache),
+                               token=expr.name)
+        self.get_variable(expr.name)
+        self.emit(OpCode.PARTIAL, token=expr.name)
+        self.patch_jump(sugar)
+
+    def visit_set_expr(self, expr: SetExpr):
+        self.compile_node(expr.object)
+        self.compile_node(expr.value)
+        self.emit(OpCode.SET_PROPERTY, self.make_constant(expr.cache),
+                  token=expr.name)
+
+    def visit_index_get_expr(self, expr: IndexGetExpr):
+        self.compile_node(expr.collection)
+        self.compile_node(expr.index)
+        self.emit(OpCode.GET_INDEX, token=expr.bracket)
+
+    def visit_index_set_expr(self, expr: IndexSetExpr):
+        self.compile_node(expr.collection)
+        self.compile_node(expr.index)
+        self.compile_node(expr.value)
+        self.emit(OpCode.SET_INDEX, token=expr.bracket)
+
+    def visit_super_expr(self, expr: SuperExpr):
+        self.get_variable(Token(TokenType.THIS, "this", None,
+                                expr.keyword.line))
+        self.get_variable(expr.keyword)
+        self.emit(OpCode.GET_SUPER, self.make_constant(expr.cache),
+                  token=expr.method)
+
+    def visit_function_expr(self, expr: FunctionExpr):
+        self.function(None, expr, FunctionType.FUNCTION)
+
+    def visit_list_expr(self, expr: ListExpr):
+        for element in expr.elements:
+            self.compile_node(element)
+        self.emit(OpCode.BUILD_LIST, len(expr.elements))
+
+    def visit_map_expr(self, expr: MapExpr):
+        for key, value in expr.elements:
+            self.compile_node(key)
+            self.compile_node(value)
+        self.emit(OpCode.BUILD_MAP, len(expr.elements))
+
+
+def disassemble(proto: FunctionProto) -> str:
+    "デバッグ用にバイトコードを人が読める形式にする"
+    lines = [f"== {proto} =="]
+    nested = []
+    code = proto.code
+    ip = 0
+    while ip < len(code):
+        op = OpCode(code[ip])
+        count = OPERAND_COUNTS.get(op, 0)
+        operands = code[ip + 1:ip + 1 + count]
+        text = f"{ip:04d} {op.name:<20} " + " ".join(map(str, operands))
+        if op in (OpCode.CONSTANT, OpCode.GET_GLOBAL, OpCode.SET_GLOBAL,
+                  OpCode.DEFINE_GLOBAL, OpCode.GET_PROPERTY,
+                  OpCode.SET_PROPERTY, OpCode.GET_SUPER, OpCode.INVOKE,
+                  OpCode.SUPER_INVOKE, OpCode.CLOSURE, OpCode.CLASS,
+                  OpCode.METHOD):
+            constant = proto.constants[operands[0]]
+            if isinstance(constant, (MethodCache, PropertyCache)):
+                constant = constant.name
+            if isinstance(constant, Token):
+                constant = constant.lexeme
+            text += f"  ; {constant}"
+            if isinstance(constant, FunctionProto):
+                nested.append(constant)
+                count += 2 * constant.upvalue_count
+        lines.append(text)
+        ip += 1 + count
+
+    for function in nested:
+        lines.append(disassemble(function))
+    return "\n".join(lines)
@@ -3,18 +3,38 @@ from oneliner.error import InterpretError
 from typing import Self
 
 
+class Undefined:
+    "まだ宣言が実行されていないローカル変数のスロットの値"
+
+    def __repr__(self):
+        return "UNDEFINED"
+
+
+UNDEFINED = Undefined()
+
+
 class Environment:
-    def __init__(self, enclosing: Self | None = None):
-        self.variables = {}
+    """
+    ローカルスコープの環境。変数はResolverが割り当てたスロット番号で配列に格納される。
+    slotsは変数名からスロット番号への対応で、同じスコープの環境で共有される。
+    """
+    __slots__ = ("values", "enclosing", "slots")
+
+    def __init__(self,
+                 enclosing: Self | None,
+                 slots: dict[str, int],
+                 values: list | None = None):
+        if values is None:
+            values = [UNDEFINED] * len(slots)
+        self.values = values
         self.enclosing = enclosing
+        self.slots = slots
 
-    def define(self, name: str, value):
-        self.variables[name] = value
+    def get_at(self, distance: int, slot: int):
+        return self.ancestor(distance).values[slot]
 
-    def get_at(self, distance: int, name: str):
-        env = self.ancestor(distance)
-        assert name in env.variables
-        return env.variables[name]
+    def assign_at(self, distance: int, slot: int, value):
+        self.ancestor(distance).values[slot] = value
 
     def ancestor(self, distance: int):
         environment = self
@@ -23,25 +43,73 @@ class Environment:
         return environment
 
     def get(self, name: Token):
-        if name.lexeme in self.variables:
+        "名前で動的に変数を探す(解決済みでない参照のため)"
+        slot = self.slots.get(name.lexeme)
+        if slot is not None and self.values[slot] is not UNDEFINED:
+            return self.values[slot]
+        return self.enclosing.get(name)
+
+
+class GlobalVariables(dict):
+    """
+    グローバル変数の名前から値への辞書。
+    ネイティブ関数は起動を速くするため、見つからない名前を初めて引いたときに
+    まとめて登録する。同じ名前のグローバル変数が既にあればそちらを残す
+    """
+
+    def __init__(self, variables=()):
+        super().__init__(variables)
+        # まだ登録していないネイティブ関数の (名前, 値) を返す関数
+        self.pending = getattr(variables, "pending", None)
+
+    def defer(self, natives):
+        self.pending = natives
+
+    def load_natives(self) -> bool:
+        "まだ登録していないネイティブ関数を登録する。登録したら True を返す"
+        natives = self.pending
+        if natives is None:
+            return False
+        self.pending = None
+        for name, value in natives():
+            self.setdefault(name, value)
+        return True
+
+    def __missing__(self, key: str):
+        if self.load_natives():
+            return self[key]
+        raise KeyError(key)
+
+    def defines(self, key: str) -> bool:
+        "key があるか。なければネイティブ関数を登録してから確かめる"
+        return key in self or (self.load_natives() and key in self)
+
+
+class GlobalEnvironment:
+    "グローバルスコープの環境。変数は名前で管理される"
+
+    def __init__(self):
+        self.variables = GlobalVariables()
+        self.enclosing = None
+
+    def define(self, name: str, value):
+        self.variables[name] = value
+
+    def get(self, name: Token):
+        try:
             return self.variables[name.lexeme]
-        elif self.enclosing is not None:
-            return self.enclosing.get(name)
-        else:
-            raise InterpretError(name, f"Undefined variable: '{name.lexeme}'")
+        except KeyError:
+            raise InterpretError(
+                name, f"Undefined variable: '{name.lexeme}'") from None
 
     def assign(self, name: Token, value):
-
-        if name.lexeme in self.variables:
-            self.variables[name.lexeme] = value
-            return
-        elif self.enclosing is not None:
-            self.enclosing.assign(name, value)
+        variables = self.variables
+        key = name.lexeme
+        if key in variables or variables.defines(key):
+            variables[key] = value
             return
-        else:
-            raise InterpretError(name, f"Undefined variable: '{name.lexeme}'")
+        raise InterpretError(name, f"Undefined variable: '{key}'")
+
 
-    def assign_at(self, distance: int, name: Token, value):
-        env = self.ancestor(distance)
-        assert name.lexeme in env.variables
-        env.variables[name.lexeme] = value
+# サブクラスのメソッドの super を持つ環境のスロット
+SUPER_SLOTS = {"super": 0}
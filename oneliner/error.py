@@ -1,5 +1,4 @@
 from oneliner.token import Token, TokenType
-from oneliner.expr import Expr
 
 
 class ErrorReporter():
@@ -48,9 +47,35 @@ class InterpretError(Exception):
         self.token = token
         self.message = message
 
-# return is a special case of InterpretError
 
+class NativeError(Exception):
+    "ネイティブ関数の中のエラー。呼び出し箇所のトークンを付けてInterpretErrorにする"
 
-class Return(InterpretError):
-    def __init__(self, value: Expr):
-        self.value = value
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class InputError(Exception):
+    "-n / -p の入力のファイルを読めなかった。元の OSError を持つ"
+
+    def __init__(self, error: OSError):
+        super().__init__(str(error))
+        self.error = error
+
+
+class Signal:
+    """
+    文の実行結果として返す、制御の移動の合図。
+    例外を使わずに、関数の呼び出し元まで文の実行を打ち切っていく。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"<{self.name}>"
+
+
+# return文を実行した。戻り値は Interpreter.return_value に置かれている
+RETURN = Signal("return")
@@ -1,4 +1,8 @@
+from typing import TYPE_CHECKING
 from oneliner.token import Token
+
+if TYPE_CHECKING:
+    from oneliner.klass import MethodCache, PropertyCache
 from abc import ABC, abstractmethod
 
 
@@ -8,6 +12,10 @@ class Expr:
 
 
 class AssignExpr(Expr):
+    # Resolverが設定する
+    depth: int | None = None
+    slot: int | None = None
+
     def __init__(self,
                  name: Token,
                  value: Expr):
@@ -34,6 +42,9 @@ class BinaryExpr(Expr):
 
 
 class CallExpr(Expr):
+    # Resolverが設定する
+    cache: "MethodCache | None" = None
+
     def __init__(self,
                  callee: Expr,
                  paren: Token,
@@ -48,6 +59,9 @@ class CallExpr(Expr):
 
 
 class FunctionExpr(Expr):
+    # Resolverが設定する
+    slots: dict[str, int] | None = None
+
     def __init__(self,
                  params: list[Token],
                  body: list[Expr]):
@@ -60,6 +74,9 @@ class FunctionExpr(Expr):
 
 
 class GetExpr(Expr):
+    # Resolverが設定する
+    cache: "PropertyCache | None" = None
+
     def __init__(self,
                  object: Expr,
                  name: Token):
@@ -106,6 +123,9 @@ class LogicalExpr(Expr):
 
 
 class SetExpr(Expr):
+    # Resolverが設定する
+    cache: "PropertyCache | None" = None
+
     def __init__(self,
                  object: Expr,
                  name: Token,
@@ -120,6 +140,12 @@ class SetExpr(Expr):
 
 
 class SuperExpr(Expr):
+    # Resolverが設定する
+    depth: int | None = None
+    slot: int | None = None
+    this_depth: int | None = None
+    cache: "MethodCache | None" = None
+
     def __init__(self,
                  keyword: Token,
                  method: Token):
@@ -146,6 +172,10 @@ class TernaryExpr(Expr):
 
 
 class ThisExpr(Expr):
+    # Resolverが設定する
+    depth: int | None = None
+    slot: int | None = None
+
     def __init__(self,
                  keyword: Token):
 
@@ -168,6 +198,10 @@ class UnaryExpr(Expr):
 
 
 class VariableExpr(Expr):
+    # Resolverが設定する
+    depth: int | None = None
+    slot: int | None = None
+
     def __init__(self,
                  name: Token):
 
@@ -227,6 +261,82 @@ class IndexSetExpr(Expr):
         return visitor.visit_index_set_expr(self)
 
 
+class RangeExpr(Expr):
+    def __init__(self,
+                 start: Expr,
+                 stop: Expr,
+                 step: Expr,
+                 operator: Token):
+
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.operator = operator
+
+    def accept(self, visitor):
+        return visitor.visit_range_expr(self)
+
+
+class AddExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_add_expr(self)
+
+
+class SubtractExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_subtract_expr(self)
+
+
+class MultiplyExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_multiply_expr(self)
+
+
+class DivideExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_divide_expr(self)
+
+
+class FloorDivideExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_floor_divide_expr(self)
+
+
+class ModuloExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_modulo_expr(self)
+
+
+class GreaterExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_greater_expr(self)
+
+
+class GreaterEqualExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_greater_equal_expr(self)
+
+
+class LessExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_less_expr(self)
+
+
+class LessEqualExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_less_equal_expr(self)
+
+
+class EqualExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_equal_expr(self)
+
+
+class NotEqualExpr(BinaryExpr):
+    def accept(self, visitor):
+        return visitor.visit_not_equal_expr(self)
+
+
 class ExprVisitor(ABC):
 
     @abstractmethod
@@ -300,3 +410,43 @@ class ExprVisitor(ABC):
     @abstractmethod
     def visit_index_set_expr(self, expr: IndexSetExpr):
         pass
+
+    @abstractmethod
+    def visit_range_expr(self, expr: RangeExpr):
+        pass
+
+    def visit_add_expr(self, expr: AddExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_subtract_expr(self, expr: SubtractExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_multiply_expr(self, expr: MultiplyExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_divide_expr(self, expr: DivideExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_floor_divide_expr(self, expr: FloorDivideExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_modulo_expr(self, expr: ModuloExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_greater_expr(self, expr: GreaterExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_greater_equal_expr(self, expr: GreaterEqualExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_less_expr(self, expr: LessExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_less_equal_expr(self, expr: LessEqualExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_equal_expr(self, expr: EqualExpr):
+        return self.visit_binary_expr(expr)
+
+    def visit_not_equal_expr(self, expr: NotEqualExpr):
+        return self.visit_binary_expr(expr)
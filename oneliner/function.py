@@ -2,7 +2,7 @@ from oneliner.expr import FunctionExpr
 from oneliner.stmt import FunctionStmt
 from oneliner.environment import Environment
 from abc import ABC, abstractmethod
-from oneliner.error import Return
+from oneliner.error import RETURN, NativeError
 from oneliner.token import Token
 
 
@@ -22,7 +22,8 @@ class Function(Callable):
                  name: Token | None = None,
                  expr: FunctionExpr | None = None,
                  closure: Environment = None,
-                 is_initializer: bool = False):
+                 is_initializer: bool = False,
+                 this=None):
         if stmt is not None:
             self.name = stmt.name
             self.expr = stmt.function
@@ -31,39 +32,110 @@ class Function(Callable):
             self.expr = expr
         self.closure: Environment = closure
         self.is_initializer = is_initializer
+        # bindしたメソッドのレシーバ
+        self.this = this
+        # メソッドは呼び出しの環境のスロット0に this を持つ
+        self.is_method = "this" in self.expr.slots
 
     def arity(self) -> int:
         return len(self.expr.params)
 
     def call(self, interpreter, arguments: list):
-        environment: Environment = Environment(self.closure)
-        for i in range(len(self.expr.params)):
-            environment.define(
-                self.expr.params[i].lexeme, arguments[i])
+        if self.is_method:
+            return self.call_method(interpreter, self.this, arguments)
+
+        depth = interpreter.depth
+        if depth >= interpreter.max_depth:
+            raise NativeError("Stack overflow.")
+        interpreter.depth = depth + 1
+        try:
+            environment: Environment = Environment(self.closure,
+                                                   self.expr.slots)
+            # 引数はスロットの先頭から順に割り当てられている
+            environment.values[:len(arguments)] = arguments
+            value = None
+            if interpreter.execute_block(self.expr.body,
+                                         environment) is RETURN:
+                value = interpreter.return_value
+                if type(value) is TailCall:
+                    value = value.run(interpreter)
+            return value
+        except RecursionError:
+            # Pythonの再帰の上限に先に達した
+            raise NativeError("Stack overflow.") from None
+        finally:
+            interpreter.depth = depth
+
+    def call_method(self, interpreter, this, arguments: list):
+        "メソッドを this をレシーバとして呼び出す。束縛したメソッドを作らずに済む"
+        depth = interpreter.depth
+        if depth >= interpreter.max_depth:
+            raise NativeError("Stack overflow.")
+        interpreter.depth = depth + 1
         try:
-            interpreter.execute_block(self.expr.body, environment)
-        except Return as return_value:
+            environment: Environment = Environment(self.closure,
+                                                   self.expr.slots)
+            environment.values[0] = this
+            environment.values[1:len(arguments) + 1] = arguments
+            status = interpreter.execute_block(self.expr.body, environment)
+            value = None
             if self.is_initializer:
-                return self.closure.get_at(0, "this")
-            return return_value.value
-
+                value = this
+            elif status is RETURN:
+                value = interpreter.return_value
+                if type(value) is TailCall:
+                    value = value.run(interpreter)
+            return value
+        except RecursionError:
+            raise NativeError("Stack overflow.") from None
+        finally:
+            interpreter.depth = depth
+
+    def run(self, interpreter, arguments: list):
+        "本体を一度だけ実行する。末尾位置の呼び出しは TailCall のまま返す"
+        environment: Environment = Environment(self.closure, self.expr.slots)
+        if self.is_method:
+            environment.values[0] = self.this
+            environment.values[1:len(arguments) + 1] = arguments
+        else:
+            environment.values[:len(arguments)] = arguments
+        status = interpreter.execute_block(self.expr.body, environment)
         if self.is_initializer:
-            return self.closure.get_at(0, "this")
+            return self.this
+        if status is RETURN:
+            return interpreter.return_value
 
         return None
 
     def bind(self, instance):
-        environment: Environment = Environment(self.closure)
-        environment.define("this", instance)
         return Function(name=self.name,
                         expr=self.expr,
-                        closure=environment,
-                        is_initializer=self.is_initializer)
+                        closure=self.closure,
+                        is_initializer=self.is_initializer,
+                        this=instance)
 
     def __str__(self):
         return f"<fun {self.name.lexeme}>" if self.name else "<lambda>"
 
 
+class TailCall:
+    """
+    末尾位置で呼び出す関数と引数。呼び出し元の関数の call が受け取り、
+    Pythonのスタックを積まずにループで実行する(トランポリン)。
+    """
+    __slots__ = ("function", "arguments")
+
+    def __init__(self, function: Function, arguments: list):
+        self.function = function
+        self.arguments = arguments
+
+    def run(self, interpreter):
+        value = self
+        while type(value) is TailCall:
+            value = value.function.run(interpreter, value.arguments)
+        return value
+
+
 class Partial(Callable):
     "Callableに対して、第一引数を部分適用した新たなCallableを表す"
 
@@ -1,59 +1,126 @@
-import logging
-from oneliner.utll import stringify, is_truthy
-from oneliner.builtin import NativeFunction, export_functions
-from oneliner.function import Function, Callable, Partial
-from oneliner.environment import Environment
-from oneliner.error import InterpretError, ErrorReporter, Return
+from oneliner.utll import is_truthy, concat
+from oneliner.builtin import NumberRange, NumArray, native_variables, \
+    iterate
+from oneliner.function import Function, Callable, Partial, TailCall
+from oneliner.environment import Environment, GlobalEnvironment, \
+    SUPER_SLOTS
+from oneliner.error import InterpretError, ErrorReporter, RETURN, \
+    NativeError
 from oneliner.klass import Instance, Klass
+from oneliner.output import Output
+from oneliner.stack import call_with_stack
 from oneliner.token import TokenType, Token
 from oneliner.expr import Expr, ExprVisitor, LiteralExpr, GroupingExpr, \
     SetExpr, BinaryExpr, SuperExpr, TernaryExpr, VariableExpr, AssignExpr, \
     LogicalExpr, CallExpr, GetExpr, ThisExpr, UnaryExpr, FunctionExpr, \
-    ListExpr, MapExpr, IndexGetExpr, IndexSetExpr
+    ListExpr, MapExpr, IndexGetExpr, IndexSetExpr, AddExpr, SubtractExpr, \
+    MultiplyExpr, DivideExpr, FloorDivideExpr, ModuloExpr, GreaterExpr, \
+    GreaterEqualExpr, LessExpr, LessEqualExpr, EqualExpr, NotEqualExpr, \
+    RangeExpr
 from oneliner.stmt import Stmt, StmtVisitor, EmptyStmt, ExpressionStmt, \
-    VarStmt, BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt, ClassStmt
+    VarStmt, BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt, \
+    ClassStmt, ForInStmt
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+# 1lの関数呼び出しの深さの上限(--max-depth で変えられる)
+DEFAULT_MAX_DEPTH = 100_000
+# 1lの関数呼び出し1段あたりに使うPythonのフレーム数の見積もり
+FRAMES_PER_CALL = 40
+
+
+def is_inclusive(operator: Token) -> bool:
+    "RangeExprの元の比較演算子が終端を含むか"
+    return operator.type in (TokenType.LESS_EQUAL, TokenType.GREATER_EQUAL)
 
 
 class Interpreter(ExprVisitor, StmtVisitor):
-    globals = Environment()
+    globals = GlobalEnvironment()
 
     def __init__(self, error_reporter: ErrorReporter):
         self.environment = Interpreter.globals
-        self.locals = {}
         self.error_reporter = error_reporter
-        self.register_natives(export_functions())
-
-    def register_natives(self, natives: list[NativeFunction]):
-        for native in natives:
-            self.globals.define(native.name(), native)
-
-            for alias in native.alias():
-                self.globals.define(alias, native)
+        # 文の実行結果が RETURN のときの戻り値
+        self.return_value = None
+        # 実行中の1lの関数呼び出しの深さ
+        self.depth = 0
+        self.set_max_depth(DEFAULT_MAX_DEPTH)
+        # print の出力先
+        self.output = Output()
+        # ネイティブ関数は、グローバル変数が初めて見つからなかったときに登録する
+        self.globals.variables.defer(native_variables)
+
+    def set_max_depth(self, max_depth: int):
+        """
+        呼び出しの深さの上限と、実行中に使うPythonの再帰の上限を設定する。
+        再帰の上限はスタックの大きさでも制限されるので、ネイティブ関数を
+        はさむ深い再帰は max_depth より浅いところで Stack overflow. になる
+        """
+        self.max_depth = max_depth
+        self.recursion_limit = max_depth * FRAMES_PER_CALL
 
     def interpret(self, statements: list[Stmt]):
-        try:
+        self.run_program(self.prepare(statements))
+
+    def prepare(self, statements: list[Stmt]):
+        "文のリストを、何度でも実行できる引数なしの関数にする"
+        def program():
             for statement in statements:
                 self.execute(statement)
+        return program
+
+    def run_program(self, program):
+        "prepareした関数を実行し、実行時エラーを報告する"
+        try:
+            call_with_stack(program, self.recursion_limit)
         except InterpretError as e:
+            self.reset()
+            # エラーメッセージより前の出力を先に出す
+            self.output.flush()
             self.error_reporter.runtime_error(e)
+        finally:
+            self.output.flush()
 
-    def execute(self, stmt: Stmt):
-        stmt.accept(self)
+    def reset(self):
+        "実行時エラーで中断した後の状態を戻す"
+        self.environment = self.globals
+        self.depth = 0
 
-    def resolve(self, expr: Expr, depth: int):
-        self.locals[expr] = depth
+    def execute(self, stmt: Stmt):
+        "return文を実行したら RETURN を返す"
+        return stmt.accept(self)
 
-    def visit_return_stmt(self, stmt: ReturnStmt) -> None:
+    def visit_return_stmt(self, stmt: ReturnStmt):
         value = None
-        if stmt.value is not None:
+        if stmt.tail:
+            value = self.evaluate_tail(stmt.value)
+        elif stmt.value is not None:
             value = self.evaluate(stmt.value)
 
-        raise Return(value)
+        self.return_value = value
+        return RETURN
+
+    def evaluate_tail(self, expr: Expr):
+        "return文の値を評価する。末尾位置の1lの関数の呼び出しは TailCall にする"
+        match expr:
+            case TernaryExpr():
+                if is_truthy(self.evaluate(expr.condition)):
+                    return self.evaluate_tail(expr.then_expr)
+                return self.evaluate_tail(expr.else_expr)
+            case GroupingExpr():
+                return self.evaluate_tail(expr.expression)
+            case CallExpr():
+                callee = self.evaluate(expr.callee)
+                if not isinstance(callee, Function):
+                    return self.call_value(expr, callee)
+                arguments = [self.evaluate(arg) for arg in expr.arguments]
+                if (actual := len(arguments)) != \
+                        (expected := callee.arity()):
+                    raise InterpretError(
+                        expr.paren,
+                        f"Expected {expected} arguments but got {actual}."
+                    )
+                return TailCall(callee, arguments)
+            case _:
+                return self.evaluate(expr)
 
     def visit_expression_stmt(self, stmt: ExpressionStmt) -> None:
         self.evaluate(stmt.expression)
@@ -65,26 +132,43 @@ class Interpreter(ExprVisitor, StmtVisitor):
         function = Function(stmt=stmt,
                             closure=self.environment,
                             is_initializer=False)
-        self.environment.define(stmt.name.lexeme, function)
+        self.define_variable(stmt.name, stmt.slot, function)
 
     def visit_var_stmt(self, stmt: VarStmt) -> None:
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
 
-        self.environment.define(stmt.name.lexeme, value)
+        self.define_variable(stmt.name, stmt.slot, value)
+
+    def define_variable(self, name: Token, slot: int | None, value):
+        "slotがNoneならグローバル変数として定義する"
+        if slot is None:
+            self.globals.define(name.lexeme, value)
+        else:
+            self.environment.values[slot] = value
 
     def visit_block_stmt(self, stmt: BlockStmt) -> None:
-        self.execute_block(stmt.statements, Environment(self.environment))
+        # 変数を宣言しないブロックは現在の環境でそのまま実行する
+        if stmt.slots is None:
+            for statement in stmt.statements:
+                if self.execute(statement) is RETURN:
+                    return RETURN
+            return None
+        return self.execute_block(stmt.statements,
+                                  Environment(self.environment, stmt.slots))
 
     def execute_block(self, statements: list[Stmt], environment: Environment):
+        "return文を実行したら、残りの文を飛ばして RETURN を返す"
         previous: Environment = self.environment
         try:
             self.environment = environment
             for statement in statements:
-                self.execute(statement)
+                if self.execute(statement) is RETURN:
+                    return RETURN
         finally:
             self.environment = previous
+        return None
 
     def visit_function_expr(self, expr: FunctionExpr) -> None:
         return Function(expr=expr,
@@ -99,10 +183,11 @@ class Interpreter(ExprVisitor, StmtVisitor):
                 raise InterpretError(stmt.superclass.name,
                                      "Superclass must be a class.")
 
-        self.environment.define(stmt.name.lexeme, None)
+        self.define_variable(stmt.name, stmt.slot, None)
         if stmt.superclass is not None:
-            self.environment = Environment(self.environment)
-            self.environment.define("super", superclass)
+            self.environment = Environment(self.environment,
+                                           SUPER_SLOTS,
+                                           [superclass])
 
         methods = {}
         for method in stmt.methods:
@@ -117,26 +202,48 @@ class Interpreter(ExprVisitor, StmtVisitor):
         if superclass is not None:
             self.environment = self.environment.enclosing
 
-        self.environment.assign(stmt.name, klass)
+        self.define_variable(stmt.name, stmt.slot, klass)
 
-    def visit_if_stmt(self, stmt: IfStmt) -> None:
+    def visit_if_stmt(self, stmt: IfStmt):
         if is_truthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.then_branch)
+            return self.execute(stmt.then_branch)
         elif stmt.else_branch is not None:
-            self.execute(stmt.else_branch)
+            return self.execute(stmt.else_branch)
 
-    def visit_while_stmt(self, stmt: WhileStmt) -> None:
+    def visit_while_stmt(self, stmt: WhileStmt):
         while is_truthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.body)
+            if self.execute(stmt.body) is RETURN:
+                return RETURN
+
+    def visit_for_in_stmt(self, stmt: ForInStmt):
+        values = self.iterate(stmt.name, self.evaluate(stmt.iterable))
+        # slots が None なら、ループ変数は現在の環境のスロットにある
+        previous = self.environment
+        if stmt.slots is not None:
+            self.environment = Environment(previous, stmt.slots)
+        variables = self.environment.values
+        slot = stmt.slot
+        try:
+            for value in values:
+                variables[slot] = value
+                if self.execute(stmt.body) is RETURN:
+                    return RETURN
+        finally:
+            self.environment = previous
+
+    def iterate(self, token: Token, value):
+        try:
+            return iterate(value)
+        except NativeError as e:
+            raise InterpretError(token, e.message) from None
 
     def visit_assign_expr(self, expr: AssignExpr):
         value = self.evaluate(expr.value)
 
-        distance = self.locals.get(expr, None)
-        if distance is not None:
-            self.environment.assign_at(distance, expr.name, value)
+        if expr.depth is not None:
+            self.environment.assign_at(expr.depth, expr.slot, value)
         else:
-            self.environment.assign(expr.name, value)
+            self.globals.assign(expr.name, value)
 
         return value
 
@@ -161,12 +268,21 @@ class Interpreter(ExprVisitor, StmtVisitor):
         if not self.is_numeric(operand):
             raise InterpretError(operator, "Operand must be number")
 
+    def visit_range_expr(self, expr: RangeExpr):
+        start = self.evaluate(expr.start)
+        stop = self.evaluate(expr.stop)
+        step = self.evaluate(expr.step)
+        self.check_numeric_operands(expr.operator, start, stop)
+        return NumberRange(start, stop, step, is_inclusive(expr.operator))
+
     def check_numeric_operands(self, operator: Token, left, right):
         if not (self.is_numeric(left) and self.is_numeric(right)):
             raise InterpretError(operator, "Operands must be numbers")
 
     def is_numeric(self, object):
-        return isinstance(object, float) or isinstance(object, int)
+        # 配列も数値と同じ演算子で、要素ごとに計算できる
+        return isinstance(object, float) or isinstance(object, int) \
+            or isinstance(object, NumArray)
 
     def visit_ternary_expr(self, expr: TernaryExpr):
         condition = self.evaluate(expr.condition)
@@ -194,14 +310,7 @@ class Interpreter(ExprVisitor, StmtVisitor):
 
         match expr.operator.type:
             case TokenType.PLUS:
-                if self.is_numeric(left) and self.is_numeric(right):
-                    return left + right
-                elif isinstance(left, list) and isinstance(right, list):
-                    return left + right
-                elif isinstance(left, dict) and isinstance(right, dict):
-                    return {**left, **right}
-                else:
-                    return stringify(left) + stringify(right)
+                return self.add(left, right)
             case TokenType.MINUS:
                 self.check_numeric_operands(expr.operator, left, right)
                 return left - right
@@ -235,6 +344,110 @@ class Interpreter(ExprVisitor, StmtVisitor):
             case _:
                 raise InterpretError(expr.operator, "Unreachable")
 
+    def add(self, left, right):
+        if self.is_numeric(left) and self.is_numeric(right):
+            return left + right
+        elif isinstance(left, list) and isinstance(right, list):
+            return left + right
+        elif isinstance(left, dict) and isinstance(right, dict):
+            return {**left, **right}
+        else:
+            return concat(left, right)
+
+    #
+    # 演算子ごとのノード。オペランドが両方 int か両方 float なら型の検査を省く
+    # (evaluate を経由せずに accept を呼び、フレームを1つ減らしている)
+    #
+
+    def visit_add_expr(self, expr: AddExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is int and type(right) is int or \
+                type(left) is float and type(right) is float:
+            return left + right
+        return self.add(left, right)
+
+    def visit_subtract_expr(self, expr: SubtractExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left - right
+
+    def visit_multiply_expr(self, expr: MultiplyExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left * right
+
+    def visit_divide_expr(self, expr: DivideExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left / right
+
+    def visit_floor_divide_expr(self, expr: FloorDivideExpr):
+        return expr.left.accept(self) // expr.right.accept(self)
+
+    def visit_modulo_expr(self, expr: ModuloExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left % right
+
+    def visit_greater_expr(self, expr: GreaterExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left > right
+
+    def visit_greater_equal_expr(self, expr: GreaterEqualExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left >= right
+
+    def visit_less_expr(self, expr: LessExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left < right
+
+    def visit_less_equal_expr(self, expr: LessEqualExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if not (type(left) is int and type(right) is int or
+                type(left) is float and type(right) is float):
+            self.check_numeric_operands(expr.operator, left, right)
+        return left <= right
+
+    def visit_equal_expr(self, expr: EqualExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if left is None:
+            return right is None
+        return left == right
+
+    def visit_not_equal_expr(self, expr: NotEqualExpr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if left is None:
+            return right is not None
+        return left != right
+
     def is_equal(self, left, right):
         if left is None and right is None:
             return True
@@ -249,12 +462,13 @@ class Interpreter(ExprVisitor, StmtVisitor):
         return self.look_up_variable(expr.name, expr)
 
     def look_up_variable(self, name: Token, expr: Expr):
-        distance = self.locals.get(expr, None)
-        if distance is not None:
-            return self.environment.get_at(distance, name.lexeme)
+        if expr.depth is not None:
+            return self.environment.get_at(expr.depth, expr.slot)
         return self.globals.get(name)
 
     def visit_call_expr(self, expr: CallExpr):
+        if expr.cache is not None:
+            return self.invoke(expr)
         callee = self.evaluate(expr.callee)
         arguments = [self.evaluate(arg) for arg in expr.arguments]
         if not isinstance(callee, Callable):
@@ -266,13 +480,67 @@ class Interpreter(ExprVisitor, StmtVisitor):
                 expr.paren,
                 f"Expected {expected} arguments but got {actual}."
             )
-        return callee.call(self, arguments)
+        try:
+            return callee.call(self, arguments)
+        except NativeError as e:
+            raise InterpretError(expr.paren, e.message) from None
 
-    def visit_get_expr(self, expr: GetExpr):
+    def call_value(self, expr: CallExpr, callee):
+        "インスタンスのメソッド以外を呼び出す(visit_call_expr と同じ処理)"
+        arguments = [self.evaluate(arg) for arg in expr.arguments]
+        if not isinstance(callee, Callable):
+            raise InterpretError(
+                expr.paren, "Can only callable functions and classes.")
 
+        if (actual := len(arguments)) != (expected := callee.arity()):
+            raise InterpretError(
+                expr.paren,
+                f"Expected {expected} arguments but got {actual}."
+            )
+        try:
+            return callee.call(self, arguments)
+        except NativeError as e:
+            raise InterpretError(expr.paren, e.message) from None
+
+    def invoke(self, expr: CallExpr):
+        """
+        obj.name(...) と super.name(...) を、インラインキャッシュで引いた
+        メソッドで直接呼び出す
+        """
+        if isinstance(expr.callee, SuperExpr):
+            invocant = self.environment.get_at(expr.callee.this_depth, 0)
+            method = self.super_method(expr.callee)
+        else:
+            invocant = self.evaluate(expr.callee.object)
+            method = None
+            if isinstance(invocant, Instance):
+                method = expr.cache.lookup(invocant.shape)
+            if method is None:
+                # フィールドの関数、構文糖衣、またはエラー
+                callee = self.get_property(invocant, expr.callee.name)
+                return self.call_value(expr, callee)
+
+        arguments = [self.evaluate(arg) for arg in expr.arguments]
+        if (actual := len(arguments)) != (expected := method.arity()):
+            raise InterpretError(
+                expr.paren,
+                f"Expected {expected} arguments but got {actual}."
+            )
+        try:
+            return method.call_method(self, invocant, arguments)
+        except NativeError as e:
+            raise InterpretError(expr.paren, e.message) from None
+
+    def visit_get_expr(self, expr: GetExpr):
         invocant = self.evaluate(expr.object)
-        property = expr.name
+        if isinstance(invocant, Instance):
+            cache = expr.cache
+            if invocant.shape is cache.shape:
+                return invocant.values[cache.slot]
+            return cache.get(invocant)
+        return self.get_property(invocant, expr.name)
 
+    def get_property(self, invocant, property: Token):
         if isinstance(invocant, Instance):
             return invocant.get(property)
 
@@ -313,7 +581,7 @@ class Interpreter(ExprVisitor, StmtVisitor):
                 pass
             case Instance():
                 value = self.evaluate(expr.value)
-                object.set(expr.name, value)
+                expr.cache.set(object, value)
                 return value
             case _:
                 raise InterpretError(expr.name,
@@ -323,15 +591,17 @@ class Interpreter(ExprVisitor, StmtVisitor):
         return self.look_up_variable(expr.keyword, expr)
 
     def visit_super_expr(self, expr: SuperExpr):
-        distance = self.locals.get(expr, None)
-        superclass = self.environment.get_at(distance, "super")
-        object = self.environment.get_at(distance - 1, "this")
+        object = self.environment.get_at(expr.this_depth, 0)
+        return self.super_method(expr).bind(object)
 
-        method = superclass.find_method(expr.method.lexeme)
+    def super_method(self, expr: SuperExpr):
+        superclass = self.environment.get_at(expr.depth, 0)
+        # スーパークラスのShapeの根にはフィールドがない
+        method = expr.cache.lookup(superclass.shape)
         if method is None:
             raise InterpretError(expr.method,
                                  f"Undefined property '{expr.method.lexeme}'.")
-        return method.bind(object)
+        return method
 
     def visit_list_expr(self, expr: ListExpr):
         return [self.evaluate(element) for element in expr.elements]
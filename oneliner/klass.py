@@ -6,51 +6,101 @@ from typing import Self
 
 
 class Klass(Callable):
+    """
+    メソッドの表(table)は、スーパークラスの表に自分のメソッドを上書きした
+    平坦な辞書として作っておく。継承の深さによらず、メソッドは1回の表引きで見つかる。
+    初期化子(init)とその引数の数も作成時に求めておく。
+    """
+
     def __init__(self, name: Token,
                  superclass: Self | None,
                  methods: dict[str, Function]):
         self.name = name
         self.superclass = superclass
         self.methods = methods
+        # フィールドのないインスタンスのShape(遷移の木の根)
+        self.shape = Shape(self, {})
+        self.update_table()
 
     def __str__(self):
         return f"<class {self.name}>"
 
-    def find_method(self, name: str) -> Function | None:
-        if name in self.methods:
-            return self.methods[name]
-
+    def update_table(self):
+        "スーパークラスかメソッドを変えたら呼ぶ"
+        self.table: dict[str, Function] = {}
         if self.superclass is not None:
-            return self.superclass.find_method(name)
+            self.table.update(self.superclass.table)
+        self.table.update(self.methods)
+        self.initializer = self.table.get("init")
+        self.init_arity = 0
+        if self.initializer is not None:
+            self.init_arity = self.initializer.arity()
+
+    def inherit(self, superclass: Self):
+        self.superclass = superclass
+        self.update_table()
+
+    def define_method(self, name: str, method):
+        self.methods[name] = method
+        self.table[name] = method
+        if name == "init":
+            self.initializer = method
+            self.init_arity = method.arity()
 
-        return None
+    def find_method(self, name: str) -> Function | None:
+        return self.table.get(name)
 
     def call(self, interpreter, arguments: list[Expr]):
         instance: Instance = Instance(self)
-        initializer = self.find_method("init")
-        if initializer is not None:
-            initializer.bind(instance).call(interpreter, arguments)
+        if self.initializer is not None:
+            self.initializer.call_method(interpreter, instance, arguments)
 
         return instance
 
     def arity(self) -> int:
-        initializer = self.find_method("init")
-        if initializer is None:
-            return 0
-        return initializer.arity()
+        return self.init_arity
+
+
+class Shape:
+    """
+    インスタンスのフィールドの並び(隠れクラス)。フィールド名からスロット番号への対応を持つ。
+    同じクラスで同じ順にフィールドを追加したインスタンスは同じShapeを共有する。
+    フィールドを1つ追加した先のShapeは transitions に覚えておき、使い回す。
+    """
+
+    __slots__ = ("klass", "slots", "transitions")
+
+    def __init__(self, klass: Klass, slots: dict[str, int]):
+        self.klass = klass
+        self.slots = slots
+        self.transitions: dict[str, Shape] = {}
 
+    def with_field(self, name: str) -> "Shape":
+        "フィールド name を末尾に追加したShape"
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = Shape(self.klass, {**self.slots, name: len(self.slots)})
+            self.transitions[name] = shape
+        return shape
+
+
+class Instance:
+    "フィールドの値は、shapeのスロット番号の順に values に持つ"
+
+    __slots__ = ("klass", "shape", "values")
 
-class Instance():
     def __init__(self, klass: Klass):
         self.klass = klass
-        self.fields = {}
+        self.shape: Shape = klass.shape
+        self.values: list = []
 
     def __str__(self) -> str:
         return f"<instance of {self.klass.name}>"
 
     def get(self, name: Token):
-        if name.lexeme in self.fields:
-            return self.fields[name.lexeme]
+        slot = self.shape.slots.get(name.lexeme)
+        if slot is not None:
+            return self.values[slot]
 
         method = self.klass.find_method(name.lexeme)
 
@@ -60,4 +110,98 @@ class Instance():
         raise InterpretError(name, f"Undefined property '{name.lexeme}'.")
 
     def set(self, name: Token, value):
-        self.fields[name.lexeme] = value
+        slot = self.shape.slots.get(name.lexeme)
+        if slot is None:
+            self.shape = self.shape.with_field(name.lexeme)
+            self.values.append(value)
+        else:
+            self.values[slot] = value
+
+
+class MethodCache:
+    """
+    obj.name(...) と super.name(...) の呼び出し箇所ごとのインラインキャッシュ。
+    直前に見たShapeとそのメソッドを覚えておき(単相)、外れたらShapeごとの表を引く(多相)。
+    表がLIMITを超えたShapeはキャッシュせず、毎回 find_method で探す。
+    Shapeはクラスごとに別なので、クラスのメソッドも同名のフィールドの有無も決まる。
+    クラスのメソッドは定義後に変わらないので、無効化は必要ない。
+    """
+
+    LIMIT = 4
+
+    __slots__ = ("name", "shape", "method", "entries")
+
+    def __init__(self, name: Token):
+        self.name = name
+        self.shape: Shape | None = None
+        self.method = None
+        self.entries: dict[Shape, object] = {}
+
+    def lookup(self, shape: Shape):
+        """
+        shapeのインスタンスのメソッドを返す。
+        同名のフィールドがあるか、メソッドがなければNone
+        """
+        if shape is self.shape:
+            return self.method
+
+        entries = self.entries
+        if shape in entries:
+            method = entries[shape]
+        else:
+            method = None
+            if self.name.lexeme not in shape.slots:
+                method = shape.klass.find_method(self.name.lexeme)
+            if len(entries) < self.LIMIT:
+                entries[shape] = method
+        self.shape = shape
+        self.method = method
+        return method
+
+
+class PropertyCache:
+    """
+    obj.name の読み出しと obj.name = x の代入の箇所ごとのインラインキャッシュ。
+    直前に見たShapeと、そのShapeでのフィールドのスロット番号を覚えておく。
+    代入でフィールドを追加したときは、追加後のShape(next)も覚えておく。
+    """
+
+    __slots__ = ("name", "shape", "slot", "next")
+
+    def __init__(self, name: Token):
+        self.name = name
+        self.shape: Shape | None = None
+        self.slot = 0
+        self.next: Shape | None = None
+
+    def get(self, instance: Instance):
+        "shape が一致しなかったときの読み出し"
+        shape = instance.shape
+        slot = shape.slots.get(self.name.lexeme)
+        if slot is None:
+            # メソッドを束縛するか、エラーにする
+            return instance.get(self.name)
+        self.shape = shape
+        self.slot = slot
+        return instance.values[slot]
+
+    def set(self, instance: Instance, value):
+        shape = instance.shape
+        if shape is self.shape:
+            if self.next is None:
+                instance.values[self.slot] = value
+            else:
+                instance.shape = self.next
+                instance.values.append(value)
+            return
+
+        slot = shape.slots.get(self.name.lexeme)
+        if slot is None:
+            slot = len(instance.values)
+            self.next = instance.shape = shape.with_field(self.name.lexeme)
+            instance.values.append(value)
+        else:
+            self.next = None
+            instance.values[slot] = value
+        self.shape = shape
+        self.slot = slot
@@ -0,0 +1,393 @@
+from oneliner.expr import Expr, ExprVisitor, AssignExpr, BinaryExpr, \
+    CallExpr, FunctionExpr, GetExpr, GroupingExpr, LiteralExpr, \
+    LogicalExpr, SetExpr, SuperExpr, TernaryExpr, ThisExpr, UnaryExpr, \
+    VariableExpr, ListExpr, MapExpr, IndexGetExpr, IndexSetExpr, RangeExpr, \
+    AddExpr, SubtractExpr, GreaterExpr, GreaterEqualExpr, LessExpr, \
+    LessEqualExpr
+from oneliner.stmt import Stmt, StmtVisitor, BlockStmt, ClassStmt, \
+    EmptyStmt, ExpressionStmt, FunctionStmt, IfStmt, ReturnStmt, VarStmt, \
+    WhileStmt, ForInStmt
+from oneliner.resolver import has_tail_call
+from oneliner.token import TokenType
+from oneliner.utll import stringify, is_truthy
+
+
+# 両辺が数値のときだけ畳み込む二項演算子
+NUMERIC_OPERATORS = {
+    TokenType.MINUS: lambda left, right: left - right,
+    TokenType.STAR: lambda left, right: left * right,
+    TokenType.SLASH: lambda left, right: left / right,
+    TokenType.DOUBLE_SLASH: lambda left, right: left // right,
+    TokenType.PERCENT: lambda left, right: left % right,
+    TokenType.GREATER: lambda left, right: left > right,
+    TokenType.GREATER_EQUAL: lambda left, right: left >= right,
+    TokenType.LESS: lambda left, right: left < right,
+    TokenType.LESS_EQUAL: lambda left, right: left <= right,
+}
+
+# 右辺が0だと実行時にエラーになる演算子
+DIVISIONS = {TokenType.SLASH, TokenType.DOUBLE_SLASH, TokenType.PERCENT}
+
+
+def is_numeric(value) -> bool:
+    return isinstance(value, float) or isinstance(value, int)
+
+
+def is_equal(left, right) -> bool:
+    if left is None and right is None:
+        return True
+    if left is None:
+        return False
+    return left == right
+
+
+# for文を range の for-in に書き換えられる条件の比較演算子と、step の向き
+# (1: 増える、-1: 減る)
+COUNTED_LOOP_CONDITIONS = {
+    LessExpr: 1,
+    LessEqualExpr: 1,
+    GreaterExpr: -1,
+    GreaterEqualExpr: -1,
+}
+
+
+def walk(node):
+    "node とその下にあるすべてのノード"
+    if isinstance(node, (list, tuple)):
+        for item in node:
+            yield from walk(item)
+    elif isinstance(node, (Expr, Stmt)):
+        yield node
+        for value in vars(node).values():
+            yield from walk(value)
+
+
+def assigned_names(node) -> set[str]:
+    "node の下で代入されている変数名"
+    return {child.name.lexeme for child in walk(node)
+            if isinstance(child, AssignExpr)}
+
+
+def is_captured(node, name: str) -> bool:
+    "node の下の関数が name という変数を参照しているか"
+    for function in walk(node):
+        if isinstance(function, FunctionExpr):
+            for child in walk(function.body):
+                if isinstance(child, (VariableExpr, AssignExpr)) \
+                        and child.name.lexeme == name:
+                    return True
+    return False
+
+
+def is_variable(expr: Expr, name: str) -> bool:
+    "ループのブロック直下の変数 name の参照か"
+    return isinstance(expr, VariableExpr) and expr.name.lexeme == name \
+        and expr.depth == 0
+
+
+class Optimizer(ExprVisitor, StmtVisitor):
+    """
+    解決済みのASTを実行前に書き換える。
+
+    - リテラルだけの算術・文字列連結・比較・論理演算と、条件が定数の三項演算子を
+      リテラルに畳み込む
+    - 条件が定数のif文・while文の、実行されない分岐を取り除く
+    - return文より後ろの、実行されない文を取り除く
+    - 括弧(GroupingExpr)を取り除く
+    - `for (var i = a; i < n; i = i + 1)` の形のfor文を、本体で i に代入しなければ
+      range の for-in (ForInStmt と RangeExpr)に書き換える
+
+    実行時にエラーになる式(0での除算や数値でない値の算術)は畳み込まずに残すので、
+    エラーはこれまで通り実行時に報告される。
+    ノードはその場で書き換え、置き換えるノードを返す。
+    """
+
+    def __init__(self):
+        # プログラムのどこかで代入されている変数名
+        self.assigned: set[str] = set()
+
+    def optimize(self, statements: list[Stmt]) -> list[Stmt]:
+        self.assigned = assigned_names(statements)
+        return self.optimize_statements(statements)
+
+    def optimize_statements(self, statements: list[Stmt]) -> list[Stmt]:
+        optimized = []
+        for statement in statements:
+            statement = statement.accept(self)
+            if statement is None:
+                continue
+            optimized.append(statement)
+            if isinstance(statement, ReturnStmt):
+                break
+        return optimized
+
+    def optimize_branch(self, stmt: Stmt | None) -> Stmt | None:
+        "if文・while文の分岐。取り除いた文は空のブロックにする"
+        if stmt is None:
+            return None
+        optimized = stmt.accept(self)
+        return BlockStmt([]) if optimized is None else optimized
+
+    def evaluate(self, expr: Expr) -> Expr:
+        return expr.accept(self)
+
+    #
+    # statements
+    #
+
+    def visit_block_stmt(self, stmt: BlockStmt):
+        stmt.statements = self.optimize_statements(stmt.statements)
+        loop = self.counted_loop(stmt)
+        if loop is not None:
+            stmt.statements = [loop]
+        return stmt
+
+    def counted_loop(self, stmt: BlockStmt) -> ForInStmt | None:
+        """
+        パーサがfor文から作った Block[var i = a, While(i < n, Block[本体, i = i + step])]
+        が数え上げのループなら、同じことをする for (i in range) を返す。
+        n はリテラルか、どこでも代入されないローカル変数でなければならない
+        """
+        if len(stmt.statements) != 2:
+            return None
+        declaration, loop = stmt.statements
+        if not isinstance(declaration, VarStmt) \
+                or declaration.initializer is None \
+                or not isinstance(loop, WhileStmt):
+            return None
+        name = declaration.name.lexeme
+
+        condition = loop.condition
+        direction = COUNTED_LOOP_CONDITIONS.get(type(condition))
+        if direction is None or not is_variable(condition.left, name):
+            return None
+        match condition.right:
+            case LiteralExpr(value=value) if type(value) in (int, float):
+                pass
+            case VariableExpr() as bound if bound.depth is not None \
+                    and bound.name.lexeme not in self.assigned:
+                pass
+            case _:
+                return None
+
+        if not isinstance(loop.body, BlockStmt) \
+                or loop.body.slots is not None \
+                or len(loop.body.statements) != 2:
+            return None
+        body, increment = loop.body.statements
+        if not isinstance(increment, ExpressionStmt):
+            return None
+        match increment.expression:
+            case AssignExpr(value=AddExpr(left=left,
+                                          right=LiteralExpr(value=step))):
+                pass
+            case AssignExpr(value=SubtractExpr(left=left,
+                                               right=LiteralExpr(value=step))):
+                step = -step if type(step) in (int, float) else step
+            case _:
+                return None
+        assign = increment.expression
+        if assign.name.lexeme != name or assign.depth != 0 \
+                or not is_variable(left, name) \
+                or type(step) not in (int, float) or step * direction <= 0:
+            return None
+
+        if name in assigned_names(body) or is_captured(body, name):
+            return None
+
+        loop = ForInStmt(declaration.name,
+                         RangeExpr(declaration.initializer,
+                                   condition.right,
+                                   LiteralExpr(step),
+                                   condition.operator),
+                         body)
+        # ループ変数はブロックの環境のスロットをそのまま使う
+        loop.slots = None
+        loop.slot = declaration.slot
+        return loop
+
+    def visit_empty_stmt(self, stmt: EmptyStmt):
+        return stmt
+
+    def visit_expression_stmt(self, stmt: ExpressionStmt):
+        stmt.expression = self.evaluate(stmt.expression)
+        return stmt
+
+    def visit_var_stmt(self, stmt: VarStmt):
+        if stmt.initializer is not None:
+            stmt.initializer = self.evaluate(stmt.initializer)
+        return stmt
+
+    def visit_function_stmt(self, stmt: FunctionStmt):
+        self.evaluate(stmt.function)
+        return stmt
+
+    def visit_class_stmt(self, stmt: ClassStmt):
+        for method in stmt.methods:
+            self.evaluate(method.function)
+        return stmt
+
+    def visit_return_stmt(self, stmt: ReturnStmt):
+        if stmt.value is not None:
+            stmt.value = self.evaluate(stmt.value)
+            stmt.tail = has_tail_call(stmt.value)
+        return stmt
+
+    def visit_if_stmt(self, stmt: IfStmt):
+        stmt.condition = self.evaluate(stmt.condition)
+        if isinstance(stmt.condition, LiteralExpr):
+            if is_truthy(stmt.condition.value):
+                return stmt.then_branch.accept(self)
+            if stmt.else_branch is None:
+                return None
+            return stmt.else_branch.accept(self)
+
+        stmt.then_branch = self.optimize_branch(stmt.then_branch)
+        stmt.else_branch = self.optimize_branch(stmt.else_branch)
+        return stmt
+
+    def visit_while_stmt(self, stmt: WhileStmt):
+        stmt.condition = self.evaluate(stmt.condition)
+        if isinstance(stmt.condition, LiteralExpr) and \
+                not is_truthy(stmt.condition.value):
+            return None
+        stmt.body = self.optimize_branch(stmt.body)
+        return stmt
+
+    def visit_for_in_stmt(self, stmt: ForInStmt):
+        stmt.iterable = self.evaluate(stmt.iterable)
+        stmt.body = self.optimize_branch(stmt.body)
+        return stmt
+
+    #
+    # expressions
+    #
+
+    def visit_literal_expr(self, expr: LiteralExpr):
+        return expr
+
+    def visit_grouping_expr(self, expr: GroupingExpr):
+        return self.evaluate(expr.expression)
+
+    def visit_unary_expr(self, expr: UnaryExpr):
+        expr.operand = self.evaluate(expr.operand)
+        if not isinstance(expr.operand, LiteralExpr):
+            return expr
+
+        operand = expr.operand.value
+        match expr.operator.type:
+            case TokenType.MINUS if is_numeric(operand):
+                return LiteralExpr(-operand)
+            case TokenType.NOT | TokenType.BANG:
+                return LiteralExpr(not is_truthy(operand))
+        return expr
+
+    def visit_binary_expr(self, expr: BinaryExpr):
+        expr.left = self.evaluate(expr.left)
+        expr.right = self.evaluate(expr.right)
+        if not (isinstance(expr.left, LiteralExpr)
+                and isinstance(expr.right, LiteralExpr)):
+            return expr
+
+        left = expr.left.value
+        right = expr.right.value
+        operator = expr.operator.type
+        match operator:
+            case TokenType.PLUS:
+                if is_numeric(left) and is_numeric(right):
+                    return LiteralExpr(left + right)
+                return LiteralExpr(stringify(left) + stringify(right))
+            case TokenType.DOUBLE_EQUAL:
+                return LiteralExpr(is_equal(left, right))
+            case TokenType.BANG_EQUAL:
+                return LiteralExpr(not is_equal(left, right))
+            case _ if operator in NUMERIC_OPERATORS:
+                if not (is_numeric(left) and is_numeric(right)):
+                    return expr
+                if operator in DIVISIONS and right == 0:
+                    return expr
+                return LiteralExpr(NUMERIC_OPERATORS[operator](left, right))
+        return expr
+
+    def visit_logical_expr(self, expr: LogicalExpr):
+        expr.left = self.evaluate(expr.left)
+        expr.right = self.evaluate(expr.right)
+        if not isinstance(expr.left, LiteralExpr):
+            return expr
+
+        left = expr.left.value
+        match expr.operator.type:
+            case TokenType.OR | TokenType.DOUBLE_PIPE:
+                if is_truthy(left):
+                    return expr.left
+            case TokenType.AND | TokenType.DOUBLE_AMPERSAND:
+                if not is_truthy(left):
+                    return expr.left
+        return expr.right
+
+    def visit_ternary_expr(self, expr: TernaryExpr):
+        expr.condition = self.evaluate(expr.condition)
+        expr.then_expr = self.evaluate(expr.then_expr)
+        expr.else_expr = self.evaluate(expr.else_expr)
+        if isinstance(expr.condition, LiteralExpr):
+            if is_truthy(expr.condition.value):
+                return expr.then_expr
+            return expr.else_expr
+        return expr
+
+    def visit_variable_expr(self, expr: VariableExpr):
+        return expr
+
+    def visit_assign_expr(self, expr: AssignExpr):
+        expr.value = self.evaluate(expr.value)
+        return expr
+
+    def visit_call_expr(self, expr: CallExpr):
+        expr.callee = self.evaluate(expr.callee)
+        expr.arguments = [self.evaluate(arg) for arg in expr.arguments]
+        return expr
+
+    def visit_function_expr(self, expr: FunctionExpr):
+        expr.body = self.optimize_statements(expr.body)
+        return expr
+
+    def visit_get_expr(self, expr: GetExpr):
+        expr.object = self.evaluate(expr.object)
+        return expr
+
+    def visit_set_expr(self, expr: SetExpr):
+        expr.object = self.evaluate(expr.object)
+        expr.value = self.evaluate(expr.value)
+        return expr
+
+    def visit_this_expr(self, expr: ThisExpr):
+        return expr
+
+    def visit_super_expr(self, expr: SuperExpr):
+        return expr
+
+    def visit_list_expr(self, expr: ListExpr):
+        expr.elements = [self.evaluate(element) for element in expr.elements]
+        return expr
+
+    def visit_map_expr(self, expr: MapExpr):
+        expr.elements = [(self.evaluate(key), self.evaluate(value))
+                         for key, value in expr.elements]
+        return expr
+
+    def visit_index_get_expr(self, expr: IndexGetExpr):
+        expr.collection = self.evaluate(expr.collection)
+        expr.index = self.evaluate(expr.index)
+        return expr
+
+    def visit_index_set_expr(self, expr: IndexSetExpr):
+        expr.collection = self.evaluate(expr.collection)
+        expr.index = self.evaluate(expr.index)
+        expr.value = self.evaluate(expr.value)
+        return expr
+
+    def visit_range_expr(self, expr: RangeExpr):
+        expr.start = self.evaluate(expr.start)
+        expr.stop = self.evaluate(expr.stop)
+        expr.step = self.evaluate(expr.step)
+        return expr
@@ -0,0 +1,169 @@
+import sys
+from collections import OrderedDict
+from oneliner.error import NativeError
+from oneliner.utll import stringify, stringify_chunks
+
+# 出力をフラッシュする方針(--flush)
+#   line: print のたびに書き出す
+#   block: BUFFER_SIZE 文字たまったら書き出す
+#   explicit: flush() を呼ぶか、プログラムが終わるまで書き出さない
+FLUSH_POLICIES = ("line", "block", "explicit")
+BUFFER_SIZE = 1 << 16
+# 同時に開いておくファイルの数
+MAX_OPEN_FILES = 32
+# ファイルの代わりに標準出力・標準エラー出力を表す名前
+STDOUT_NAMES = ("-", "/dev/stdout")
+STDERR_NAMES = ("/dev/stderr",)
+
+
+def default_policy() -> str:
+    "端末に出力するなら行ごとに、パイプやファイルならまとめて書き出す"
+    try:
+        return "line" if sys.stdout.isatty() else "block"
+    except (AttributeError, ValueError):
+        return "block"
+
+
+def write_line(write, value):
+    for chunk in stringify_chunks(value):
+        write(chunk)
+    write("\n")
+
+
+class FilePool:
+    """
+    名前で指定されたファイルを開いたままにしておく。
+    開いているファイルが capacity 個を超えたら、最近使われていないものから閉じる。
+    AWKの print > file と同じく、最初に開くときは切り詰め、
+    閉じた後に再び書くときは追記する。close で閉じたファイルはまた切り詰める
+    """
+
+    def __init__(self, capacity: int = MAX_OPEN_FILES):
+        self.capacity = capacity
+        self.files = OrderedDict()
+        # このプログラムで書き始めたファイル
+        self.written = set()
+
+    def get(self, path: str):
+        file = self.files.get(path)
+        if file is not None:
+            self.files.move_to_end(path)
+            return file
+
+        if len(self.files) >= self.capacity:
+            _, oldest = self.files.popitem(last=False)
+            oldest.close()
+        mode = "a" if path in self.written else "w"
+        try:
+            file = open(path, mode, encoding="utf-8",
+                        errors="surrogateescape")
+        except OSError as e:
+            raise NativeError(f"Can't open {path}: {e.strerror}.")
+        self.written.add(path)
+        self.files[path] = file
+        return file
+
+    def close(self, path: str) -> bool:
+        "path を閉じる。開いていなければ False を返す"
+        self.written.discard(path)
+        file = self.files.pop(path, None)
+        if file is None:
+            return False
+        file.close()
+        return True
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close_all(self):
+        while self.files:
+            _, file = self.files.popitem()
+            file.close()
+        self.written.clear()
+
+
+class Output:
+    """
+    print の出力先。文字列をためておき、フラッシュの方針に従って
+    まとめてエンコードし、標準出力のバイナリのストリームに書き出す。
+    名前を指定した出力は FilePool で開いたファイルに書く
+    """
+
+    def __init__(self, policy: str | None = None):
+        self.pieces = []
+        # pieces の合計の文字数
+        self.size = 0
+        self.set_policy(policy)
+        self.files = FilePool()
+
+    def set_policy(self, policy: str | None):
+        self.policy = policy or default_policy()
+        # この文字数以上たまったら書き出す
+        self.limit = {"line": 0,
+                      "block": BUFFER_SIZE,
+                      "explicit": float("inf")}[self.policy]
+
+    def print(self, value):
+        if type(value) is not str:
+            if isinstance(value, (list, dict)):
+                self.print_chunks(value)
+                return
+            value = stringify(value)
+        pieces = self.pieces
+        pieces.append(value)
+        pieces.append("\n")
+        self.size += len(value) + 1
+        if self.size >= self.limit:
+            self.flush()
+
+    def print_chunks(self, value):
+        "大きなリスト・マップも、全体の文字列を作らずに少しずつためる"
+        for chunk in stringify_chunks(value):
+            self.pieces.append(chunk)
+            self.size += len(chunk)
+            if self.size >= self.limit:
+                self.flush()
+        self.pieces.append("\n")
+        self.size += 1
+        if self.size >= self.limit:
+            self.flush()
+
+    def print_to(self, path: str, value):
+        if path in STDOUT_NAMES:
+            self.print(value)
+        elif path in STDERR_NAMES:
+            write_line(sys.stderr.write, value)
+        else:
+            write_line(self.files.get(path).write, value)
+
+    def flush(self):
+        "たまっている出力を書き出す"
+        if not self.pieces:
+            return
+        text = "".join(self.pieces)
+        self.pieces.clear()
+        self.size = 0
+
+        stdout = sys.stdout
+        # print() などで書かれた分を先に出す
+        stdout.flush()
+        buffer = getattr(stdout, "buffer", None)
+        if buffer is None:
+            stdout.write(text)
+            stdout.flush()
+            return
+        buffer.write(text.encode(stdout.encoding or "utf-8",
+                                 "surrogateescape"))
+        buffer.flush()
+
+    def flush_all(self):
+        self.flush()
+        self.files.flush()
+
+    def close(self):
+        "標準出力を書き出し、開いているファイルをすべて閉じる"
+        try:
+            self.flush()
+        finally:
+            self.files.close_all()
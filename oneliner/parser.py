@@ -1,12 +1,31 @@
 from oneliner.token import Token, TokenType
-from oneliner.expr import Expr, BinaryExpr, SetExpr, ThisExpr, UnaryExpr, \
+from oneliner.expr import Expr, SetExpr, ThisExpr, UnaryExpr, \
     LiteralExpr,  GroupingExpr, TernaryExpr, VariableExpr, AssignExpr, \
     LogicalExpr, CallExpr, GetExpr, SuperExpr, FunctionExpr, ListExpr, \
-    MapExpr, IndexGetExpr, IndexSetExpr
+    MapExpr, IndexGetExpr, IndexSetExpr, AddExpr, SubtractExpr, \
+    MultiplyExpr, DivideExpr, FloorDivideExpr, ModuloExpr, GreaterExpr, \
+    GreaterEqualExpr, LessExpr, LessEqualExpr, EqualExpr, NotEqualExpr
 from oneliner.stmt import ClassStmt, Stmt, EmptyStmt, ExpressionStmt, \
-    VarStmt, BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt
+    VarStmt, BlockStmt, IfStmt, WhileStmt, FunctionStmt, ReturnStmt, \
+    ForInStmt
 from oneliner.error import ParseError, ErrorReporter
 
+# 二項演算子ごとのノード(どれもBinaryExprのサブクラス)
+BINARY_EXPRS = {
+    TokenType.PLUS: AddExpr,
+    TokenType.MINUS: SubtractExpr,
+    TokenType.STAR: MultiplyExpr,
+    TokenType.SLASH: DivideExpr,
+    TokenType.DOUBLE_SLASH: FloorDivideExpr,
+    TokenType.PERCENT: ModuloExpr,
+    TokenType.GREATER: GreaterExpr,
+    TokenType.GREATER_EQUAL: GreaterEqualExpr,
+    TokenType.LESS: LessExpr,
+    TokenType.LESS_EQUAL: LessEqualExpr,
+    TokenType.DOUBLE_EQUAL: EqualExpr,
+    TokenType.BANG_EQUAL: NotEqualExpr,
+}
+
 
 class Parser:
 
@@ -24,6 +43,38 @@ class Parser:
         except ParseError:
             return None
 
+    def parse_stream(self) \
+            -> tuple[list[Stmt], list[Stmt], list[Stmt]] | None:
+        """
+        ストリーミングモードのプログラムを、トップレベルの BEGIN {...} と
+        END {...} の中身、それ以外(レコードごとに実行する本体)に分けて
+        (BEGIN, 本体, END) を返す。BEGIN/END の中身もトップレベルの文になる
+        """
+        try:
+            begin: list[Stmt] = []
+            body: list[Stmt] = []
+            end: list[Stmt] = []
+            while not self.is_at_end():
+                if self.match_pattern("BEGIN"):
+                    begin.extend(self.block_statement())
+                elif self.match_pattern("END"):
+                    end.extend(self.block_statement())
+                else:
+                    body.append(self.declaration())
+            return begin, body, end
+        except ParseError:
+            return None
+
+    def match_pattern(self, name: str) -> bool:
+        "name { の並びなら消費してTrueを返す"
+        token = self.peek()
+        if token.type != TokenType.IDENTIFIER or token.lexeme != name:
+            return False
+        if self.tokens[self.current + 1].type != TokenType.LEFT_BRACE:
+            return False
+        self.current += 2
+        return True
+
     #
     # statements
     #
@@ -187,6 +238,10 @@ class Parser:
     def for_statement(self) -> Stmt:
         self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'for'.")
 
+        name = self.match_for_in()
+        if name is not None:
+            return self.for_in_statement(name)
+
         # initializer
         initializer: Stmt = None
         if self.match(TokenType.SEMICOLON):
@@ -223,6 +278,28 @@ class Parser:
 
         return body
 
+    # for(x in iterable) {}
+
+    def match_for_in(self) -> Token | None:
+        "(var)? name in の並びなら消費して name を返す。in は予約語ではない"
+        start = self.current
+        if self.check(TokenType.VAR):
+            start += 1
+        name = self.tokens[start]
+        if name.type != TokenType.IDENTIFIER:
+            return None
+        keyword = self.tokens[start + 1]
+        if keyword.type != TokenType.IDENTIFIER or keyword.lexeme != "in":
+            return None
+        self.current = start + 2
+        return name
+
+    def for_in_statement(self, name: Token) -> Stmt:
+        iterable = self.expression()
+        self.consume(TokenType.RIGHT_PAREN, "Expect ')' after for clause.")
+        body = self.statement()
+        return ForInStmt(name, iterable, body)
+
     #
     # expressions
     #
@@ -281,7 +358,7 @@ class Parser:
         while (self.match(TokenType.BANG_EQUAL, TokenType.DOUBLE_EQUAL)):
             operator = self.previous()
             right = self.comparison()
-            expr = BinaryExpr(expr, operator, right)
+            expr = BINARY_EXPRS[operator.type](expr, operator, right)
         return expr
 
     def match(self, *types: TokenType) -> bool:
@@ -317,7 +394,7 @@ class Parser:
                           TokenType.LESS, TokenType.LESS_EQUAL)):
             operator = self.previous()
             right = self.term()
-            expr = BinaryExpr(expr, operator, right)
+            expr = BINARY_EXPRS[operator.type](expr, operator, right)
         return expr
 
     def term(self) -> Expr:
@@ -325,7 +402,7 @@ class Parser:
         while (self.match(TokenType.MINUS, TokenType.PLUS)):
             operator = self.previous()
             right = self.factor()
-            expr = BinaryExpr(expr, operator, right)
+            expr = BINARY_EXPRS[operator.type](expr, operator, right)
         return expr
 
     def factor(self) -> Expr:
@@ -336,7 +413,7 @@ class Parser:
                           TokenType.PERCENT)):
             operator = self.previous()
             right = self.unary()
-            expr = BinaryExpr(expr, operator, right)
+            expr = BINARY_EXPRS[operator.type](expr, operator, right)
         return expr
 
     def unary(self) -> Expr:
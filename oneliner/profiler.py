@@ -0,0 +1,216 @@
+import sys
+from collections import Counter, defaultdict
+from time import perf_counter
+from oneliner.builtin import NativeFunction
+from oneliner.closure_compiler import ClosureInterpreter, CompiledFunction
+from oneliner.function import Function
+from oneliner.interpreter import Interpreter
+from oneliner.klass import Klass
+from oneliner.vm import VM
+
+
+class FunctionStats:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        # 呼び出し元の行番号ごとの回数
+        self.sites: Counter[int] = Counter()
+        # 再帰中の呼び出しの数。一番外側の呼び出しだけを inclusive に数える
+        self.active = 0
+
+
+class Frame:
+    __slots__ = ("name", "start", "children")
+
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.start = start
+        self.children = 0.0
+
+
+class Profiler:
+    """
+    1lの関数(Function)、クラスの生成(Klass)、ネイティブ関数の呼び出しごとに
+    呼び出し回数、包括時間・自己時間、呼び出し元の行番号を記録する。
+
+    install() したときだけ各クラスの call を差し替えるので、
+    --profile を付けないときのオーバーヘッドはない。
+    """
+
+    def __init__(self):
+        self.stats: dict[str, FunctionStats] = {}
+        self.stack: list[Frame] = []
+        # 実行中の呼び出し式の行番号
+        self.sites: list[int] = []
+        # 関数名を ; でつないだ呼び出しスタックごとの自己時間
+        self.stacks: defaultdict[tuple[str, ...], float] = defaultdict(float)
+        self.started = perf_counter()
+
+    #
+    # 計測
+    #
+
+    def enter(self, name: str, kind: str):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = FunctionStats(kind)
+        stats.calls += 1
+        stats.active += 1
+        if self.sites:
+            stats.sites[self.sites[-1]] += 1
+        self.stack.append(Frame(name, perf_counter()))
+
+    def exit(self):
+        now = perf_counter()
+        frame = self.stack.pop()
+        elapsed = now - frame.start
+        stats = self.stats[frame.name]
+        stats.active -= 1
+        if stats.active == 0:
+            stats.inclusive += elapsed
+        stats.exclusive += elapsed - frame.children
+        self.stacks[tuple(f.name for f in self.stack) + (frame.name,)] += \
+            elapsed - frame.children
+        if self.stack:
+            self.stack[-1].children += elapsed
+
+    def profile(self, original, label):
+        "call(やcall_method)メソッドを、計測してから元のメソッドを呼ぶ関数で包む"
+        profiler = self
+
+        def call(callee, interpreter, *arguments):
+            name, kind = label(callee)
+            profiler.enter(name, kind)
+            try:
+                return original(callee, interpreter, *arguments)
+            finally:
+                profiler.exit()
+        return call
+
+    def profile_function(self, original):
+        "メソッドは call_method で計測するので、call ではそれ以外の関数だけを計測する"
+        profiled = self.profile(original, function_label)
+
+        def call(callee, interpreter, arguments):
+            if callee.is_method:
+                return original(callee, interpreter, arguments)
+            return profiled(callee, interpreter, arguments)
+        return call
+
+    def call_site(self, original):
+        "呼び出し式の評価中、その行番号を sites に積む"
+        sites = self.sites
+
+        def visit_call_expr(expr):
+            sites.append(expr.paren.line)
+            try:
+                return original(expr)
+            finally:
+                sites.pop()
+        return visit_call_expr
+
+    def compiled_call_site(self, original):
+        "クロージャにコンパイルした呼び出し式を、行番号を積むように包む"
+        sites = self.sites
+
+        def visit_call_expr(expr):
+            call = original(expr)
+            line = expr.paren.line
+
+            def profiled_call(env):
+                sites.append(line)
+                try:
+                    return call(env)
+                finally:
+                    sites.pop()
+            return profiled_call
+        return visit_call_expr
+
+    def install(self, interpreter: Interpreter):
+        if isinstance(interpreter, VM):
+            raise ValueError("--profile is not supported by the vm engine")
+
+        # メソッドはどこから呼ばれても call_method を通る
+        for function_type in (Function, CompiledFunction):
+            function_type.call = self.profile_function(function_type.call)
+            function_type.call_method = self.profile(
+                function_type.call_method, function_label)
+            # 末尾呼び出しはトランポリンから run で実行される
+            function_type.run = self.profile(function_type.run,
+                                             function_label)
+        Klass.call = self.profile(Klass.call, class_label)
+        interpreter.globals.variables.load_natives()
+        for native in set(interpreter.globals.variables.values()):
+            if isinstance(native, NativeFunction):
+                native_type = type(native)
+                native_type.call = self.profile(native_type.call,
+                                                native_label)
+
+        if isinstance(interpreter, ClosureInterpreter):
+            compiler = interpreter.compiler
+            compiler.visit_call_expr = \
+                self.compiled_call_site(compiler.visit_call_expr)
+        else:
+            interpreter.visit_call_expr = \
+                self.call_site(interpreter.visit_call_expr)
+
+    #
+    # 出力
+    #
+
+    def overhead(self) -> float:
+        "enter/exit 1回あたりのおおよその時間"
+        count = 10000
+        start = perf_counter()
+        for _ in range(count):
+            self.enter("<calibration>", "")
+            self.exit()
+        elapsed = (perf_counter() - start) / count
+        del self.stats["<calibration>"]
+        del self.stacks[("<calibration>",)]
+        return elapsed
+
+    def report(self, file=sys.stderr):
+        total = perf_counter() - self.started
+        calls = sum(stats.calls for stats in self.stats.values())
+        overhead = self.overhead()
+
+        print(f"{'calls':>8} {'incl ms':>10} {'excl ms':>10}  "
+              f"{'kind':6} {'function':24} call sites", file=file)
+        for name, stats in sorted(self.stats.items(),
+                                  key=lambda item: -item[1].exclusive):
+            sites = ", ".join(f"{line}x{count}"
+                              for line, count
+                              in stats.sites.most_common(3))
+            if len(stats.sites) > 3:
+                sites += ", ..."
+            print(f"{stats.calls:8} {stats.inclusive * 1000:10.2f}"
+                  f" {stats.exclusive * 1000:10.2f}  "
+                  f"{stats.kind:6} {name:24} {sites}", file=file)
+        print(f"total {total * 1000:.2f} ms, {calls} calls, "
+              f"profiler overhead about {overhead * 1e6:.2f} us/call "
+              f"({overhead * calls * 1000:.2f} ms)", file=file)
+
+    def write_stacks(self, path: str):
+        "flamegraph.pl などで読める collapsed stack 形式(値はマイクロ秒)"
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, seconds in sorted(self.stacks.items()):
+                microseconds = round(seconds * 1e6)
+                if microseconds > 0:
+                    print(f"{';'.join(stack)} {microseconds}", file=file)
+
+
+def function_label(function: Function) -> tuple[str, str]:
+    if function.name is None:
+        return "<lambda>", "lambda"
+    return f"{function.name.lexeme}@{function.name.line}", "fun"
+
+
+def class_label(klass: Klass) -> tuple[str, str]:
+    return f"{klass.name.lexeme}@{klass.name.line}", "class"
+
+
+def native_label(native: NativeFunction) -> tuple[str, str]:
+    return native.name(), "native"
@@ -1,14 +1,14 @@
 from oneliner.error import ErrorReporter
 from oneliner.token import Token
-from oneliner.interpreter import Interpreter
+from oneliner.klass import MethodCache, PropertyCache
 from oneliner.expr import ExprVisitor, AssignExpr, BinaryExpr, Expr, \
     FunctionExpr, SetExpr, TernaryExpr, \
     VariableExpr, CallExpr, GroupingExpr, LiteralExpr, LogicalExpr, \
     UnaryExpr, GetExpr, ThisExpr, SuperExpr, ListExpr, MapExpr, \
-    IndexGetExpr, IndexSetExpr
+    IndexGetExpr, IndexSetExpr, RangeExpr
 from oneliner.stmt import StmtVisitor, BlockStmt, IfStmt, Stmt, VarStmt, \
     FunctionStmt, ExpressionStmt, ReturnStmt, WhileStmt, ClassStmt, \
-    EmptyStmt
+    EmptyStmt, ForInStmt
 from enum import Enum, auto
 
 
@@ -25,13 +25,53 @@ class ClassType(Enum):
     SUBCLASS = auto()
 
 
+# ブロック直下にあると、そのブロックに変数を宣言する文
+DECLARATIONS = (VarStmt, FunctionStmt, ClassStmt)
+
+
+def has_tail_call(expr: Expr) -> bool:
+    "return文の値の中に、末尾位置の呼び出し(結果がそのまま戻り値になる呼び出し)があるか"
+    match expr:
+        case CallExpr():
+            return True
+        case TernaryExpr():
+            return has_tail_call(expr.then_expr) or \
+                has_tail_call(expr.else_expr)
+        case GroupingExpr():
+            return has_tail_call(expr.expression)
+        case _:
+            return False
+
+
+class Scope:
+    "変数名ごとに、スロット番号と定義済みかどうかを持つ"
+
+    def __init__(self):
+        self.slots: dict[str, int] = {}
+        self.defined: dict[str, bool] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.slots
+
+    def declare(self, name: str):
+        self.slots[name] = len(self.slots)
+        self.defined[name] = False
+
+    def define(self, name: str):
+        if name not in self.slots:
+            self.declare(name)
+        self.defined[name] = True
+
+
 class Resolver(StmtVisitor, ExprVisitor):
-    def __init__(self,
-                 interpreter: Interpreter,
-                 error_reporter: ErrorReporter):
-        self.interpreter = interpreter
+    """
+    ローカル変数の参照に、何個外側のスコープか(depth)とその中のスロット番号(slot)を
+    割り当て、ノード自身に記録する。グローバル変数の場合は depth が None のまま。
+    """
+
+    def __init__(self, error_reporter: ErrorReporter):
         self.error_reporter = error_reporter
-        self.scopes: list[dict[str, bool]] = []
+        self.scopes: list[Scope] = []
         self.current_function = FunctionType.NONE
         self.current_class = ClassType.NONE
 
@@ -57,9 +97,16 @@ class Resolver(StmtVisitor, ExprVisitor):
         pass
 
     def visit_block_stmt(self, stmt: BlockStmt) -> None:
+        # 変数を宣言しないブロックには実行時の環境を作らない
+        if not any(isinstance(statement, DECLARATIONS)
+                   for statement in stmt.statements):
+            stmt.slots = None
+            self.resolve(stmt.statements)
+            return
+
         self.begin_scope()
         self.resolve(stmt.statements)
-        self.end_scope()
+        stmt.slots = self.end_scope()
 
     def visit_class_stmt(self, stmt: ClassStmt):
         enclosing_class = self.current_class
@@ -67,6 +114,7 @@ class Resolver(StmtVisitor, ExprVisitor):
 
         self.declare(stmt.name)
         self.define(stmt.name)
+        stmt.slot = self.slot_of(stmt.name)
 
         if stmt.superclass is not None:
             self.current_class = ClassType.SUBCLASS
@@ -77,10 +125,7 @@ class Resolver(StmtVisitor, ExprVisitor):
             self.resolve(stmt.superclass)
 
             self.begin_scope()
-            self.scopes[-1]["super"] = True
-
-        self.begin_scope()
-        self.scopes[-1]["this"] = True
+            self.scopes[-1].define("super")
 
         for method in stmt.methods:
             function_type = FunctionType.METHOD
@@ -88,25 +133,24 @@ class Resolver(StmtVisitor, ExprVisitor):
                 function_type = FunctionType.INITIALIZER
             self.resolve_function(method.function, function_type)
 
-        self.end_scope()
-
         if stmt.superclass is not None:
             self.end_scope()
 
         self.current_class = enclosing_class
 
     def begin_scope(self) -> None:
-        scope: dict[str, bool] = {}
-        self.scopes.append(scope)
+        self.scopes.append(Scope())
 
-    def end_scope(self) -> None:
-        self.scopes.pop()
+    def end_scope(self) -> dict[str, int]:
+        "スコープを閉じ、変数名からスロット番号への対応を返す"
+        return self.scopes.pop().slots
 
     def visit_var_stmt(self, stmt: VarStmt) -> None:
         self.declare(stmt.name)
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
+        stmt.slot = self.slot_of(stmt.name)
 
     def declare(self, name: Token) -> None:
         if len(self.scopes) == 0:
@@ -116,18 +160,23 @@ class Resolver(StmtVisitor, ExprVisitor):
             self.error_reporter.error(name, "Can't redeclare variable.")
             return
 
-        scope[name.lexeme] = False
+        scope.declare(name.lexeme)
 
     def define(self, name: Token) -> None:
         if len(self.scopes) == 0:
             return
-        scope = self.scopes[-1]
-        scope[name.lexeme] = True
+        self.scopes[-1].define(name.lexeme)
+
+    def slot_of(self, name: Token) -> int | None:
+        "現在のスコープでの変数のスロット番号。グローバル変数ならNone"
+        if len(self.scopes) == 0:
+            return None
+        return self.scopes[-1].slots[name.lexeme]
 
     def visit_variable_expr(self, expr: VariableExpr) -> None:
         if (len(self.scopes) > 0) \
                 and (expr.name.lexeme in self.scopes[-1]) \
-                and (self.scopes[-1][expr.name.lexeme] is False):
+                and (self.scopes[-1].defined[expr.name.lexeme] is False):
             self.error_reporter.error(
                 expr.name,
                 "Can't read local variable in its own initializer.")
@@ -135,10 +184,15 @@ class Resolver(StmtVisitor, ExprVisitor):
         self.resolve_local(expr, expr.name)
 
     def resolve_local(self, expr: Expr, name: Token) -> None:
+        if (found := self.find_local(name.lexeme)) is not None:
+            expr.depth, expr.slot = found
+
+    def find_local(self, name: str) -> tuple[int, int] | None:
+        "ローカル変数の(depth, slot)。グローバル変数ならNone"
         for i in range(len(self.scopes) - 1, -1, -1):
-            if name.lexeme in self.scopes[i]:
-                self.interpreter.resolve(expr, len(self.scopes) - 1 - i)
-                return
+            if name in self.scopes[i]:
+                return len(self.scopes) - 1 - i, self.scopes[i].slots[name]
+        return None
 
     def visit_assign_expr(self, expr: AssignExpr) -> None:
         self.resolve(expr.value)
@@ -147,6 +201,7 @@ class Resolver(StmtVisitor, ExprVisitor):
     def visit_function_stmt(self, stmt: FunctionStmt) -> None:
         self.declare(stmt.name)
         self.define(stmt.name)
+        stmt.slot = self.slot_of(stmt.name)
         self.resolve_function(stmt.function, FunctionType.FUNCTION)
 
     def resolve_function(self,
@@ -156,11 +211,14 @@ class Resolver(StmtVisitor, ExprVisitor):
         self.current_function = type
 
         self.begin_scope()
+        # メソッドの this は呼び出しの環境のスロット0に置く
+        if type in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.scopes[-1].define("this")
         for param in function.params:
             self.declare(param)
             self.define(param)
         self.resolve(function.body)
-        self.end_scope()
+        function.slots = self.end_scope()
 
         self.current_function = enclosing_function
 
@@ -186,11 +244,22 @@ class Resolver(StmtVisitor, ExprVisitor):
                     "Can't return a value from an initializer.")
 
             self.resolve(stmt.value)
+            stmt.tail = has_tail_call(stmt.value)
 
     def visit_while_stmt(self, stmt: WhileStmt) -> None:
         self.resolve(stmt.condition)
         self.resolve(stmt.body)
 
+    def visit_for_in_stmt(self, stmt: ForInStmt) -> None:
+        # ループ変数はループだけのスコープに置く
+        self.resolve(stmt.iterable)
+        self.begin_scope()
+        self.declare(stmt.name)
+        self.define(stmt.name)
+        stmt.slot = self.slot_of(stmt.name)
+        self.resolve(stmt.body)
+        stmt.slots = self.end_scope()
+
     def visit_binary_expr(self, expr: BinaryExpr) -> None:
         self.resolve(expr.left)
         self.resolve(expr.right)
@@ -202,6 +271,12 @@ class Resolver(StmtVisitor, ExprVisitor):
 
     def visit_call_expr(self, expr: CallExpr) -> None:
         self.resolve(expr.callee)
+        # obj.name(...) と super.name(...) の呼び出し箇所には
+        # メソッドのインラインキャッシュを持たせる
+        if isinstance(expr.callee, GetExpr):
+            expr.cache = MethodCache(expr.callee.name)
+        elif isinstance(expr.callee, SuperExpr):
+            expr.cache = expr.callee.cache
         for arg in expr.arguments:
             self.resolve(arg)
 
@@ -214,15 +289,22 @@ class Resolver(StmtVisitor, ExprVisitor):
         self.resolve(expr.index)
         self.resolve(expr.value)
 
+    def visit_range_expr(self, expr: RangeExpr) -> None:
+        self.resolve(expr.start)
+        self.resolve(expr.stop)
+        self.resolve(expr.step)
+
     def visit_function_expr(self, expr: FunctionExpr) -> None:
         self.resolve_function(expr, FunctionType.FUNCTION)
 
     def visit_get_expr(self, expr: GetExpr) -> None:
         self.resolve(expr.object)
+        expr.cache = PropertyCache(expr.name)
 
     def visit_set_expr(self, expr: SetExpr) -> None:
         self.resolve(expr.value)
         self.resolve(expr.object)
+        expr.cache = PropertyCache(expr.name)
 
     def visit_grouping_expr(self, expr: GroupingExpr) -> None:
         self.resolve(expr.expression)
@@ -267,3 +349,6 @@ class Resolver(StmtVisitor, ExprVisitor):
             return
 
         self.resolve_local(expr, expr.keyword)
+        expr.this_depth, _ = self.find_local("this")
+        # スーパークラスは定義ごとに決まるので、ほぼ単相になる
+        expr.cache = MethodCache(expr.method)
@@ -1,36 +1,90 @@
+import importlib
+import sys
+from typing import TYPE_CHECKING
 from oneliner.scanner import Scanner
-from oneliner.error import ScanError, ErrorReporter
+from oneliner.error import ScanError, ErrorReporter, InputError
 from oneliner.parser import Parser
-from oneliner.ast_printer import AstPrinter
 from oneliner.interpreter import Interpreter
 from oneliner.resolver import Resolver
-import readline
-import logging
+from oneliner.optimizer import Optimizer
+from oneliner.stmt import Stmt
+from oneliner.stream import StreamProcessor
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+if TYPE_CHECKING:
+    from oneliner.cache import ProgramCache
+
+# --engine で選べる実行エンジンの、モジュールとクラスの名前。
+# 使うものだけを読み込む(起動を速くするため)
+ENGINES = {
+    "tree": ("oneliner.interpreter", "Interpreter"),
+    "closure": ("oneliner.closure_compiler", "ClosureInterpreter"),
+    "vm": ("oneliner.vm", "VM"),
+}
+
+
+def load_engine(engine: str) -> type[Interpreter]:
+    module, name = ENGINES[engine]
+    return getattr(importlib.import_module(module), name)
 
 
 class Runner:
 
     def __init__(self, args):
         self.is_debug = args.debug
+        self.engine = args.engine
+        # -O0 で Optimizer を使わない
+        self.optimize = args.optimize > 0
         self.error_reporter = ErrorReporter()
-        self.interpreter = Interpreter(self.error_reporter)
+        self.interpreter = self.create_interpreter(args.engine)
+        if args.max_depth is not None:
+            self.interpreter.set_max_depth(args.max_depth)
+        self.interpreter.output.set_policy(args.flush)
+        # デバッグ時はASTを表示したいのでキャッシュを使わない
+        self.use_cache = args.cache and not self.is_debug
+        self.profiler = None
+        self.profile_stacks = args.profile_stacks
+        if args.profile or args.profile_stacks:
+            from oneliner.profiler import Profiler
+            self.profiler = Profiler()
+            self.profiler.install(self.interpreter)
+        # -n / -p のときは、入力のレコードごとにプログラムを実行する
+        self.stream = None
+        if args.loop or args.print_records:
+            self.stream = StreamProcessor(
+                self.interpreter,
+                field_separator=args.field_separator,
+                record_separator=args.record_separator,
+                print_records=args.print_records)
+
+    def close(self):
+        "出力を書き出し、fprint で開いたファイルを閉じる"
+        self.interpreter.output.close()
+
+    def create_interpreter(self, engine: str) -> Interpreter:
+        return load_engine(engine)(self.error_reporter)
 
     def run_file(self, script_path: str, args: list[str] = []):
         with open(script_path, 'r', encoding='utf-8') as file:
             code = file.read()
-            self.run(code, args)
-            if self.error_reporter.has_error:
-                exit(65)
-            if self.error_reporter.has_runtime_error:
-                exit(70)
+        cache = None
+        if self.use_cache:
+            from oneliner.cache import ProgramCache
+            cache = ProgramCache()
+        self.run(code, args, cache)
+        if self.error_reporter.has_error:
+            exit(65)
+        if self.error_reporter.has_runtime_error:
+            exit(70)
 
     def run_prompt(self):
+        # 行編集とエラーのログはREPLでだけ使う
+        import logging
+        import readline
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+        logger = logging.getLogger(__name__)
         readline.parse_and_bind("tab: complete")
 
         while True:
@@ -48,29 +102,96 @@ class Runner:
             except Exception as e:
                 logger.exception("error: %s", e)
 
-    def run(self, code: str, args: list[str] = []):
+    def run(self,
+            code: str,
+            args: list[str] = [],
+            cache: "ProgramCache | None" = None):
+        kind = "program" if self.stream is None else "stream"
+        if not self.optimize:
+            kind += "-O0"
+        statements = None
+        if cache is not None:
+            statements = cache.load(code, kind)
+
+        if statements is None:
+            statements = self.parse(code)
+            if statements is None:
+                return
+            if cache is not None:
+                cache.store(code, statements, kind)
+
+        if self.stream is not None:
+            self.run_stream(*statements, args)
+        else:
+            if self.is_debug and self.engine == "vm":
+                from oneliner.compiler import Compiler, disassemble
+                print(disassemble(Compiler().compile(statements)))
+
+            self.interpreter.interpret(statements)
+
+        if self.profiler is not None:
+            self.report_profile()
+
+    def report_profile(self):
+        self.profiler.report()
+        if self.profile_stacks:
+            self.profiler.write_stacks(self.profile_stacks)
+
+    def run_stream(self,
+                   begin: list[Stmt],
+                   body: list[Stmt],
+                   end: list[Stmt],
+                   paths: list[str]):
+        try:
+            self.stream.run(begin, body, end, paths)
+        except InputError as e:
+            print(f"Can't read input: {e}", file=sys.stderr)
+            exit(66)
+
+    def parse(self, code: str):
+        """
+        スキャン、パース、変数の解決を行う。エラーがあればNoneを返す。
+        ストリーミングモードでは (BEGIN, 本体, END) の文のリストを返す
+        """
         scanner = Scanner(code, self.error_reporter)
         try:
             tokens = scanner.scan_tokens()
 
             parser = Parser(tokens, self.error_reporter)
-            statements = parser.parse()
+            if self.stream is None:
+                statements = parser.parse()
+                parts = [statements]
+            else:
+                statements = parser.parse_stream()
+                parts = statements or []
 
             # 構文エラーがあれば停止
             if (self.error_reporter.has_error):
-                return
+                return None
 
             if self.is_debug:
+                from oneliner.ast_printer import AstPrinter
                 printer = AstPrinter()
-                printer.print(statements)
+                for part in parts:
+                    printer.print(part)
 
-            resolver = Resolver(self.interpreter, self.error_reporter)
-            resolver.resolve(statements)
+            resolver = Resolver(self.error_reporter)
+            for part in parts:
+                resolver.resolve(part)
             if self.error_reporter.has_error:
-                return
+                return None
 
-            self.interpreter.interpret(statements)
+            if self.optimize:
+                optimizer = Optimizer()
+                parts = [optimizer.optimize(part) for part in parts]
+                statements = parts[0] if self.stream is None else tuple(parts)
+                if self.is_debug:
+                    print("# optimized")
+                    for part in parts:
+                        printer.print(part)
+
+            return statements
 
         except ScanError as e:
             self.report(e.line, e.current, e.message)
-            return
+            return None
@@ -1,6 +1,7 @@
+import gc
 import re
+import sys
 from oneliner.token import Token, TokenType
-from typing import Union
 from oneliner.error import ErrorReporter
 
 keywords = {
@@ -31,205 +32,129 @@ keywords = {
     "while": TokenType.WHILE
 }
 
+operators = {
+    "(": TokenType.LEFT_PAREN,
+    ")": TokenType.RIGHT_PAREN,
+    "{": TokenType.LEFT_BRACE,
+    "}": TokenType.RIGHT_BRACE,
+    "[": TokenType.LEFT_BRACKET,
+    "]": TokenType.RIGHT_BRACKET,
+    ",": TokenType.COMMA,
+    ".": TokenType.DOT,
+    "-": TokenType.MINUS,
+    "+": TokenType.PLUS,
+    ";": TokenType.SEMICOLON,
+    "*": TokenType.STAR,
+    "?": TokenType.QUESTION,
+    ":": TokenType.COLON,
+    "λ": TokenType.LAMBDA,
+    "^": TokenType.LAMBDA,
+    "!": TokenType.BANG,
+    "!=": TokenType.BANG_EQUAL,
+    "=": TokenType.EQUAL,
+    "==": TokenType.DOUBLE_EQUAL,
+    "<": TokenType.LESS,
+    "<=": TokenType.LESS_EQUAL,
+    ">": TokenType.GREATER,
+    ">=": TokenType.GREATER_EQUAL,
+    "&": TokenType.AMPERSAND,
+    "&&": TokenType.DOUBLE_AMPERSAND,
+    "|": TokenType.PIPE,
+    "||": TokenType.DOUBLE_PIPE,
+    "%": TokenType.PERCENT,
+    "%{": TokenType.PERCENT_LEFT_BRACE,
+    "/": TokenType.SLASH,
+    "//": TokenType.DOUBLE_SLASH,
+}
+
+# 空白を読み飛ばして、1回のマッチで1つの字句を切り出す。
+# 先に書いた選択肢が優先されるので、2文字の演算子は1文字のものより前に置く。
+TOKEN_PATTERN = re.compile(r"""
+    [ \t\r]*
+    ( \n+                                            # 改行
+    | [A-Za-z_][A-Za-z0-9_]*                        # 識別子・キーワード
+    | [0-9]+ (?: \.[0-9]+ )?                        # 数値
+    | != | == | <= | >= | && | \|\| | %\{ | //       # 2文字の演算子
+    | "[^"]*" | '[^']*'                             # 文字列
+    | ["'].*                                        # 閉じていない文字列
+    | \#\{[^}]*\}? | \#\[[^\]]*\]? | \#\([^)]*\)?   # 括弧で囲むコメント
+    | \#[^\n]*                                      # 行末までのコメント
+    | [^ \t\r]                                       # 1文字の演算子など
+    )
+""", re.VERBOSE | re.DOTALL)
+
+IDENTIFIER_START = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_")
+DIGITS = frozenset("0123456789")
+QUOTES = frozenset("\"'")
+
 
 class Scanner:
+    """
+    TOKEN_PATTERN で切り出した字句を、先頭の文字で種類に振り分ける。
+    キーワード・演算子と、一度出てきた識別子・数値は表引きで種類が決まる。
+    識別子の字句は intern して、同じ名前のトークンで文字列を共有する。
+    """
 
     def __init__(self, source: str, error_reporter: ErrorReporter):
         self.tokens = []
         self.source = source
-        self.start: int = 0
-        self.current: int = 0
         self.line: int = 1
         self.error_reporter = error_reporter
+        # 字句から(種類, 共有する字句, リテラル)への表
+        self.known: dict[str, tuple[TokenType, str, int | float | None]] = {
+            text: (type, text, None)
+            for text, type in (keywords | operators).items()}
 
     def scan_tokens(self):
-        while not self.is_at_end():
-            self.start = self.current
-            self.scan_token()
-        self.tokens.append(Token(TokenType.EOF, "", None, self.line))
-        return self.tokens
-
-    def scan_token(self):
-        char = self.advance()
-
-        match char:
-            case "(":
-                self.add_token(TokenType.LEFT_PAREN)
-            case ")":
-                self.add_token(TokenType.RIGHT_PAREN)
-            case "{":
-                self.add_token(TokenType.LEFT_BRACE)
-            case "}":
-                self.add_token(TokenType.RIGHT_BRACE)
-            case "[":
-                self.add_token(TokenType.LEFT_BRACKET)
-            case "]":
-                self.add_token(TokenType.RIGHT_BRACKET)
-            case ",":
-                self.add_token(TokenType.COMMA)
-            case ".":
-                self.add_token(TokenType.DOT)
-            case "-":
-                self.add_token(TokenType.MINUS)
-            case "+":
-                self.add_token(TokenType.PLUS)
-            case ";":
-                self.add_token(TokenType.SEMICOLON)
-            case "*":
-                self.add_token(TokenType.STAR)
-            case "?":
-                self.add_token(TokenType.QUESTION)
-            case ":":
-                self.add_token(TokenType.COLON)
-            case "λ" | "^":
-                self.add_token(TokenType.LAMBDA)
-            case "!":
-                self.add_token(TokenType.BANG_EQUAL
-                               if self.match("=")
-                               else TokenType.BANG)
-            case "=":
-                self.add_token(TokenType.DOUBLE_EQUAL
-                               if self.match("=")
-                               else TokenType.EQUAL)
-            case "<":
-                self.add_token(TokenType.LESS_EQUAL
-                               if self.match("=")
-                               else TokenType.LESS)
-            case ">":
-                self.add_token(TokenType.GREATER_EQUAL
-                               if self.match("=")
-                               else TokenType.GREATER)
-
-            case "&":
-                self.add_token(TokenType.DOUBLE_AMPERSAND
-                               if self.match("&")
-                               else TokenType.AMPERSAND)
-            case "|":
-                self.add_token(TokenType.DOUBLE_PIPE
-                               if self.match("|")
-                               else TokenType.PIPE)
-            case "%":
-                self.add_token(TokenType.PERCENT_LEFT_BRACE
-                               if self.match("{")
-                               else TokenType.PERCENT)
-            case "#":
-                # コメント
-                # #の直後が開き括弧({[の場合、それぞれ)}]までがコメントとして扱われる
-                brackets = {"{": "}", "[": "]", "(": ")"}
-                peeked = self.peek()
-                if peeked in brackets:
-                    closer = brackets[peeked]
-                    while self.peek() != closer and not self.is_at_end():
-                        if self.peek() == "\n":
-                            self.line += 1
-                        self.advance()
-                    self.advance()  # 閉じ括弧を消費
-                else:
-                    while self.peek() != "\n" and not self.is_at_end():
-                        self.advance()
-
-            case "/":
-                self.add_token(TokenType.DOUBLE_SLASH
-                               if self.match("/")
-                               else TokenType.SLASH)
-            case " " | "\t" | "\r":
-                pass
-            case "\n":
-                self.line += 1
-            case '"' | "'":
-                self.string(char)
-            case _:
-                if self.is_digit(char):
-                    self.number()
-                elif self.is_alpha(char):
-                    self.identifier()
+        # トークンは循環参照を作らないので、大量に作る間はGCを止める
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.scan()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def scan(self):
+        tokens = self.tokens
+        append = tokens.append
+        known = self.known
+        line = self.line
+
+        for text in TOKEN_PATTERN.findall(self.source):
+            entry = known.get(text)
+            if entry is not None:
+                append(Token(entry[0], entry[1], entry[2], line))
+                continue
+
+            char = text[0]
+            if char == "\n":
+                line += len(text)
+            elif char in IDENTIFIER_START:
+                text = sys.intern(text)
+                known[text] = entry = (TokenType.IDENTIFIER, text, None)
+                append(Token(entry[0], entry[1], entry[2], line))
+            elif char in DIGITS:
+                if "." in text:
+                    entry = (TokenType.FLOAT, text, float(text))
                 else:
-                    self.error_reporter.error(
-                        self.line, f"Unknown character: {char}"
-                    )
-
-    def is_at_end(self):
-        return self.current >= len(self.source)
-
-    def advance(self):
-        char = self.source[self.current]
-        self.current += 1
-        return char
-
-    def match(self, expected: str):
-        if self.is_at_end():
-            return False
-        if self.source[self.current] != expected:
-            return False
-        self.current += 1
-        return True
-
-    def peek(self):
-        if self.is_at_end():
-            return "\0"
-        return self.source[self.current]
-
-    def peek_next(self):
-        if self.current + 1 >= len(self.source):
-            return "\0"
-        return self.source[self.current+1]
-
-    def add_token(self,
-                  type: TokenType,
-                  literal: Union[int, float, str, None] = None):
-        text = self.source[self.start:self.current]
-        self.tokens.append(Token(type, text, literal, self.line))
-
-    def string(self, closer: str):
-        while self.peek() != closer and not self.is_at_end():
-            if self.peek() == "\n":
-                self.line += 1
-            self.advance()
-
-        if self.is_at_end():
-            self.error_reporter.error(self.line, "Unterminated string")
-            return
-
-        self.advance()  # 閉じる引用符を消費
-        self.add_token(TokenType.STRING,
-                       self.source[self.start + 1:self.current - 1])
-
-    def number(self):
-        while self.is_digit(self.peek()):
-            self.advance()
-
-        is_float = False
-        # 小数点
-        if self.peek() == "." and self.is_digit(self.peek_next()):
-            # 小数点を消費
-            self.advance()
-            while self.is_digit(self.peek()):
-                self.advance()
-            is_float = True
-
-        number_text = self.source[self.start:self.current]
-
-        if is_float:
-            self.add_token(TokenType.FLOAT, float(number_text))
-        else:
-            self.add_token(TokenType.INT, int(number_text))
-
-    def is_digit(self, char: str):
-        return bool(re.match(r'^[0-9]$', char))
-
-    def is_alpha(self, char: str):
-        return bool(re.match(r'^[A-Za-z_]$', char))
-
-    def is_alpha_numeric(self, char: str):
-        return self.is_alpha(char) or self.is_digit(char)
-
-    def identifier(self):
-        while self.is_alpha_numeric(self.peek()):
-            self.advance()
-
-        identifier_text = self.source[self.start:self.current]
-
-        if identifier_text in keywords:
-            self.add_token(keywords[identifier_text])
-        else:
-            self.add_token(TokenType.IDENTIFIER)
+                    entry = (TokenType.INT, text, int(text))
+                known[text] = entry
+                append(Token(entry[0], entry[1], entry[2], line))
+            elif char in QUOTES:
+                # 複数行の文字列は、閉じた行の行番号になる
+                line += text.count("\n")
+                if len(text) == 1 or text[-1] != char:
+                    # 閉じていない文字列はソースの最後までを消費している
+                    self.error_reporter.error(line, "Unterminated string")
+                    break
+                append(Token(TokenType.STRING, text, text[1:-1], line))
+            elif char == "#":
+                line += text.count("\n")
+            else:
+                self.error_reporter.error(line, f"Unknown character: {char}")
+
+        self.line = line
+        append(Token(TokenType.EOF, "", None, line))
+        return tokens
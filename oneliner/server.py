@@ -0,0 +1,239 @@
+import gc
+import importlib
+import marshal
+import os
+import select
+import signal
+import socket
+import stat
+import sys
+import traceback
+from oneliner.client import LENGTH_SIZE, STANDARD_FDS, is_own_socket, \
+    peer_uid, private_directory
+from oneliner.cli import main
+from oneliner.environment import GlobalEnvironment
+from oneliner.interpreter import Interpreter
+from oneliner.runner import ENGINES, load_engine
+
+# 起動時に読み込んでおく、エンジン以外のモジュール
+WARM_MODULES = ("oneliner.cache", "oneliner.profiler", "oneliner.ast_printer",
+                "oneliner.compiler", "gzip", "bz2", "lzma")
+
+
+def warm_up():
+    "ワーカーがリクエストのたびに読み込まなくてよいように、先に読み込んでおく"
+    for engine in ENGINES:
+        load_engine(engine)
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+    # 引数の解釈やネイティブ関数の登録など、最初の実行でだけ行われる準備を
+    # 済ませておく。グローバル変数はリクエストごとに作り直すので残らない
+    for engine in ENGINES:
+        main(["--local", "--no-cache", "--engine", engine, "clock;"])
+    # ここまでに作ったオブジェクトをGCが辿らないようにし、fork した子プロセスで
+    # コピーオンライトのページのコピーが起きにくくする
+    gc.freeze()
+
+
+def receive(connection: socket.socket) -> bytes:
+    data = connection.recv(1 << 16)
+    if not data:
+        raise ConnectionError("the client closed the connection")
+    return data
+
+
+def receive_request(connection: socket.socket) -> tuple[dict, list[int]]:
+    "クライアントの send_request で送られたリクエストとファイル記述子を受け取る"
+    data, fds, _, _ = socket.recv_fds(connection, 1 << 16,
+                                      len(STANDARD_FDS))
+    if not data:
+        raise ConnectionError("the client closed the connection")
+    while len(data) < LENGTH_SIZE:
+        data += receive(connection)
+    length = int.from_bytes(data[:LENGTH_SIZE], "big")
+    while len(data) < LENGTH_SIZE + length:
+        data += receive(connection)
+    return marshal.loads(data[LENGTH_SIZE:]), fds
+
+
+def make_private_directory(directory: str):
+    """
+    デフォルトのソケットを置く /tmp の下のディレクトリを、自分だけが使える
+    権限で作る。他のユーザーが先に作っていたら使わない
+    """
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    status = os.lstat(directory)
+    if (not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid()
+            or status.st_mode & 0o077):
+        sys.exit(f"1l: {directory} must be a directory only you can access")
+
+
+def listen(path: str) -> socket.socket:
+    "path にソケットを作る。動いているサーバがなければ、古いソケットは消す"
+    if os.path.dirname(path) == private_directory():
+        make_private_directory(os.path.dirname(path))
+    if os.path.lexists(path):
+        if not is_own_socket(path):
+            sys.exit(f"1l: {path} exists and is not a socket owned by you")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with probe:
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                sys.exit(f"1l: a server is already running at {path}")
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # 同じユーザーのプロセスからだけつなげる
+    previous = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(previous)
+    listener.listen(64)
+    return listener
+
+
+def serve(path: str, workers: int):
+    """
+    1l --server の本体。起動済みのワーカーを workers 個作り、
+    止められるまで、終了したワーカーを作り直す
+    """
+    warm_up()
+    listener = listen(path)
+    pids = set()
+    # SIGTERM でも Ctrl-C と同じように止める
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"1l: serving on {path} with {workers} workers", file=sys.stderr)
+    try:
+        for _ in range(workers):
+            pids.add(spawn(listener))
+        while True:
+            pid, _ = os.wait()
+            if pid in pids:
+                pids.discard(pid)
+                pids.add(spawn(listener))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        listener.close()
+        os.unlink(path)
+
+
+def spawn(listener: socket.socket) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Ctrl-C はサーバの親プロセスが受け、ワーカーは SIGTERM で止める
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        Worker(listener).run()
+    finally:
+        os._exit(0)
+
+
+class Worker:
+    """
+    リクエストを1つずつ受け付け、そのたびに fork した子プロセスで実行する。
+    子プロセスは1つのリクエストを実行したら終わるので、Interpreter.globals も
+    カレントディレクトリも環境変数も、次のリクエストには残らない
+    """
+
+    def __init__(self, listener: socket.socket):
+        self.listener = listener
+
+    def run(self):
+        while True:
+            connection, _ = self.listener.accept()
+            with connection:
+                try:
+                    self.handle(connection)
+                except Exception:
+                    traceback.print_exc()
+
+    def handle(self, connection: socket.socket):
+        # ソケットの権限に加えて、相手が同じユーザーかを確かめる
+        uid = peer_uid(connection)
+        if uid is not None and uid != os.getuid():
+            raise ConnectionError(f"a client of user {uid} was refused")
+        request, fds = receive_request(connection)
+        if len(fds) != len(STANDARD_FDS):
+            raise ConnectionError("the client didn't send its standard I/O")
+        # 子プロセスが終わると閉じるパイプ
+        done, done_writer = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(done)
+            self.listener.close()
+            connection.close()
+            run_request(request, fds)
+        os.close(done_writer)
+        for fd in fds:
+            os.close(fd)
+
+        # クライアントが先に切断したら(Ctrl-Cなど)、実行を止める
+        readable, _, _ = select.select([done, connection], [], [])
+        if done not in readable:
+            os.kill(pid, signal.SIGTERM)
+        _, status = os.waitpid(pid, 0)
+        os.close(done)
+        code = os.waitstatus_to_exitcode(status)
+        # シグナルで終わったときは、シェルと同じく 128 + シグナル番号
+        if code < 0:
+            code = 128 - code
+        try:
+            connection.sendall(bytes([code & 0xff]))
+        except OSError:
+            pass
+
+
+def update_environ(environ: dict):
+    "環境変数をクライアントのものにする。違うものだけを書き換える"
+    for key in os.environ.keys() - environ.keys():
+        del os.environ[key]
+    for key, value in environ.items():
+        if os.environ.get(key) != value:
+            os.environ[key] = value
+
+
+def run_request(request: dict, fds: list[int]):
+    "子プロセスで、クライアントの標準入出力・環境で 1l を実行し、終了する"
+    code = 1
+    try:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in zip(STANDARD_FDS, fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        update_environ(request["environ"])
+        sys.argv = ["1l"] + request["argv"]
+        # グローバル変数はリクエストごとに作り直す
+        Interpreter.globals = GlobalEnvironment()
+        main(request["argv"])
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
@@ -0,0 +1,82 @@
+import _thread
+import os
+import sys
+
+# 1lのプログラムを実行するスレッドのスタックの大きさ(バイト)。
+# 実際に使った分しかメモリは確保されない
+STACK_SIZE = 1 << 31
+# PythonのフレームがCのスタックを使う量の見積もり(バイト)。
+# map のようなネイティブ関数をはさむ再帰では、フレームごとに600バイトほど使う
+C_FRAME_SIZE = 1 << 10
+# STACK_SIZE のスタックがあふれる前に RecursionError になる、再帰の上限
+MAX_RECURSION_LIMIT = STACK_SIZE // C_FRAME_SIZE
+
+
+def call_with_stack(function, recursion_limit: int):
+    """
+    function を STACK_SIZE のスタックを持つスレッドで呼び出し、終わるまで待つ。
+    Pythonの再帰の上限は、その間だけ recursion_limit まで上げる(上限は
+    MAX_RECURSION_LIMIT)。function の例外は呼び出し元で投げ直す。
+    スレッドを作れなければ、再帰の上限は変えずにそのまま呼び出す
+    """
+    errors = []
+    done = _thread.allocate_lock()
+    done.acquire()
+
+    def run():
+        try:
+            function()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            done.release()
+
+    previous_size = _thread.stack_size()
+    previous_limit = sys.getrecursionlimit()
+    try:
+        _thread.stack_size(STACK_SIZE)
+        sys.setrecursionlimit(max(previous_limit,
+                                  min(recursion_limit, MAX_RECURSION_LIMIT)))
+        ident = _thread.start_new_thread(run, ())
+    except (ValueError, RuntimeError, MemoryError):
+        sys.setrecursionlimit(previous_limit)
+        function()
+        return
+    finally:
+        _thread.stack_size(previous_size)
+
+    try:
+        wait(done, ident)
+    finally:
+        sys.setrecursionlimit(previous_limit)
+    if errors:
+        raise errors[0]
+
+
+def wait(done, ident: int):
+    """
+    スレッドが done を解放するまで待つ。Ctrl-C はメインスレッドが受けるので、
+    スレッドに KeyboardInterrupt を送る。入力を待っているスレッドは次の入力まで
+    止まらないので、2回目の Ctrl-C ではスレッドを待たずにプロセスを終わらせる
+    """
+    interrupted = False
+    while True:
+        try:
+            done.acquire()
+            return
+        except KeyboardInterrupt:
+            if interrupted:
+                # 終了処理は入力を待っているスレッドと衝突するので、
+                # ふつうの Ctrl-C と同じくシグナルで終わる
+                import signal
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGINT)
+            interrupted = True
+            interrupt(ident)
+
+
+def interrupt(ident: int):
+    # Ctrl-C のときだけ使うので、ここで読み込む
+    import ctypes
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(ident), ctypes.py_object(KeyboardInterrupt))
@@ -9,6 +9,9 @@ class Stmt:
 
 
 class BlockStmt(Stmt):
+    # Resolverが設定する
+    slots: dict[str, int] | None = None
+
     def __init__(self,
                  statements: list[Stmt]):
 
@@ -39,6 +42,9 @@ class ExpressionStmt(Stmt):
 
 
 class FunctionStmt(Stmt):
+    # Resolverが設定する
+    slot: int | None = None
+
     def __init__(self,
                  name: Token,
                  function: FunctionExpr):
@@ -51,6 +57,9 @@ class FunctionStmt(Stmt):
 
 
 class ClassStmt(Stmt):
+    # Resolverが設定する
+    slot: int | None = None
+
     def __init__(self,
                  name: Token,
                  superclass: VariableExpr,
@@ -79,6 +88,9 @@ class IfStmt(Stmt):
 
 
 class ReturnStmt(Stmt):
+    # Resolverが設定する
+    tail: bool | None = None
+
     def __init__(self,
                  keyword: Token,
                  value: Expr):
@@ -91,6 +103,9 @@ class ReturnStmt(Stmt):
 
 
 class VarStmt(Stmt):
+    # Resolverが設定する
+    slot: int | None = None
+
     def __init__(self,
                  name: Token,
                  initializer: Expr):
@@ -114,6 +129,24 @@ class WhileStmt(Stmt):
         return visitor.visit_while_stmt(self)
 
 
+class ForInStmt(Stmt):
+    # Resolverが設定する
+    slots: dict[str, int] | None = None
+    slot: int | None = None
+
+    def __init__(self,
+                 name: Token,
+                 iterable: Expr,
+                 body: Stmt):
+
+        self.name = name
+        self.iterable = iterable
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visit_for_in_stmt(self)
+
+
 class StmtVisitor(ABC):
 
     @abstractmethod
@@ -151,3 +184,7 @@ class StmtVisitor(ABC):
     @abstractmethod
     def visit_while_stmt(self, stmt: WhileStmt):
         pass
+
+    @abstractmethod
+    def visit_for_in_stmt(self, stmt: ForInStmt):
+        pass
@@ -0,0 +1,207 @@
+import importlib
+import os
+import sys
+from oneliner.utll import stringify
+from oneliner.stmt import Stmt
+from oneliner.environment import GlobalVariables
+from oneliner.error import InputError
+
+# レコードごとに設定される変数
+RECORD = "_"
+RECORD_NUMBER = "NR"
+FIELDS = "F"
+FIELD_COUNT = "NF"
+# BEGINなどで書き換えられる区切り文字
+FIELD_SEPARATOR = "FS"
+RECORD_SEPARATOR = "RS"
+
+CHUNK_SIZE = 1 << 20
+
+set_item = dict.__setitem__
+
+
+class Fields(list):
+    "F のリスト。AWKと同じく、レコードにないフィールドは空文字列になる"
+
+    def __getitem__(self, index):
+        try:
+            return list.__getitem__(self, index)
+        except IndexError:
+            return ""
+
+
+class RecordVariables(GlobalVariables):
+    """
+    ストリーミングモードのグローバル変数。
+    F(フィールドのリスト)と NF(フィールド数)は、参照されたときに初めて
+    現在のレコード _ を FS で分割して作る。
+    AWKの $0 への代入と同じく、_ に代入すると F と NF も作り直す。
+    """
+
+    LAZY = (FIELDS, FIELD_COUNT)
+
+    def __missing__(self, key: str):
+        if key not in self.LAZY:
+            return super().__missing__(key)
+        self.split()
+        return self[key]
+
+    def defines(self, key: str) -> bool:
+        # エンジンは、in で見つからなかったときにだけ呼ぶ
+        return super().defines(key) or key in self.LAZY
+
+    def __setitem__(self, key: str, value):
+        set_item(self, key, value)
+        if key == RECORD:
+            self.pop(FIELDS, None)
+            self.pop(FIELD_COUNT, None)
+
+    # 以下はレコードごとに呼ばれるので、__setitem__ を通さずに設定する
+    def next_record(self, record: str, number: int):
+        set_item(self, RECORD, record)
+        set_item(self, RECORD_NUMBER, number)
+        self.pop(FIELDS, None)
+        self.pop(FIELD_COUNT, None)
+
+    def split(self):
+        record = stringify(self.get(RECORD))
+        separator = self.get(FIELD_SEPARATOR)
+        # AWKと同じく、FSが空白1文字(デフォルト)なら連続する空白で区切る
+        if separator is None or separator == " " or separator == "":
+            fields = record.split()
+        else:
+            fields = record.split(stringify(separator))
+        set_item(self, FIELDS, Fields(fields))
+        set_item(self, FIELD_COUNT, len(fields))
+
+
+# 拡張子ごとの、展開しながら読み書きするモジュール
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "lzma"}
+
+
+def compression(path: str):
+    "path の拡張子が圧縮形式なら、そのモジュールを読み込んで返す"
+    name = COMPRESSIONS.get(os.path.splitext(path)[1])
+    return None if name is None else importlib.import_module(name)
+
+
+def open_input(path: str):
+    "バイナリで読むために開く。圧縮されたファイルは展開しながら読む"
+    module = compression(path)
+    if module is None:
+        return open(path, "rb")
+    return module.open(path, "rb")
+
+
+def open_output(path: str):
+    "テキストで書くために開く。圧縮形式の拡張子なら圧縮しながら書く"
+    module = compression(path)
+    if module is None:
+        return open(path, "w", encoding="utf-8", errors="surrogateescape")
+    return module.open(path, "wt", encoding="utf-8",
+                       errors="surrogateescape")
+
+
+def read_records(paths: list[str],
+                 separator: str,
+                 chunk_size: int = CHUNK_SIZE):
+    """
+    ファイル(なければ標準入力)をバイナリのまま最大 chunk_size ずつ読み、
+    separator で区切ったレコードを順に返す。
+    デコードはチャンクごとにまとめて行う。
+    .gz .bz2 .xz のファイルは展開しながら読む。
+    """
+    encoded = separator.encode("utf-8")
+    for path in paths or ["-"]:
+        if path == "-":
+            yield from split_records(sys.stdin.buffer, separator, encoded,
+                                     chunk_size)
+            continue
+        with open_input(path) as file:
+            yield from split_records(file, separator, encoded, chunk_size)
+
+
+def input_records(paths: list[str], separator: str):
+    """
+    -n / -p の入力のレコード。読み込みの OSError を InputError にして、
+    プログラムの出力などのエラーと区別する
+    """
+    try:
+        yield from read_records(paths, separator)
+    except OSError as e:
+        raise InputError(e) from e
+
+
+def split_records(file, separator: str, encoded: bytes, chunk_size: int):
+    rest = b""
+    # read1 は chunk_size に満たなくても読めた分を返すので、
+    # tail -f のようなパイプの行も届いたらすぐに処理できる
+    while chunk := file.read1(chunk_size):
+        if rest:
+            chunk = rest + chunk
+        # 最後の区切りより後ろは、次のチャンクとつなげてから分割する。
+        # UTF-8では区切りの途中で文字が切れることはない
+        last = chunk.rfind(encoded)
+        if last < 0:
+            rest = chunk
+            continue
+        rest = chunk[last + len(encoded):]
+        text = chunk[:last].decode("utf-8", "surrogateescape")
+        yield from text.split(separator)
+
+    if rest:
+        yield rest.decode("utf-8", "surrogateescape")
+
+
+class StreamProcessor:
+    """
+    AWKのように、入力のレコードごとにプログラムの本体を実行する。
+    プログラムは一度だけprepareし、BEGIN、各レコードの本体、ENDの順に実行する。
+    print_records が真なら、本体の実行後に _ を出力する(-p)。
+    """
+
+    def __init__(self,
+                 interpreter,
+                 field_separator: str | None = None,
+                 record_separator: str = "\n",
+                 print_records: bool = False):
+        self.interpreter = interpreter
+        self.field_separator = field_separator
+        self.record_separator = record_separator
+        self.print_records = print_records
+
+    def run(self,
+            begin: list[Stmt],
+            body: list[Stmt],
+            end: list[Stmt],
+            paths: list[str]):
+        globals = self.interpreter.globals
+        variables = RecordVariables(globals.variables)
+        variables[FIELD_SEPARATOR] = self.field_separator
+        variables[RECORD_SEPARATOR] = self.record_separator
+        variables[RECORD] = None
+        variables[RECORD_NUMBER] = 0
+        # エンジンがグローバル変数を参照する前に差し替える
+        globals.variables = variables
+
+        begin_program = self.interpreter.prepare(begin)
+        body_program = self.interpreter.prepare(body)
+        end_program = self.interpreter.prepare(end)
+        print_records = self.print_records
+        output = self.interpreter.output
+
+        def process():
+            begin_program()
+
+            separator = stringify(variables[RECORD_SEPARATOR]) or "\n"
+            number = 0
+            for record in input_records(paths, separator):
+                number += 1
+                variables.next_record(record, number)
+                body_program()
+                if print_records:
+                    output.print(variables[RECORD])
+
+            end_program()
+
+        self.interpreter.run_program(process)
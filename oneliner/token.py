@@ -70,6 +70,8 @@ class TokenType(Enum):
 
 
 class Token:
+    __slots__ = ("type", "lexeme", "literal", "line")
+
     def __init__(self, type: TokenType,
                  lexeme: str,
                  literal: Union[int, float, str],
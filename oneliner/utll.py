@@ -6,6 +6,90 @@ def camel_to_snake(camel):
     return s1.lower()
 
 
+# これより短い文字列どうしの連結は、Ropeにせずそのまま連結する
+ROPE_MIN_LENGTH = 256
+
+
+class Rope:
+    """
+    + で連結した長い文字列。連結では部品をリストに追加するだけで、
+    1つの文字列にするのは表示・添字・比較・マップのキー・ネイティブ関数の引数などで
+    必要になったときに一度だけ行う。
+    部品のリストは連結した結果のRopeと共有し、末尾への追加だけを行う。
+    count はこのRopeの部品の数で、それより後ろは別のRopeの部品
+    """
+    __slots__ = ("parts", "count", "length", "text")
+
+    def __init__(self, parts: list, length: int):
+        self.parts = parts
+        self.count = len(parts)
+        self.length = length
+        self.text = None
+
+    def append(self, part) -> "Rope":
+        "part は文字列かRope"
+        parts = self.parts
+        if parts is None:
+            parts = [self.text]
+        elif len(parts) != self.count:
+            # 別の連結で既に伸ばされているので、自分の部品だけをコピーする
+            parts = parts[:self.count]
+        parts.append(part)
+        return Rope(parts, self.length + len(part))
+
+    def __str__(self):
+        if self.text is None:
+            self.text = "".join(self.pieces())
+            self.parts = None
+        return self.text
+
+    def pieces(self) -> list[str]:
+        "部品のRopeを(再帰せずに)展開した文字列の列"
+        pieces = []
+        stack = self.parts[self.count - 1::-1]
+        while stack:
+            part = stack.pop()
+            if type(part) is str:
+                pieces.append(part)
+            elif part.text is not None:
+                pieces.append(part.text)
+            else:
+                stack.extend(part.parts[part.count - 1::-1])
+        return pieces
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return str(self)[index]
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __eq__(self, other):
+        if type(other) is Rope:
+            other = str(other)
+        return str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+def concat(left, right):
+    "文字列の + 。長くなる連結はRopeにして、それまでの文字列をコピーしない"
+    if type(left) is Rope:
+        if type(right) is not Rope:
+            right = stringify(right)
+        return left.append(right)
+    left = stringify(left)
+    if type(right) is Rope:
+        return Rope([left, right], len(left) + right.length)
+    right = stringify(right)
+    if len(left) + len(right) < ROPE_MIN_LENGTH:
+        return left + right
+    return Rope([left, right], len(left) + len(right))
+
+
 def stringify(value, for_debug=False):
     match(value):
         case None:
@@ -15,22 +99,78 @@ def stringify(value, for_debug=False):
                 return f'"{value}"'
             else:
                 return value
+        case Rope():
+            return stringify(str(value), for_debug)
         case bool():
             return str(value).lower()
-        case list():
-            return ("[" +
-                    ", ".join([stringify(item, True) for item in value])
-                    + "]")
-        case dict():
-            return ("%{" +
-                    ", ".join(
-                        [f"{stringify(k, True)}: {stringify(v, True)}"
-                         for k, v in value.items()])
-                    + "}")
+        case list() | dict():
+            return "".join(stringify_chunks(value))
         case _:
             return str(value)
 
 
+# stringify_chunks が一度に返す断片の数
+CHUNK_PIECES = 4096
+
+
+def stringify_chunks(value, for_debug=False):
+    """
+    stringify と同じ文字列を、いくつかに分けて返す。入れ子のリスト・マップも
+    再帰せずに辿るので、全体の文字列を作らずに書き出せ、深い入れ子でも
+    Pythonの再帰の上限に当たらない。
+    自分自身を(間接的に)含むリスト・マップは、その位置を [...] / %{...} と表示する
+    """
+    if not isinstance(value, (list, dict)):
+        yield stringify(value, for_debug)
+        return
+
+    # 出力中のリスト・マップの id
+    active = set()
+    # 出力中のリスト・マップごとの [コンテナ, 要素のイテレータ, 要素を出力したか]
+    stack = []
+    pieces = []
+
+    def enter(container):
+        active.add(id(container))
+        if isinstance(container, list):
+            stack.append([container, iter(container), False])
+            pieces.append("[")
+        else:
+            stack.append([container, iter(container.items()), False])
+            pieces.append("%{")
+
+    enter(value)
+    while stack:
+        frame = stack[-1]
+        container, items, started = frame
+        is_map = isinstance(container, dict)
+        for item in items:
+            if started:
+                pieces.append(", ")
+            started = True
+            if is_map:
+                key, item = item
+                pieces.append(stringify(key, True))
+                pieces.append(": ")
+            if isinstance(item, (list, dict)):
+                if id(item) in active:
+                    pieces.append("[...]" if isinstance(item, list)
+                                  else "%{...}")
+                    continue
+                frame[2] = True
+                enter(item)
+                break
+            pieces.append(stringify(item, True))
+            if len(pieces) >= CHUNK_PIECES:
+                yield "".join(pieces)
+                pieces.clear()
+        else:
+            stack.pop()
+            active.discard(id(container))
+            pieces.append("}" if is_map else "]")
+    yield "".join(pieces)
+
+
 def is_truthy(object):
     match(object):
         case None:
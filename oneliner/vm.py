@@ -0,0 +1,612 @@
+from oneliner.utll import is_truthy, concat
+from oneliner.function import Callable, Partial
+from oneliner.error import InterpretError, ErrorReporter, NativeError
+from oneliner.interpreter import Interpreter
+from oneliner.builtin import NumberRange, NumArray, iterate
+from oneliner.klass import Instance, Klass
+from oneliner.compiler import Compiler, FunctionProto, OpCode
+from oneliner.stmt import Stmt
+
+# 配列も数値と同じ演算子で、要素ごとに計算できる
+NUMERIC = (int, float, NumArray)
+
+# 列挙型のメンバ参照は遅いため、ディスパッチループでは整数の定数と比較する
+CONSTANT = OpCode.CONSTANT.value
+NIL = OpCode.NIL.value
+TRUE = OpCode.TRUE.value
+FALSE = OpCode.FALSE.value
+POP = OpCode.POP.value
+GET_LOCAL = OpCode.GET_LOCAL.value
+SET_LOCAL = OpCode.SET_LOCAL.value
+GET_GLOBAL = OpCode.GET_GLOBAL.value
+DEFINE_GLOBAL = OpCode.DEFINE_GLOBAL.value
+SET_GLOBAL = OpCode.SET_GLOBAL.value
+GET_UPVALUE = OpCode.GET_UPVALUE.value
+SET_UPVALUE = OpCode.SET_UPVALUE.value
+GET_PROPERTY = OpCode.GET_PROPERTY.value
+SET_PROPERTY = OpCode.SET_PROPERTY.value
+PARTIAL = OpCode.PARTIAL.value
+GET_INDEX = OpCode.GET_INDEX.value
+SET_INDEX = OpCode.SET_INDEX.value
+GET_SUPER = OpCode.GET_SUPER.value
+EQUAL = OpCode.EQUAL.value
+NOT_EQUAL = OpCode.NOT_EQUAL.value
+GREATER = OpCode.GREATER.value
+GREATER_EQUAL = OpCode.GREATER_EQUAL.value
+LESS = OpCode.LESS.value
+LESS_EQUAL = OpCode.LESS_EQUAL.value
+ADD = OpCode.ADD.value
+SUBTRACT = OpCode.SUBTRACT.value
+MULTIPLY = OpCode.MULTIPLY.value
+DIVIDE = OpCode.DIVIDE.value
+FLOOR_DIVIDE = OpCode.FLOOR_DIVIDE.value
+MODULO = OpCode.MODULO.value
+NOT = OpCode.NOT.value
+NEGATE = OpCode.NEGATE.value
+JUMP = OpCode.JUMP.value
+JUMP_IF_FALSE = OpCode.JUMP_IF_FALSE.value
+JUMP_IF_TRUE_OR_POP = OpCode.JUMP_IF_TRUE_OR_POP.value
+JUMP_IF_FALSE_OR_POP = OpCode.JUMP_IF_FALSE_OR_POP.value
+CALL = OpCode.CALL.value
+INVOKE = OpCode.INVOKE.value
+SUPER_INVOKE = OpCode.SUPER_INVOKE.value
+CLOSURE = OpCode.CLOSURE.value
+CLOSE_UPVALUE = OpCode.CLOSE_UPVALUE.value
+RETURN = OpCode.RETURN.value
+CLASS = OpCode.CLASS.value
+INHERIT = OpCode.INHERIT.value
+METHOD = OpCode.METHOD.value
+BUILD_LIST = OpCode.BUILD_LIST.value
+BUILD_MAP = OpCode.BUILD_MAP.value
+GET_ITER = OpCode.GET_ITER.value
+FOR_ITER = OpCode.FOR_ITER.value
+RANGE = OpCode.RANGE.value
+
+# FOR_ITER でイテレータが終わったことを表す
+DONE = object()
+
+
+class Upvalue:
+    """
+    クロージャが捕捉した変数。
+    スコープが生きている間はVMのスタックを指し、閉じられると自分用の1要素のリストを指す。
+    """
+    __slots__ = ("cell", "index")
+
+    def __init__(self, cell: list, index: int):
+        self.cell = cell
+        self.index = index
+
+
+class Closure(Callable):
+    def __init__(self, proto: FunctionProto, upvalues: list[Upvalue]):
+        self.proto = proto
+        self.upvalues = upvalues
+
+    def arity(self) -> int:
+        return self.proto.arity
+
+    def call(self, interpreter, arguments: list):
+        return interpreter.call_function(self, None, arguments)
+
+    def call_method(self, interpreter, this, arguments: list):
+        return interpreter.call_function(self, this, arguments)
+
+    def bind(self, instance):
+        return BoundMethod(instance, self)
+
+    def __str__(self):
+        name = self.proto.name
+        return f"<fun {name.lexeme}>" if name else "<lambda>"
+
+
+class BoundMethod(Callable):
+    def __init__(self, receiver: Instance, method: Closure):
+        self.receiver = receiver
+        self.method = method
+
+    def arity(self) -> int:
+        return self.method.arity()
+
+    def call(self, interpreter, arguments: list):
+        return interpreter.call_function(self.method, self.receiver, arguments)
+
+    def __str__(self):
+        return str(self.method)
+
+
+class CallFrame:
+    __slots__ = ("closure", "ip", "base")
+
+    def __init__(self, closure: Closure, base: int):
+        self.closure = closure
+        self.ip = 0
+        # スタック上のスロット0(レシーバ)の位置。直前には呼び出し対象が置かれる
+        self.base = base
+
+
+class VM(Interpreter):
+    "Compilerが出力したバイトコードをスタックマシンで実行するエンジン"
+
+    def __init__(self, error_reporter: ErrorReporter):
+        super().__init__(error_reporter)
+        self.stack: list = []
+        self.frames: list[CallFrame] = []
+        self.open_upvalues: dict[int, Upvalue] = {}
+
+    def prepare(self, statements: list[Stmt]):
+        proto = Compiler().compile(statements)
+
+        def program():
+            self.call_function(Closure(proto, []), None, [])
+        return program
+
+    def reset(self):
+        super().reset()
+        self.stack.clear()
+        self.frames.clear()
+        self.open_upvalues.clear()
+
+    def call_function(self, closure: Closure, receiver, arguments: list):
+        "ネイティブ関数などPython側から1lの関数を呼び出す"
+        stack = self.stack
+        stack.append(closure)
+        stack.append(receiver)
+        stack.extend(arguments)
+        depth = len(self.frames)
+        self.frames.append(CallFrame(closure, len(stack) - len(arguments) - 1))
+        try:
+            return self.run(depth)
+        except RecursionError:
+            # ネイティブ関数と1lの関数が交互に呼び合い、Pythonの再帰の上限に達した
+            raise NativeError("Stack overflow.") from None
+
+    def capture_upvalue(self, index: int) -> Upvalue:
+        upvalue = self.open_upvalues.get(index)
+        if upvalue is None:
+            upvalue = Upvalue(self.stack, index)
+            self.open_upvalues[index] = upvalue
+        return upvalue
+
+    def close_upvalues(self, last: int):
+        stack = self.stack
+        for index in [i for i in self.open_upvalues if i >= last]:
+            upvalue = self.open_upvalues.pop(index)
+            upvalue.cell = [stack[index]]
+            upvalue.index = 0
+
+    def run(self, exit_depth: int):
+        stack = self.stack
+        frames = self.frames
+        globals = self.globals.variables
+        push = stack.append
+        pop = stack.pop
+
+        frame = frames[-1]
+        closure = frame.closure
+        proto = closure.proto
+        code = proto.code
+        constants = proto.constants
+        tokens = proto.tokens
+        base = frame.base
+        ip = frame.ip
+
+        # よく実行される命令ほど前に置く
+        while True:
+            op = code[ip]
+            ip += 1
+
+            if op == GET_LOCAL:
+                push(stack[base + code[ip]])
+                ip += 1
+
+            elif op == SET_LOCAL:
+                stack[base + code[ip]] = stack[-1]
+                ip += 1
+
+            elif op == CONSTANT:
+                push(constants[code[ip]])
+                ip += 1
+
+            elif op == POP:
+                pop()
+
+            elif op == JUMP_IF_FALSE:
+                value = pop()
+                if value is False or value is None or \
+                        (value is not True and not is_truthy(value)):
+                    ip = code[ip]
+                else:
+                    ip += 1
+
+            elif op == JUMP:
+                ip = code[ip]
+
+            elif op == GET_GLOBAL:
+                name = constants[code[ip]]
+                try:
+                    push(globals[name])
+                except KeyError:
+                    raise InterpretError(
+                        tokens[ip],
+                        f"Undefined variable: '{name}'") from None
+                ip += 1
+
+            elif op == GET_UPVALUE:
+                upvalue = closure.upvalues[code[ip]]
+                push(upvalue.cell[upvalue.index])
+                ip += 1
+
+            elif op == SET_UPVALUE:
+                upvalue = closure.upvalues[code[ip]]
+                upvalue.cell[upvalue.index] = stack[-1]
+                ip += 1
+
+            elif op == ADD:
+                right = pop()
+                left = stack[-1]
+                if isinstance(left, NUMERIC) and isinstance(right, NUMERIC):
+                    stack[-1] = left + right
+                elif isinstance(left, list) and isinstance(right, list):
+                    stack[-1] = left + right
+                elif isinstance(left, dict) and isinstance(right, dict):
+                    stack[-1] = {**left, **right}
+                else:
+                    stack[-1] = concat(left, right)
+
+            elif op == LESS:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, NUMERIC)
+                        and isinstance(right, NUMERIC)):
+                    raise InterpretError(tokens[ip - 1],
+                                         "Operands must be numbers")
+                stack[-1] = left < right
+
+            elif op == SUBTRACT:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, NUMERIC)
+                        and isinstance(right, NUMERIC)):
+                    raise InterpretError(tokens[ip - 1],
+                                         "Operands must be numbers")
+                stack[-1] = left - right
+
+            elif op == FOR_ITER:
+                value = next(stack[base + code[ip]], DONE)
+                if value is DONE:
+                    ip = code[ip + 1]
+                else:
+                    push(value)
+                    ip += 2
+
+            elif op == CALL:
+                argc = code[ip]
+                ip += 1
+                callee_base = len(stack) - argc - 1
+                callee = stack[callee_base - 1]
+
+                # 束縛済みメソッドと部分適用は展開してから呼び出す
+                while isinstance(callee, (BoundMethod, Partial)):
+                    if isinstance(callee, BoundMethod):
+                        stack[callee_base] = callee.receiver
+                        callee = callee.method
+                        continue
+                    if argc != (expected := callee.arity()):
+                        raise InterpretError(
+                            tokens[ip - 1],
+                            f"Expected {expected} arguments but got {argc}.")
+                    stack.insert(callee_base + 1, callee.arg1)
+                    argc += 1
+                    callee = callee.function
+
+                if isinstance(callee, Klass):
+                    instance = Instance(callee)
+                    stack[callee_base] = instance
+                    callee = callee.initializer
+                    if callee is None:
+                        if argc != 0:
+                            raise InterpretError(
+                                tokens[ip - 1],
+                                f"Expected 0 arguments but got {argc}.")
+                        del stack[callee_base - 1:]
+                        push(instance)
+                        continue
+
+                if isinstance(callee, Closure):
+                    if argc != callee.proto.arity:
+                        raise InterpretError(
+                            tokens[ip - 1],
+                            f"Expected {callee.proto.arity} arguments"
+                            f" but got {argc}.")
+                    if code[ip] == RETURN:
+                        # 末尾呼び出し: 呼び出し元のフレームを再利用する
+                        if self.open_upvalues:
+                            self.close_upvalues(base)
+                        del stack[base - 1:callee_base - 1]
+                        frame.closure = callee
+                    else:
+                        if len(frames) >= self.max_depth:
+                            raise InterpretError(tokens[ip - 1],
+                                                 "Stack overflow.")
+                        frame.ip = ip
+                        frame = CallFrame(callee, callee_base)
+                        frames.append(frame)
+                        base = callee_base
+                    closure = callee
+                    proto = closure.proto
+                    code = proto.code
+                    constants = proto.constants
+                    tokens = proto.tokens
+                    ip = 0
+
+                elif isinstance(callee, Callable):
+                    if argc != (expected := callee.arity()):
+                        raise InterpretError(
+                            tokens[ip - 1],
+                            f"Expected {expected} arguments but got {argc}.")
+                    arguments = stack[callee_base + 1:]
+                    del stack[callee_base - 1:]
+                    try:
+                        push(callee.call(self, arguments))
+                    except NativeError as e:
+                        raise InterpretError(tokens[ip - 1],
+                                             e.message) from None
+
+                else:
+                    raise InterpretError(
+                        tokens[ip - 1],
+                        "Can only callable functions and classes.")
+
+            elif op == RETURN:
+                result = pop()
+                if self.open_upvalues:
+                    self.close_upvalues(base)
+                del stack[base - 1:]
+                frames.pop()
+                if len(frames) == exit_depth:
+                    return result
+                push(result)
+
+                frame = frames[-1]
+                closure = frame.closure
+                proto = closure.proto
+                code = proto.code
+                constants = proto.constants
+                tokens = proto.tokens
+                base = frame.base
+                ip = frame.ip
+
+            elif op == INVOKE:
+                # [obj] -> [呼び出し対象, レシーバ]
+                object = stack[-1]
+                if isinstance(object, Instance):
+                    cache = constants[code[ip]]
+                    method = cache.lookup(object.shape)
+                    if method is None:
+                        # フィールドの関数、またはエラー
+                        stack[-1] = object.get(cache.name)
+                        push(None)
+                    else:
+                        stack[-1] = method
+                        push(object)
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+
+            elif op == GET_PROPERTY:
+                object = stack[-1]
+                if isinstance(object, Instance):
+                    cache = constants[code[ip]]
+                    if object.shape is cache.shape:
+                        stack[-1] = object.values[cache.slot]
+                    else:
+                        stack[-1] = cache.get(object)
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+
+            elif op == SET_PROPERTY:
+                value = pop()
+                object = stack[-1]
+                match object:
+                    case list():
+                        object.set(constants[code[ip]].name, value)
+                    case dict():
+                        value = None
+                    case Instance():
+                        constants[code[ip]].set(object, value)
+                    case _:
+                        raise InterpretError(
+                            tokens[ip], "Only instances have fields.")
+                stack[-1] = value
+                ip += 1
+
+            elif op == EQUAL or op == NOT_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if left is None:
+                    equal = right is None
+                    stack[-1] = equal if op == EQUAL else not equal
+                elif op == EQUAL:
+                    stack[-1] = left == right
+                else:
+                    stack[-1] = left != right
+
+            elif op == LESS_EQUAL or op == GREATER or op == GREATER_EQUAL \
+                    or op == MULTIPLY or op == DIVIDE or op == MODULO:
+                right = pop()
+                left = stack[-1]
+                if not (isinstance(left, NUMERIC)
+                        and isinstance(right, NUMERIC)):
+                    raise InterpretError(tokens[ip - 1],
+                                         "Operands must be numbers")
+                if op == LESS_EQUAL:
+                    stack[-1] = left <= right
+                elif op == GREATER:
+                    stack[-1] = left > right
+                elif op == GREATER_EQUAL:
+                    stack[-1] = left >= right
+                elif op == MULTIPLY:
+                    stack[-1] = left * right
+                elif op == DIVIDE:
+                    stack[-1] = left / right
+                else:
+                    stack[-1] = left % right
+
+            elif op == NIL:
+                push(None)
+
+            elif op == TRUE:
+                push(True)
+
+            elif op == FALSE:
+                push(False)
+
+            elif op == SET_GLOBAL:
+                name = constants[code[ip]]
+                if name not in globals and not globals.defines(name):
+                    raise InterpretError(
+                        tokens[ip], f"Undefined variable: '{name}'")
+                globals[name] = stack[-1]
+                ip += 1
+
+            elif op == DEFINE_GLOBAL:
+                globals[constants[code[ip]]] = pop()
+                ip += 1
+
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if is_truthy(stack[-1]):
+                    ip = code[ip]
+                else:
+                    pop()
+                    ip += 1
+
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if not is_truthy(stack[-1]):
+                    ip = code[ip]
+                else:
+                    pop()
+                    ip += 1
+
+            elif op == PARTIAL:
+                function = pop()
+                invocant = stack[-1]
+                if function is not None and isinstance(function, Callable):
+                    if function.arity() < 1:
+                        raise InterpretError(
+                            tokens[ip - 1],
+                            "Callable must have at least 1 argument")
+                    stack[-1] = Partial(function, invocant)
+                else:
+                    raise InterpretError(
+                        tokens[ip - 1],
+                        "Neither instance property nor callable")
+
+            elif op == GET_INDEX:
+                index = pop()
+                stack[-1] = stack[-1][index]
+
+            elif op == SET_INDEX:
+                value = pop()
+                index = pop()
+                stack[-1][index] = value
+                stack[-1] = value
+
+            elif op == FLOOR_DIVIDE:
+                right = pop()
+                stack[-1] = stack[-1] // right
+
+            elif op == NOT:
+                stack[-1] = not is_truthy(stack[-1])
+
+            elif op == NEGATE:
+                if not isinstance(stack[-1], NUMERIC):
+                    raise InterpretError(tokens[ip - 1],
+                                         "Operand must be number")
+                stack[-1] = - stack[-1]
+
+            elif op == CLOSURE:
+                function = constants[code[ip]]
+                ip += 1
+                upvalues = []
+                for _ in range(function.upvalue_count):
+                    if code[ip]:
+                        upvalues.append(
+                            self.capture_upvalue(base + code[ip + 1]))
+                    else:
+                        upvalues.append(closure.upvalues[code[ip + 1]])
+                    ip += 2
+                push(Closure(function, upvalues))
+
+            elif op == CLOSE_UPVALUE:
+                self.close_upvalues(len(stack) - 1)
+                pop()
+
+            elif op == SUPER_INVOKE or op == GET_SUPER:
+                # [this, superclass] -> [メソッド, this] または [束縛済みメソッド]
+                superclass = pop()
+                cache = constants[code[ip]]
+                name = cache.name
+                method = cache.lookup(superclass.shape)
+                if method is None:
+                    raise InterpretError(
+                        name, f"Undefined property '{name.lexeme}'.")
+                if op == SUPER_INVOKE:
+                    push(stack[-1])
+                    stack[-2] = method
+                else:
+                    stack[-1] = method.bind(stack[-1])
+                ip += 1
+
+            elif op == CLASS:
+                push(Klass(constants[code[ip]], None, {}))
+                ip += 1
+
+            elif op == INHERIT:
+                klass = pop()
+                superclass = stack[-1]
+                if not isinstance(superclass, Klass):
+                    raise InterpretError(tokens[ip - 1],
+                                         "Superclass must be a class.")
+                klass.inherit(superclass)
+
+            elif op == METHOD:
+                method = pop()
+                stack[-1].define_method(constants[code[ip]], method)
+                ip += 1
+
+            elif op == BUILD_LIST:
+                count = code[ip]
+                ip += 1
+                elements = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                push(elements)
+
+            elif op == BUILD_MAP:
+                count = code[ip] * 2
+                ip += 1
+                elements = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                push({elements[i]: elements[i + 1]
+                      for i in range(0, count, 2)})
+
+            elif op == GET_ITER:
+                try:
+                    stack[-1] = iterate(stack[-1])
+                except NativeError as e:
+                    raise InterpretError(tokens[ip - 1], e.message) from None
+
+            elif op == RANGE:
+                step = pop()
+                stop = pop()
+                start = stack[-1]
+                if not (isinstance(start, NUMERIC)
+                        and isinstance(stop, NUMERIC)):
+                    raise InterpretError(tokens[ip - 1],
+                                         "Operands must be numbers")
+                stack[-1] = NumberRange(start, stop, step, bool(code[ip]))
+                ip += 1
+
+            else:
+                raise InterpretError(tokens[ip - 1], f"Unknown opcode {op}")